@@ -1,7 +1,11 @@
 import os
 import uvicorn
 import csv
+import functools
+import hashlib
+import asyncio
 import io
+import json
 import uuid
 import psycopg2
 import psycopg2.extras
@@ -11,21 +15,37 @@ import pytz
 from apscheduler.schedulers.background import BackgroundScheduler
 
 from fastapi import FastAPI, Request, Form, Depends, HTTPException, status, UploadFile, File
-from fastapi.responses import HTMLResponse, RedirectResponse, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from starlette.middleware.sessions import SessionMiddleware
+from pydantic import BaseModel, Field
+from typing import List, Optional
+from urllib.parse import quote_plus
 
 #  --- Local Imports ---
 import config
 from employees import users as static_users 
 from data import (
-    get_db_connection, fetch_attendance_for_today, fetch_all_employees, fetch_employee_by_email,
+    get_db_connection, get_db_pool, close_db_pool, get_db_pool_stats, run_db, shutdown_db_executor,
+    get_profile_cache_stats, fetch_job_runs, close_attendance_writer, get_attendance_writer_stats,
+    db_connection, claim_idempotency_key, fetch_idempotency_key, complete_idempotency_key, release_idempotency_key,
+    purge_expired_idempotency_keys,
+    fetch_attendance_for_today, fetch_all_employees, fetch_employee_by_email,
+    fetch_roster_attendance_status, fetch_daily_attendance_report, iter_daily_attendance_report,
+    iter_attendance_export, ATTENDANCE_EXPORT_COLUMNS, import_attendance_csv, add_manual_attendance_batch,
+    write_attendance_record, AttendanceConflict, record_offline_attendance, add_manual_attendance_record,
+    register_offline_device, fetch_offline_devices, fetch_offline_device, revoke_offline_device,
+    employee_email_exists, employee_name_exists, fetch_employee_photo,
+    create_employee, update_employee_fields, delete_employee_record,
     submit_employee_comment, get_employee_comments, get_unread_comments_for_hr, 
-    get_all_comments_for_hr, mark_comment_as_read, get_unread_comment_count
+    get_all_comments_for_hr, mark_comment_as_read, get_unread_comment_count, delete_comment
 )
-from services import calculate_working_days_and_leaves_for_employee, is_at_office, mark_leaves_for_absent_employees
-from schema import initialize_database_schema 
+from services import (
+    is_at_office, mark_leaves_for_absent_employees, offline_event_message, verify_offline_event_signature
+)
+from schema import initialize_database_schema, maintain_attendance_partitions
 
 # ===========================================================================
 # TIMEZONE CONFIGURATION
@@ -48,13 +68,23 @@ def get_ist_date():
 async def lifespan(app: FastAPI):
     print("Application startup...") 
     initialize_database_schema()
+    get_db_pool()  # Open the minimum number of pooled connections up front
     
-    # Initialize APScheduler for daily absence marking
+    # Initialize APScheduler for daily absence marking. Every worker schedules the jobs;
+    # run_scheduled_job (job_runs table + advisory lock) lets only one of them run each day's slot.
     scheduler = BackgroundScheduler()
     
-    # Schedule job to run every day at 8 PM IST (which is 2:30 PM UTC, but we'll use a simpler hour)
-    # The job will check for employees who haven't clocked in for 3+ days
-    scheduler.add_job(mark_leaves_for_absent_employees, 'cron', hour=14, minute=30, timezone='Asia/Kolkata')
+    # The job will check for employees who haven't clocked in for 3+ days (ABSENCE_MARK_TIME, IST)
+    scheduler.add_job(mark_leaves_for_absent_employees, 'cron', hour=config.ABSENCE_MARK_TIME.hour,
+                      minute=config.ABSENCE_MARK_TIME.minute, timezone='Asia/Kolkata')
+    # Catch up on days missed while the service was down (runs once, right after start)
+    scheduler.add_job(mark_leaves_for_absent_employees)
+    # Drop idempotency keys whose replay window has passed
+    scheduler.add_job(purge_expired_idempotency_keys, 'interval', hours=1)
+    # Keep monthly attendance partitions created ahead of time and retire expired ones
+    scheduler.add_job(maintain_attendance_partitions, 'cron', hour=1, minute=0, timezone='Asia/Kolkata')
+    # Also once right after start, in case the instance was asleep at 01:00
+    scheduler.add_job(maintain_attendance_partitions)
     
     try:
         scheduler.start()
@@ -67,6 +97,9 @@ async def lifespan(app: FastAPI):
     print("Application shutdown...")
     if scheduler.running:
         scheduler.shutdown()
+    close_attendance_writer()
+    shutdown_db_executor()
+    close_db_pool()
 
 
 # Set absolute paths for Render compatibility
@@ -84,6 +117,136 @@ app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
 
 # Jinja2 Templates setup
 templates = Jinja2Templates(directory=TEMPLATES_DIR)
+# Fresh key per rendered form, so a resubmitted form replays its first outcome
+templates.env.globals["new_idempotency_key"] = lambda: uuid.uuid4().hex
+
+# ===========================================================================
+# IDEMPOTENCY KEYS
+# ===========================================================================
+
+IDEMPOTENCY_KEY_HEADER = "Idempotency-Key"
+
+
+def _idempotency_request_hash(kwargs: dict) -> str:
+    """Fingerprint of a request's form fields, so a reused key with other data is refused."""
+    fields = {}
+    for name, value in kwargs.items():
+        if name in ("request", "db", "idempotency_key"):
+            continue
+        if isinstance(value, UploadFile):
+            value = [value.filename, value.size]
+        elif isinstance(value, BaseModel):
+            value = value.model_dump()
+        fields[name] = value
+    return hashlib.sha256(json.dumps(fields, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def retryable(response: Response) -> Response:
+    """
+    Mark a response that reports a transient failure (a database error) so @idempotent
+    releases its key instead of replaying the failure to every retry.
+    """
+    response.idempotency_retryable = True
+    return response
+
+
+def idempotent(form_redirect: str = None):
+    """
+    Make a POST endpoint replay its first outcome for retries that carry the same key
+    (an `Idempotency-Key` header or an `idempotency_key` form field) for the same user.
+
+    The endpoint must take `request`; form endpoints also take an `idempotency_key` form
+    parameter, and a returned dict is sent (and stored) as JSON. Requests without a key,
+    or without a session, run as usual. Successes and rule rejections (including
+    HTTPExceptions below 500) are stored and replayed until IDEMPOTENCY_KEY_TTL_SECONDS;
+    exceptions and responses marked `retryable` release the key so a retry runs again.
+    Key rows go through the endpoint's own `db` connection when it has one.
+
+    A retry arriving while the first request still runs gets 409, except on form
+    endpoints (`form_redirect` set): they wait up to IDEMPOTENCY_WAIT_SECONDS for the
+    first outcome and replay it, or redirect to `form_redirect` with an error.
+    """
+    def decorator(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            request = kwargs["request"]
+            key = request.headers.get(IDEMPOTENCY_KEY_HEADER) or kwargs.get("idempotency_key")
+            user_email = request.session.get("user_email")
+            if not key or not user_email:
+                return await endpoint(*args, **kwargs)
+            if len(key) > 255:
+                raise HTTPException(status_code=400, detail="Idempotency key is longer than 255 characters")
+
+            db = kwargs.get("db")
+
+            async def key_row(func, *func_args):
+                if db is not None:
+                    return await run_db(func, db, *func_args)
+
+                def borrowed():
+                    with db_connection() as conn:
+                        return func(conn, *func_args)
+                return await run_db(borrowed)
+
+            path = request.url.path
+            request_hash = _idempotency_request_hash(kwargs)
+            stored = await key_row(claim_idempotency_key, user_email, path, key, request_hash)
+            if stored is not None:
+                if stored["request_hash"] != request_hash:
+                    raise HTTPException(
+                        status_code=422, detail="Idempotency key was already used for a different request"
+                    )
+                if stored["status_code"] is None and form_redirect:
+                    stored = await _wait_for_idempotent_outcome(key_row, user_email, path, key)
+                if stored is None:
+                    return RedirectResponse(
+                        url=f"{form_redirect}?error={quote_plus('Your earlier submission failed, please try again')}",
+                        status_code=status.HTTP_303_SEE_OTHER
+                    )
+                if stored["status_code"] is None:
+                    if form_redirect:
+                        error = "Your earlier submission is still being processed, please refresh in a moment"
+                        return RedirectResponse(
+                            url=f"{form_redirect}?error={quote_plus(error)}", status_code=status.HTTP_303_SEE_OTHER
+                        )
+                    raise HTTPException(status_code=409, detail="A request with this idempotency key is still in progress")
+                return Response(content=stored["body"], status_code=stored["status_code"], headers=stored["headers"])
+
+            try:
+                response = await endpoint(*args, **kwargs)
+            except HTTPException as e:
+                if e.status_code >= 500:
+                    await key_row(release_idempotency_key, user_email, path, key)
+                    raise
+                response = JSONResponse({"detail": e.detail}, status_code=e.status_code, headers=e.headers)
+            except BaseException:
+                await key_row(release_idempotency_key, user_email, path, key)
+                raise
+            if not isinstance(response, Response):
+                response = JSONResponse(jsonable_encoder(response))
+            if isinstance(response, StreamingResponse) or getattr(response, "idempotency_retryable", False):
+                await key_row(release_idempotency_key, user_email, path, key)
+                return response
+            headers = {name: value for name, value in response.headers.items()
+                       if name not in ("content-length", "set-cookie")}
+            await key_row(complete_idempotency_key, user_email, path, key, response.status_code, headers, response.body)
+            return response
+
+        return wrapper
+    return decorator
+
+
+async def _wait_for_idempotent_outcome(key_row, user_email: str, path: str, key: str) -> Optional[dict]:
+    """Poll a key still in progress until it has an outcome, is released (None) or the wait runs out."""
+    deadline = asyncio.get_running_loop().time() + config.IDEMPOTENCY_WAIT_SECONDS
+    while True:
+        await asyncio.sleep(0.2)
+        stored = await key_row(fetch_idempotency_key, user_email, path, key)
+        if stored is None or stored["status_code"] is not None:
+            return stored
+        if asyncio.get_running_loop().time() >= deadline:
+            return stored
+
 
 @app.get("/", response_class=HTMLResponse, summary="Display login page")
 async def login_page(request: Request): 
@@ -97,7 +260,7 @@ async def handle_login(request: Request, email: str = Form(...), password: str =
     if email not in static_users:
         return RedirectResponse(url="/?error=Access+Denied:+Not+an+authorized+employee", status_code=status.HTTP_303_SEE_OTHER)
     
-    employee = fetch_employee_by_email(db, email)
+    employee = await run_db(fetch_employee_by_email, db, email)
     if employee and employee["password"] == password:
         request.session["user_email"] = email
         if email == config.HR_EMAIL:  
@@ -119,7 +282,7 @@ async def signup(
     if email not in static_users:
         return templates.TemplateResponse("login.html", {"request": request, "error": "Email not authorized. Contact HR."})
     
-    if fetch_employee_by_email(db, email):
+    if await run_db(fetch_employee_by_email, db, email):
         return templates.TemplateResponse("login.html", {"request": request, "error": "Email already registered"})
     
     user_data = static_users.get(email)
@@ -147,17 +310,12 @@ async def signup(
         salary = None
         bank_details = None
     
-    cursor = db.cursor()
-    cursor.execute(
-        """INSERT INTO employee_details 
-           (name, email, password, photo, phone, parent_phone, dob, gender, 
-            employee_number, aadhar, joining_date, native, address, job_role, pan_card, salary, bank_details)
-           VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)""",
-        (name, email, password, photo, phone, parent_phone, dob, gender,
-         employee_number, aadhar, joining_date, native, address, job_role, pan_card, salary, bank_details)
-    )
-    db.commit()
-    cursor.close()
+    await run_db(create_employee, db, {
+        "name": name, "email": email, "password": password, "photo": photo, "phone": phone,
+        "parent_phone": parent_phone, "dob": dob, "gender": gender, "employee_number": employee_number,
+        "aadhar": aadhar, "joining_date": joining_date, "native": native, "address": address,
+        "job_role": job_role, "pan_card": pan_card, "salary": salary, "bank_details": bank_details
+    })
     
     request.session["user_email"] = email
     return RedirectResponse(url="/report", status_code=status.HTTP_303_SEE_OTHER)
@@ -173,19 +331,19 @@ async def report(request: Request, period: str = "30", db = Depends(get_db_conne
     if user_email == config.HR_EMAIL:
         return RedirectResponse(url="/hr-management", status_code=status.HTTP_303_SEE_OTHER)
 
-    user_data = fetch_employee_by_email(db, user_email) or _build_user_from_static(user_email)
+    user_data = await run_db(fetch_employee_by_email, db, user_email) or _build_user_from_static(user_email)
     if not user_data:
         request.session.clear()
         return RedirectResponse(url="/", status_code=status.HTTP_303_SEE_OTHER)
 
-    records = fetch_attendance_for_today(db, user_email)
+    records = await run_db(fetch_attendance_for_today, db, user_email)
     sorted_records = sorted(records, key=lambda x:  x["event_time"], reverse=True)
 
     # Map period parameter to days
     period_map = {"30": 30, "180": 180, "365": 365}
     days = period_map.get(period, 30)
     
-    report_data, total_seconds = _build_report_for_user(db, user_email, days=days)
+    report_data, total_seconds = await run_db(_build_report_for_user, db, user_email, days=days)
     total_hours = total_seconds / 3600 if total_seconds else 0
 
     is_hr = user_email == config.HR_EMAIL
@@ -203,8 +361,8 @@ async def report(request: Request, period: str = "30", db = Depends(get_db_conne
     })
 
 @app.get("/download_report", summary="Download attendance report as CSV")
-async def download_report(request: Request, period: str = "30", db = Depends(get_db_connection)):
-    """Return a CSV file of the user's attendance report."""
+async def download_report(request: Request, period: str = "30"):
+    """Stream a CSV file of the user's attendance report."""
     user_email = request.session.get("user_email")
     if not user_email:
         return RedirectResponse(url="/", status_code=status.HTTP_303_SEE_OTHER)
@@ -213,16 +371,11 @@ async def download_report(request: Request, period: str = "30", db = Depends(get
     period_map = {"30": 30, "180": 180, "365": 365}
     days = period_map.get(period, 30)
     
-    report_data, _ = _build_report_for_user(db, user_email, days=days)
-
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(["Date", "Check In", "Check Out", "Total Hours Worked"])
-    for row in report_data:
-        writer.writerow([row.get("day"), row.get("check_in"), row.get("check_out"), row.get("total_hours")])
-
-    csv_content = output.getvalue()
-    output.close()
+    # The generator borrows its own pooled connection while the response streams
+    rows = (
+        [day["day"], day["check_in"], day["check_out"], day["total_hours"]]
+        for day in map(_format_report_day, iter_daily_attendance_report(user_email, get_ist_date() - timedelta(days=days)))
+    )
     
     period_label = f"{days} days"
     if days == 180:
@@ -233,9 +386,11 @@ async def download_report(request: Request, period: str = "30", db = Depends(get
         period_label = "1 month"
 
     filename = f"attendance_{user_email.replace('@', '_at_')}_{period_label.replace(' ', '_')}.csv"
-    return Response(content=csv_content, media_type="text/csv", headers={
-        "Content-Disposition":  f"attachment; filename={filename}"
-    })
+    return StreamingResponse(
+        _iter_csv(["Date", "Check In", "Check Out", "Total Hours Worked"], rows),
+        media_type="text/csv",
+        headers={"Content-Disposition":  f"attachment; filename={filename}"}
+    )
 
 @app.get("/dashboard", response_class=HTMLResponse, name="dashboard_view", summary="Display employee dashboard (profile view)")
 async def dashboard_view(request: Request, db = Depends(get_db_connection)):
@@ -244,7 +399,7 @@ async def dashboard_view(request: Request, db = Depends(get_db_connection)):
     if not user_email:
         return RedirectResponse(url="/", status_code=status.HTTP_303_SEE_OTHER)
 
-    user = fetch_employee_by_email(db, user_email) or _build_user_from_static(user_email)
+    user = await run_db(fetch_employee_by_email, db, user_email) or _build_user_from_static(user_email)
     if not user:
         request.session.clear()
         return RedirectResponse(url="/", status_code=status.HTTP_303_SEE_OTHER)
@@ -259,7 +414,36 @@ async def dashboard_view(request: Request, db = Depends(get_db_connection)):
         "success": request.query_params.get("success")
     })
 
+# Messages for actions today's attendance already rules out
+ATTENDANCE_CONFLICT_ERRORS = {
+    AttendanceConflict.ALREADY_CHECKED_IN: "Already checked in today",
+    AttendanceConflict.NOT_CHECKED_IN: "Must check-in before checking out",
+    AttendanceConflict.ALREADY_CHECKED_OUT: "Already checked out today",
+}
+
+def _attendance_rule_error(action: str, latitude: float, longitude: float, current_time: time):
+    """Why a check-in/check-out is not allowed from here at this IST time, or None (no database access)."""
+    try:
+        if not is_at_office(float(latitude), float(longitude)):
+            return f"Location outside office bounds: {latitude:.6f}, {longitude:.6f}"
+    except ValueError:
+        return "Invalid location data. Please enable location services"
+
+    if action == "check-in":
+        is_morning = config.CHECKIN_MORNING_START <= current_time <= config.CHECKIN_MORNING_END
+        is_afternoon = config.CHECKIN_AFTERNOON_START <= current_time <= config.CHECKIN_AFTERNOON_END
+        if not (is_morning or is_afternoon):
+            return (f"Check-in only allowed between {config.CHECKIN_MORNING_START} and {config.CHECKIN_MORNING_END} "
+                    f"or between {config.CHECKIN_AFTERNOON_START} and {config.CHECKIN_AFTERNOON_END}")
+    elif action == "check-out":
+        if current_time < config.CHECKOUT_MIN_TIME:
+            return f"Check-out only allowed after {config.CHECKOUT_MIN_TIME}"
+    else:
+        return "Invalid action"
+    return None
+
 @app.post("/attendance", summary="Handle check-in/check-out actions")
+@idempotent(form_redirect="/report")
 async def handle_attendance(
     request: Request,
     action: str = Form(...),
@@ -267,113 +451,273 @@ async def handle_attendance(
     longitude: float = Form(...),
     comment: str = Form(None),
     timezone_offset: int = Form(default=330),  # Default IST (UTC+5:30 = 330 minutes)
-    db = Depends(get_db_connection)
+    idempotency_key: str = Form(None),
 ):
-    """Processes check-in and check-out requests."""
+    """Processes check-in and check-out form posts (see /api/attendance for the JSON variant)."""
     user_email = request.session.get("user_email")
     if not user_email:
         return RedirectResponse(url="/", status_code=status.HTTP_303_SEE_OTHER)
 
-    try:
-        if not is_at_office(float(latitude), float(longitude)):
-            return RedirectResponse(
-                url=f"/report?error=Location+outside+office+bounds: +{latitude:.6f},+{longitude:.6f}",
-                status_code=status.HTTP_303_SEE_OTHER
-            )
-    except ValueError:
-        return RedirectResponse(
-            url="/report?error=Invalid+location+data. +Please+enable+location+services",
-            status_code=status.HTTP_303_SEE_OTHER
-        )
-
     # Get current time in IST
     now_ist = get_ist_now()
-    current_time = now_ist.time()
-    today = now_ist.date()
-    
+
     # Store as UTC for database (convert IST to UTC)
     now_utc = datetime.now(pytz.UTC)
-    
-    cursor = db.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    cursor.execute(
-        """
-        SELECT * FROM attendance 
-        WHERE user_email = %s AND DATE(event_time AT TIME ZONE 'Asia/Kolkata') = %s
-        ORDER BY event_time DESC
-        """,
-        (user_email, today)
-    )
-    todays_records = cursor.fetchall()
-    cursor.close()
-
-    if action == "check-in":
-        is_morning = config.CHECKIN_MORNING_START <= current_time <= config.CHECKIN_MORNING_END
-        is_afternoon = config.CHECKIN_AFTERNOON_START <= current_time <= config.CHECKIN_AFTERNOON_END
-
-        if not (is_morning or is_afternoon):
-            return RedirectResponse(
-                url=f"/report?error=Check-in+only+allowed+between+{config.CHECKIN_MORNING_START}+and+{config.CHECKIN_MORNING_END}+or+between+{config.CHECKIN_AFTERNOON_START}+and+{config.CHECKIN_AFTERNOON_END}",
-                status_code=status.HTTP_303_SEE_OTHER
-            )
-
-        if any(r['action'] == 'check-in' for r in todays_records):
-            return RedirectResponse(
-                url="/report?error=Already+checked+in+today",
-                status_code=status.HTTP_303_SEE_OTHER
-            )
-
-    elif action == "check-out":  
-        if current_time < config.CHECKOUT_MIN_TIME:
-            return RedirectResponse(
-                url=f"/report?error=Check-out+only+allowed+after+{config.CHECKOUT_MIN_TIME}",
-                status_code=status.HTTP_303_SEE_OTHER
-            )
-
-        if not any(r['action'] == 'check-in' for r in todays_records):
-            return RedirectResponse(
-                url="/report?error=Must+check-in+before+checking+out",
-                status_code=status.HTTP_303_SEE_OTHER
-            )
 
-        if any(r['action'] == 'check-out' for r in todays_records):
-            return RedirectResponse(
-                url="/report? error=Already+checked+out+today",
-                status_code=status.HTTP_303_SEE_OTHER
-            )
+    error = _attendance_rule_error(action, latitude, longitude, now_ist.time())
+    if error:
+        return RedirectResponse(url=f"/report?error={quote_plus(error)}", status_code=status.HTTP_303_SEE_OTHER)
 
+    # Whether today already has this action is decided by the insert itself, atomically.
+    # No connection is held while waiting: the write borrows one (or joins a group commit).
     try:
-        cursor = db.cursor()
-        cursor.execute(
-            """
-            INSERT INTO attendance 
-            (user_email, action, event_time, latitude, longitude, location_text, comment)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-            """,
-            (user_email, action, now_utc, latitude, longitude, f"{latitude:.6f}, {longitude:.6f}", comment if comment else None)
+        await write_attendance_record(
+            user_email, action, now_utc, latitude, longitude,
+            f"{latitude:.6f}, {longitude:.6f}", comment if comment else None
         )
-        db.commit()
-        cursor.close()
-
-        if action == "check-in":  
-            working_days, _, _ = calculate_working_days_and_leaves_for_employee(user_email, today)
-            cursor = db.cursor()
-            cursor.execute(
-                "UPDATE employee_details SET total_working = %s WHERE email = %s",
-                (working_days, user_email)
-            )
-            db.commit()
-            cursor.close()
 
         success_msg = f"Successfully+{action.replace('-', '+')}+at+{now_ist.strftime('%I:%M+%p')}"
         return RedirectResponse(
             url=f"/report?success={success_msg}",
             status_code=status.HTTP_303_SEE_OTHER
         )
-    except Exception as e:  
+    except AttendanceConflict as e:
         return RedirectResponse(
+            url=f"/report?error={quote_plus(ATTENDANCE_CONFLICT_ERRORS[e.reason])}",
+            status_code=status.HTTP_303_SEE_OTHER
+        )
+    except Exception as e:  
+        return retryable(RedirectResponse(
             url=f"/report?error=Database+error: +{str(e)}",
             status_code=status.HTTP_303_SEE_OTHER
+        ))
+
+class AttendanceActionRequest(BaseModel):
+    """A check-in or check-out, with the same fields as the /attendance form."""
+    action: str
+    latitude: float
+    longitude: float
+    comment: Optional[str] = None
+
+@app.post("/api/attendance", summary="Check in or out and get today's status as JSON")
+@idempotent()
+async def attendance_api(request: Request, body: AttendanceActionRequest):
+    """
+    JSON variant of /attendance for pages that update in place: the same rules and the
+    same single write, answered with the new record and today's status instead of a
+    redirect to /report. Errors are 400 (not allowed now or here) and 409 (already done today).
+    """
+    user_email = request.session.get("user_email")
+    if not user_email:
+        raise HTTPException(status_code=401, detail="Login required")
+
+    now_ist = get_ist_now()
+    now_utc = datetime.now(pytz.UTC)
+
+    error = _attendance_rule_error(body.action, body.latitude, body.longitude, now_ist.time())
+    if error:
+        raise HTTPException(status_code=400, detail=error)
+
+    location_text = f"{body.latitude:.6f}, {body.longitude:.6f}"
+    comment = body.comment or None
+    try:
+        record = await write_attendance_record(
+            user_email, body.action, now_utc, body.latitude, body.longitude, location_text, comment
         )
+    except AttendanceConflict as e:
+        raise HTTPException(status_code=409, detail=ATTENDANCE_CONFLICT_ERRORS[e.reason])
+    except psycopg2.Error as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {e}")
+
+    day = record["day"]
+    checked_in = day["first_check_in"] is not None
+    checked_out = day["last_check_out"] is not None
+    return {
+        "message": f"Successfully {body.action.replace('-', ' ')} at {now_ist.strftime('%I:%M %p')}",
+        "record": {
+            "id": record["id"],
+            "action": body.action,
+            "event_time": pytz.UTC.localize(record["event_time"]).astimezone(IST).isoformat(),
+            "work_date": record["work_date"].isoformat(),
+            "location_text": location_text,
+            "comment": comment,
+        },
+        "today": {
+            **_format_report_day(day),
+            "checked_in": checked_in,
+            "checked_out": checked_out,
+            "worked_seconds": day["worked_seconds"],
+            "next_action": "check-out" if checked_in and not checked_out else None,
+        },
+    }
+
+# Offline events can be for an earlier day than today
+OFFLINE_CONFLICT_ERRORS = {
+    AttendanceConflict.ALREADY_CHECKED_IN: "Already checked in that day",
+    AttendanceConflict.NOT_CHECKED_IN: "Must check-in before checking out",
+    AttendanceConflict.ALREADY_CHECKED_OUT: "Already checked out that day",
+}
+
+class OfflineDeviceRegistration(BaseModel):
+    label: Optional[str] = Field(None, max_length=100)  # e.g. "Pixel 7", shown in the device list
+
+class OfflineAttendanceEvent(BaseModel):
+    """A check-in or check-out captured on a device while offline, signed with the device's key."""
+    event_id: str = Field(..., min_length=1, max_length=100)  # Unique per employee, chosen by the device
+    action: str
+    captured_at: str  # Device time, ISO 8601 with UTC offset, exactly as signed
+    latitude: float
+    longitude: float
+    comment: Optional[str] = None
+    signature: str  # Hex HMAC-SHA256 of offline_event_message(...) with the device's signing key
+
+class OfflineAttendanceBatch(BaseModel):
+    device_id: str = Field(..., min_length=1, max_length=64)  # From /api/attendance/offline-devices
+    events: List[OfflineAttendanceEvent] = Field(..., min_length=1, max_length=500)
+
+def _offline_device_times(device) -> dict:
+    """A device's timestamps (naive UTC in the database) as IST ISO strings, None when unset."""
+    return {
+        name: pytz.UTC.localize(device[name]).astimezone(IST).isoformat() if device[name] else None
+        for name in ("created_at", "expires_at", "revoked_at", "last_synced_at") if name in device
+    }
+
+@app.post("/api/attendance/offline-devices", summary="Register a device for offline check-ins")
+async def register_offline_attendance_device(
+    request: Request, registration: OfflineDeviceRegistration, db = Depends(get_db_connection)
+):
+    """
+    Give the logged-in employee's device its own random key for signing queued offline
+    events. The key is returned only here; it expires after OFFLINE_DEVICE_KEY_TTL_DAYS
+    and can be revoked at any time, each device independently.
+    """
+    user_email = request.session.get("user_email")
+    if not user_email:
+        raise HTTPException(status_code=401, detail="Login required")
+
+    device = await run_db(register_offline_device, db, user_email, registration.label)
+    print(f"Offline device {device['device_id']} registered for {user_email}")
+    return {
+        "device_id": device["device_id"],
+        "key": device["signing_key"],
+        **_offline_device_times(device),
+        "algorithm": "HMAC-SHA256",
+        "message": "event_id|action|captured_at|latitude|longitude (coordinates with 6 decimals)",
+    }
+
+@app.get("/api/attendance/offline-devices", summary="List the devices registered for offline check-ins")
+async def list_offline_attendance_devices(request: Request, employee_email: str = None, db = Depends(get_db_connection)):
+    """The logged-in employee's offline devices (HR may pass `employee_email`), without keys."""
+    user_email = request.session.get("user_email")
+    if not user_email:
+        raise HTTPException(status_code=401, detail="Login required")
+    if employee_email and employee_email != user_email and user_email != config.HR_EMAIL:
+        raise HTTPException(status_code=403, detail="HR access required")
+
+    devices = await run_db(fetch_offline_devices, db, employee_email or user_email)
+    return [{"device_id": d["device_id"], "label": d["label"], **_offline_device_times(d)} for d in devices]
+
+@app.delete("/api/attendance/offline-devices/{device_id}", summary="Revoke a device's offline signing key")
+async def revoke_offline_attendance_device(request: Request, device_id: str, db = Depends(get_db_connection)):
+    """Revoke one of the logged-in employee's devices (HR: anyone's); its unsynced events are refused."""
+    user_email = request.session.get("user_email")
+    if not user_email:
+        raise HTTPException(status_code=401, detail="Login required")
+
+    owner = None if user_email == config.HR_EMAIL else user_email
+    if not await run_db(revoke_offline_device, db, device_id, owner):
+        raise HTTPException(status_code=404, detail="Device not found")
+    print(f"Offline device {device_id} revoked by {user_email}")
+    return {"device_id": device_id, "revoked": True}
+
+@app.post("/api/attendance/offline-sync", summary="Upload check-ins captured offline")
+async def offline_attendance_sync(request: Request, batch: OfflineAttendanceBatch, db = Depends(get_db_connection)):
+    """
+    Sync a device's queue of offline check-ins/check-outs in one call.
+
+    The batch names the registered device that signed it; an unknown or revoked device
+    is refused with 403. Every event is checked in one pass (signature with the device's
+    key, device time within the key's lifetime, office geofence and the check-in/check-out
+    windows at its IST time), then the valid ones are written in one transaction, oldest
+    first. Each event gets its own result: accepted, duplicate (already synced, e.g. a
+    re-uploaded queue) or rejected with the reason. An accepted check-in for a day already
+    marked absent takes back that leave (`leave_days_reversed`).
+    """
+    user_email = request.session.get("user_email")
+    if not user_email:
+        raise HTTPException(status_code=401, detail="Login required")
+
+    device = await run_db(fetch_offline_device, db, user_email, batch.device_id)
+    if device is None:
+        raise HTTPException(status_code=403, detail="Unknown offline device; register it first")
+    if device["revoked_at"] is not None:
+        raise HTTPException(status_code=403, detail="This device's offline key was revoked")
+
+    skew = timedelta(seconds=config.OFFLINE_SYNC_MAX_CLOCK_SKEW_SECONDS)
+    now_utc = datetime.now(pytz.UTC)
+    earliest = now_utc - timedelta(hours=config.OFFLINE_SYNC_MAX_AGE_HOURS)
+    latest = now_utc + skew
+    # A device's key only vouches for events captured while it was valid
+    registered_at = pytz.UTC.localize(device["created_at"]) - skew
+    expires_at = pytz.UTC.localize(device["expires_at"])
+
+    rejected, valid, seen = {}, [], set()
+    for index, event in enumerate(batch.events):
+        if event.event_id in seen:
+            rejected[index] = "event_id repeated in this batch"
+            continue
+        seen.add(event.event_id)
+
+        message = offline_event_message(event.event_id, event.action, event.captured_at, event.latitude, event.longitude)
+        if not verify_offline_event_signature(device["signing_key"], message, event.signature):
+            rejected[index] = "Invalid signature"
+            continue
+        try:
+            captured_at = datetime.fromisoformat(event.captured_at)
+        except ValueError:
+            rejected[index] = "Invalid captured_at (expected ISO 8601)"
+            continue
+        if captured_at.tzinfo is None:
+            reason = "captured_at needs a UTC offset"
+        elif captured_at > latest:
+            reason = "captured_at is in the future"
+        elif captured_at < earliest:
+            reason = f"captured_at is more than {config.OFFLINE_SYNC_MAX_AGE_HOURS} hours old"
+        elif captured_at < registered_at:
+            reason = "captured_at is before this device was registered"
+        elif captured_at > expires_at:
+            reason = "captured_at is after this device's key expired"
+        else:
+            reason = _attendance_rule_error(
+                event.action, event.latitude, event.longitude, captured_at.astimezone(IST).time()
+            )
+        if reason:
+            rejected[index] = reason
+            continue
+        valid.append({
+            "event_id": event.event_id, "action": event.action, "event_time": captured_at,
+            "latitude": event.latitude, "longitude": event.longitude, "comment": event.comment or None,
+        })
+
+    written = await run_db(record_offline_attendance, db, user_email, device["device_id"], valid) if valid else []
+    written = {result["event_id"]: result for result in written}
+
+    results = []
+    for index, event in enumerate(batch.events):
+        if index in rejected:
+            result = {"status": "rejected", "reason": rejected[index], "record_id": None, "leave_days_reversed": 0}
+        else:
+            result = dict(written[event.event_id])
+            result["reason"] = OFFLINE_CONFLICT_ERRORS.get(result["reason"], result["reason"])
+        results.append({"index": index, "event_id": event.event_id, "status": result["status"],
+                        "reason": result["reason"], "record_id": result["record_id"],
+                        "leave_days_reversed": result["leave_days_reversed"]})
+
+    counts = {status_name: sum(1 for r in results if r["status"] == status_name)
+              for status_name in ("accepted", "duplicate", "rejected")}
+    print(f"Offline sync for {user_email}: {counts['accepted']} accepted, "
+          f"{counts['duplicate']} duplicate, {counts['rejected']} rejected")
+    return {**counts, "results": results}
 
 @app.get("/employees", response_class=HTMLResponse, name="employees_page", summary="Display employees list")
 async def employees_page(request: Request, db = Depends(get_db_connection)):
@@ -383,31 +727,7 @@ async def employees_page(request: Request, db = Depends(get_db_connection)):
         return RedirectResponse(url="/", status_code=status.HTTP_303_SEE_OTHER)
         
     is_hr = user_email == config.HR_EMAIL
-    all_employees = fetch_all_employees(db)
-    all_employees = [emp for emp in all_employees if emp.get("email") != config.HR_EMAIL]
-    
-    try:
-        cursor = db.cursor()
-        today = date.today()
-        for emp in all_employees:
-            email = emp.get("email")
-            if email:  
-                cursor.execute(
-                    "SELECT 1 FROM attendance WHERE user_email = %s AND DATE(event_time) = %s LIMIT 1",
-                    (email, today)
-                )
-                emp["present_today"] = bool(cursor.fetchone())
-                
-                if is_hr:
-                    static_data = static_users.get(email, {})
-                    emp["salary"] = static_data.get("salary", "Not Set")
-                    
-        cursor.close()
-    except Exception:  
-        for emp in all_employees:
-            emp["present_today"] = False
-            if is_hr:
-                emp["salary"] = None
+    all_employees = await run_db(_load_employee_list, db)
                 
     return templates.TemplateResponse("employee_list.html", {
         "request": request,
@@ -425,35 +745,7 @@ async def hr_management(request: Request, db = Depends(get_db_connection)):
     if user_email != config.HR_EMAIL:
         return RedirectResponse(url="/dashboard", status_code=status.HTTP_303_SEE_OTHER)
     
-    cursor = db.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    cursor.execute(
-        "SELECT * FROM employee_details WHERE email != %s ORDER BY name ASC",      
-        (config.HR_EMAIL,)
-    )
-    employees = cursor.fetchall()
-    
-    today = date.today()
-    for emp in employees:
-        email = emp.get("email")
-        if email: 
-            cursor.execute(
-                "SELECT 1 FROM attendance WHERE user_email = %s AND DATE(event_time) = %s LIMIT 1",
-                (email, today)
-            )
-            emp["present_today"] = bool(cursor.fetchone())
-            
-            # Fetch latest comment from employee
-            cursor.execute(
-                "SELECT comment FROM attendance WHERE user_email = %s AND comment IS NOT NULL ORDER BY event_time DESC LIMIT 1",
-                (email,)
-            )
-            comment_record = cursor.fetchone()
-            emp["last_comment"] = comment_record.get("comment") if comment_record else None
-        
-        static_data = static_users.get(emp['email'], {})
-        emp['salary'] = static_data.get('salary', 'Not Set')
-    
-    cursor.close()
+    employees = await run_db(_load_hr_roster, db)
     
     return templates.TemplateResponse("hr_management.html", {
         "request": request,
@@ -469,7 +761,7 @@ async def get_employee_api(email: str, request: Request, db = Depends(get_db_con
     if not user_email or user_email != config.HR_EMAIL:
         raise HTTPException(status_code=403, detail="Unauthorized")
     
-    employee = fetch_employee_by_email(db, email)
+    employee = await run_db(fetch_employee_by_email, db, email)
     if not employee:
         raise HTTPException(status_code=404, detail="Employee not found")
     
@@ -491,7 +783,101 @@ async def check_hr_access(request: Request):
     
     return employee
 
+@app.get("/api/hr/db-pool-stats", summary="Database connection pool statistics")
+async def db_pool_stats(request: Request):
+    """Expose connection pool usage (and attendance group-commit counters) for monitoring (HR only)."""
+    user_email = request.session.get("user_email")
+    if not user_email or user_email != config.HR_EMAIL:
+        raise HTTPException(status_code=403, detail="HR access required")
+    
+    return {**get_db_pool_stats(), "attendance_group_commit": get_attendance_writer_stats()}
+
+@app.get("/api/hr/attendance-export", summary="Export attendance for a date range as CSV")
+async def export_attendance(
+    request: Request,
+    start_date: date,
+    end_date: date,
+    employee_email: str = None,
+    columns: str = None,
+    compress: bool = False
+):
+    """
+    Stream all attendance between two IST dates straight from Postgres COPY (HR only).
+    `columns` is a comma-separated subset of ATTENDANCE_EXPORT_COLUMNS; `compress=true` gzips the CSV.
+    """
+    user_email = request.session.get("user_email")
+    if not user_email or user_email != config.HR_EMAIL:
+        raise HTTPException(status_code=403, detail="HR access required")
+
+    if end_date < start_date:
+        raise HTTPException(status_code=400, detail="end_date must not be before start_date")
+
+    column_list = [c.strip() for c in columns.split(",") if c.strip()] if columns else None
+    unknown = [c for c in column_list or [] if c not in ATTENDANCE_EXPORT_COLUMNS]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown columns: {', '.join(unknown)}. Allowed: {', '.join(ATTENDANCE_EXPORT_COLUMNS)}"
+        )
+
+    filename = f"attendance_{start_date.isoformat()}_{end_date.isoformat()}"
+    if employee_email:
+        filename += f"_{employee_email.replace('@', '_at_')}"
+    filename += ".csv.gz" if compress else ".csv"
+
+    return StreamingResponse(
+        iter_attendance_export(start_date, end_date, column_list, employee_email, compress),
+        media_type="application/gzip" if compress else "text/csv",
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+@app.post("/api/hr/attendance-import", summary="Bulk import attendance from CSV")
+async def import_attendance(request: Request, file: UploadFile = File(...), db = Depends(get_db_connection)):
+    """
+    Load a CSV of attendance events (HR only) in one transaction.
+    Columns: user_email, action, event_time (IST, YYYY-MM-DD HH:MM[:SS]) and optional location_text, comment.
+    Returns inserted/rejected counts and the reason for every rejected line.
+    """
+    user_email = request.session.get("user_email")
+    if not user_email or user_email != config.HR_EMAIL:
+        raise HTTPException(status_code=403, detail="HR access required")
+
+    try:
+        result = await run_db(import_attendance_csv, db, file.file)
+    except ValueError as err:
+        raise HTTPException(status_code=400, detail=str(err))
+    except psycopg2.DataError as err:
+        # Malformed CSV (e.g. wrong number of fields); Postgres names the offending line
+        raise HTTPException(
+            status_code=400,
+            detail=f"Could not read CSV (COPY line numbers start after the header): {str(err).strip()}"
+        )
+    finally:
+        await file.close()
+
+    print(f"Attendance import by {user_email}: {result['inserted']} inserted, {result['rejected']} rejected")
+    return result
+
+@app.get("/api/hr/profile-cache-stats", summary="Employee profile cache statistics")
+async def profile_cache_stats(request: Request):
+    """Expose profile cache hit/miss counters for monitoring (HR only)."""
+    user_email = request.session.get("user_email")
+    if not user_email or user_email != config.HR_EMAIL:
+        raise HTTPException(status_code=403, detail="HR access required")
+    
+    return get_profile_cache_stats()
+
+@app.get("/api/hr/job-runs", summary="Scheduled job run history")
+async def job_runs(request: Request, job_name: str = None, limit: int = 50, db = Depends(get_db_connection)):
+    """Recent scheduled job runs with timing, outcome and rows affected (HR only)."""
+    user_email = request.session.get("user_email")
+    if not user_email or user_email != config.HR_EMAIL:
+        raise HTTPException(status_code=403, detail="HR access required")
+
+    return await run_db(fetch_job_runs, db, job_name, max(1, min(limit, 500)))
+
 @app.post("/manage-employee", response_class=RedirectResponse, summary="Add or edit employee")
+@idempotent(form_redirect="/hr-management")
 async def manage_employee(
     request: Request,
     action: str = Form(...),
@@ -513,6 +899,7 @@ async def manage_employee(
     salary: str = Form(default=""),
     email: str = Form(default=""),
     photo: UploadFile = File(None),
+    idempotency_key: str = Form(None),
     db = Depends(get_db_connection)
 ):
     """Handle adding or editing employees (HR only)."""
@@ -521,8 +908,6 @@ async def manage_employee(
         return RedirectResponse(url="/", status_code=status.HTTP_303_SEE_OTHER)
     
     try:
-        cursor = db.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        
         # Handle photo upload
         photo_filename = None
         if photo and photo.filename:
@@ -545,73 +930,25 @@ async def manage_employee(
                     f.write(contents)
             except Exception as e:
                 print(f"Error saving photo: {e}")
-                return RedirectResponse(url="/hr-management?error=Error+uploading+photo", status_code=status.HTTP_303_SEE_OTHER)
+                return retryable(RedirectResponse(
+                    url="/hr-management?error=Error+uploading+photo", status_code=status.HTTP_303_SEE_OTHER
+                ))
         
-        if action == "add":
-            # Check for duplicate email
-            cursor.execute("SELECT email FROM employee_details WHERE email = %s", (new_email,))
-            if cursor.fetchone():
-                cursor.close()
-                return RedirectResponse(url="/hr-management?error=Email already exists", status_code=status.HTTP_303_SEE_OTHER)
-            
-            # Check for duplicate name
-            cursor.execute("SELECT name FROM employee_details WHERE LOWER(name) = LOWER(%s)", (name,))
-            if cursor.fetchone():
-                cursor.close()
-                return RedirectResponse(url="/hr-management?error=Employee name already exists", status_code=status.HTTP_303_SEE_OTHER)
-            
-            # Use provided photo or default
-            final_photo = photo_filename if photo_filename else "profile.jpg"
-            
-            cursor.execute(
-                """INSERT INTO employee_details 
-                   (name, email, password, phone, parent_phone, employee_number, job_role, dob, gender, joining_date, native, address, aadhar, pan_card, bank_details, salary, photo)
-                   VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)""",
-                (name, new_email, password, phone, parent_phone, employee_number, job_role, dob, gender, joining_date, native, address, aadhar, pan_card, bank_details, salary, final_photo)
-            )
-            db.commit()
-            
-        elif action == "edit":
-            # Check if email is being changed and if new email already exists (excluding current employee)
-            if new_email != email:
-                cursor.execute("SELECT email FROM employee_details WHERE email = %s AND email != %s", (new_email, email))
-                if cursor.fetchone():
-                    cursor.close()
-                    return RedirectResponse(url="/hr-management?error=Email already exists", status_code=status.HTTP_303_SEE_OTHER)
-            
-            # Check if name is being changed and if new name already exists (excluding current employee)
-            cursor.execute("SELECT name FROM employee_details WHERE LOWER(name) = LOWER(%s) AND email != %s", (name, email))
-            if cursor.fetchone():
-                cursor.close()
-                return RedirectResponse(url="/hr-management?error=Employee name already exists", status_code=status.HTTP_303_SEE_OTHER)
-            
-            # Get current photo if not updating
-            if not photo_filename:
-                cursor.execute("SELECT photo FROM employee_details WHERE email = %s", (email,))
-                result = cursor.fetchone()
-                photo_filename = result.get('photo') if result else 'profile.jpg'
-            
-            if password:
-                cursor.execute(
-                    """UPDATE employee_details 
-                       SET name = %s, email = %s, phone = %s, parent_phone = %s, employee_number = %s, job_role = %s, dob = %s, gender = %s, joining_date = %s, native = %s, address = %s, aadhar = %s, pan_card = %s, bank_details = %s, salary = %s, password = %s, photo = %s
-                       WHERE email = %s""",
-                    (name, new_email, phone, parent_phone, employee_number, job_role, dob, gender, joining_date, native, address, aadhar, pan_card, bank_details, salary, password, photo_filename, email)
-                )
-            else:
-                cursor.execute(
-                    """UPDATE employee_details 
-                       SET name = %s, email = %s, phone = %s, parent_phone = %s, employee_number = %s, job_role = %s, dob = %s, gender = %s, joining_date = %s, native = %s, address = %s, aadhar = %s, pan_card = %s, bank_details = %s, salary = %s, photo = %s
-                       WHERE email = %s""",
-                    (name, new_email, phone, parent_phone, employee_number, job_role, dob, gender, joining_date, native, address, aadhar, pan_card, bank_details, salary, photo_filename, email)
-                )
-            db.commit()
-        
-        cursor.close()
+        fields = {
+            "name": name, "email": new_email, "phone": phone, "parent_phone": parent_phone,
+            "employee_number": employee_number, "job_role": job_role, "dob": dob, "gender": gender,
+            "joining_date": joining_date, "native": native, "address": address, "aadhar": aadhar,
+            "pan_card": pan_card, "bank_details": bank_details, "salary": salary
+        }
+        error = await run_db(_save_employee, db, action, email, fields, password, photo_filename)
+        if error:
+            return RedirectResponse(url=f"/hr-management?error={error}", status_code=status.HTTP_303_SEE_OTHER)
         
     except psycopg2.Error as err:
         print(f"Database error: {err}")
-        return RedirectResponse(url="/hr-management?error=Database error", status_code=status.HTTP_303_SEE_OTHER)
+        return retryable(
+            RedirectResponse(url="/hr-management?error=Database error", status_code=status.HTTP_303_SEE_OTHER)
+        )
     
     return RedirectResponse(url="/hr-management?success=Employee saved", status_code=status.HTTP_303_SEE_OTHER)
 
@@ -630,10 +967,7 @@ async def delete_employee(
         return RedirectResponse(url="/hr-management?error=Cannot delete HR account", status_code=status.HTTP_303_SEE_OTHER)
     
     try:
-        cursor = db.cursor()
-        cursor.execute("DELETE FROM employee_details WHERE email = %s", (email,))
-        db.commit()
-        cursor.close()
+        await run_db(delete_employee_record, db, email)
         
     except psycopg2.Error as err:
         print(f"Database error: {err}")
@@ -642,12 +976,14 @@ async def delete_employee(
     return RedirectResponse(url="/hr-management?success=Employee deleted", status_code=status.HTTP_303_SEE_OTHER)
 
 @app.post("/manual-attendance", response_class=RedirectResponse, summary="Add manual attendance record")
+@idempotent(form_redirect="/hr-management")
 async def manual_attendance(
     request: Request,
     employee_email: str = Form(...),
     attendance_date: str = Form(...),
     attendance_time: str = Form(...),
     action: str = Form(...),
+    idempotency_key: str = Form(None),
     db = Depends(get_db_connection)
 ):
     """Allow HR to manually add attendance records for employees."""
@@ -656,7 +992,7 @@ async def manual_attendance(
         return RedirectResponse(url="/", status_code=status.HTTP_303_SEE_OTHER)
     
     try:
-        employee = fetch_employee_by_email(db, employee_email)
+        employee = await run_db(fetch_employee_by_email, db, employee_email)
         if not employee:
             return RedirectResponse(
                 url="/hr-management?error=Employee not found",
@@ -679,24 +1015,9 @@ async def manual_attendance(
                 status_code=status.HTTP_303_SEE_OTHER
             )
         
-        cursor = db.cursor()
-        cursor.execute(
-            """INSERT INTO attendance (user_email, action, event_time, latitude, longitude, location_text)
-               VALUES (%s, %s, %s, %s, %s, %s)""",
-            (employee_email, action, event_datetime, None, None, "Manual Entry by HR")
-        )
-        
-        # If check-in, increment total_working days
-        if action == "check-in":
-            cursor.execute(
-                """UPDATE employee_details 
-                   SET total_working = total_working + 1 
-                   WHERE email = %s""",
-                (employee_email,)
-            )
-        
-        db.commit()
-        cursor.close()
+        # HR enters IST wall-clock time; attendance rows are stored in UTC
+        event_datetime_utc = IST.localize(event_datetime).astimezone(pytz.UTC)
+        await run_db(add_manual_attendance_record, db, employee_email, action, event_datetime_utc)
         
         print(f"Manual attendance added:  {employee_email} - {action} at {event_datetime} by {user_email}")
         
@@ -707,16 +1028,43 @@ async def manual_attendance(
         
     except psycopg2.Error as err:
         print(f"Database error in manual_attendance: {err}")
-        return RedirectResponse(
+        return retryable(RedirectResponse(
             url="/hr-management?error=Database error occurred:  " + str(err),
             status_code=status.HTTP_303_SEE_OTHER
-        )
+        ))
     except Exception as err:
         print(f"Error in manual_attendance: {err}")
-        return RedirectResponse(
+        return retryable(RedirectResponse(
             url="/hr-management?error=An error occurred: " + str(err),
             status_code=status.HTTP_303_SEE_OTHER
-        )
+        ))
+
+class ManualAttendanceEntry(BaseModel):
+    """One manual event, with the same fields as the /manual-attendance form."""
+    employee_email: str
+    attendance_date: str  # YYYY-MM-DD (IST)
+    attendance_time: str  # HH:MM (IST)
+    action: str
+
+class ManualAttendanceBatch(BaseModel):
+    entries: List[ManualAttendanceEntry] = Field(..., min_length=1, max_length=1000)
+
+@app.post("/api/hr/manual-attendance/batch", summary="Add many manual attendance records")
+async def manual_attendance_batch(request: Request, batch: ManualAttendanceBatch, db = Depends(get_db_connection)):
+    """
+    Add manual attendance for several employees and days in one call (HR only).
+    Entries are validated together and written in one transaction; invalid entries
+    are returned with their list index and reason instead of failing the batch.
+    """
+    user_email = request.session.get("user_email")
+    if not user_email or user_email != config.HR_EMAIL:
+        raise HTTPException(status_code=403, detail="HR access required")
+
+    entries = [entry.model_dump() for entry in batch.entries]
+    result = await run_db(add_manual_attendance_batch, db, entries)
+
+    print(f"Manual attendance batch by {user_email}: {result['inserted']} added, {result['rejected']} rejected")
+    return result
 
 @app.get("/logout", summary="Log user out", name="logout")
 async def logout(request: Request):
@@ -780,56 +1128,101 @@ def _build_user_from_static(email):
         "bank_details": u.get("bank_details")
     }
 
+def _load_employee_list(db):
+    """Load the employee list with today's presence."""
+    all_employees = fetch_all_employees(db)
+    all_employees = [emp for emp in all_employees if emp.get("email") != config.HR_EMAIL]
+    
+    try:
+        roster_status = fetch_roster_attendance_status(db, get_ist_date(), include_comments=False)
+        for emp in all_employees:
+            email = emp.get("email")
+            if email:  
+                emp["present_today"] = email in roster_status
+    except Exception:  
+        for emp in all_employees:
+            emp["present_today"] = False
+    return all_employees
+
+def _load_hr_roster(db):
+    """Load every employee with today's presence and latest attendance comment for the HR page."""
+    employees = fetch_all_employees(db)
+    
+    roster_status = fetch_roster_attendance_status(db, get_ist_date())
+    for emp in employees:
+        status = roster_status.get(emp.get("email"), {})
+        emp["present_today"] = status.get("present_today", False)
+        emp["last_comment"] = status.get("last_comment")
+    
+    return employees
+
+def _save_employee(db, action: str, email: str, fields: dict, password: str, photo_filename: str = None):
+    """Add or edit an employee; returns an error message for the redirect, or None on success."""
+    new_email = fields["email"]
+    if action == "add":
+        # Check for duplicate email
+        if employee_email_exists(db, new_email):
+            return "Email already exists"
+        
+        # Check for duplicate name
+        if employee_name_exists(db, fields["name"]):
+            return "Employee name already exists"
+        
+        # Use provided photo or default
+        create_employee(db, {**fields, "password": password, "photo": photo_filename or "profile.jpg"})
+        
+    elif action == "edit":
+        # Check if email is being changed and if new email already exists (excluding current employee)
+        if new_email != email and employee_email_exists(db, new_email, exclude_email=email):
+            return "Email already exists"
+        
+        # Check if name is being changed and if new name already exists (excluding current employee)
+        if employee_name_exists(db, fields["name"], exclude_email=email):
+            return "Employee name already exists"
+        
+        # Get current photo if not updating
+        if not photo_filename:
+            photo_filename = fetch_employee_photo(db, email) or 'profile.jpg'
+        
+        updates = {**fields, "photo": photo_filename}
+        if password:
+            updates["password"] = password
+        update_employee_fields(db, email, updates)
+    
+    return None
+
+def _format_report_day(r):
+    """Display values for one daily_attendance row (times already in IST)."""
+    seconds = r["worked_seconds"]
+    hours = seconds // 3600
+    minutes = (seconds % 3600) // 60
+    return {
+        "day": r["work_date"].isoformat(),
+        "check_in": r["first_check_in"].strftime("%I:%M %p") if r["first_check_in"] else "-",
+        "check_out": r["last_check_out"].strftime("%I:%M %p") if r["last_check_out"] else "-",
+        "total_hours": f"{hours}h {minutes}m" if seconds else "-"
+    }
+
+def _iter_csv(header, rows, chunk_size: int = 64 * 1024):
+    """Encode rows as CSV text, yielding chunks of about `chunk_size` characters."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= chunk_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
 def _build_report_for_user(db, user_email, days: int = 30):
     """Build report rows for the last `days` days for the given user."""
     # Use IST for date calculations
-    end_date = get_ist_now()
-    start_date = end_date - timedelta(days=days)
-
-    cursor = db.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    cursor.execute(
-        """
-        SELECT event_time, action FROM attendance
-        WHERE user_email = %s AND event_time AT TIME ZONE 'Asia/Kolkata' >= %s
-        ORDER BY event_time ASC
-        """,
-        (user_email, start_date)
-    )
-    rows = cursor.fetchall()
-    cursor.close()
-
-    by_date = {}
-    for r in rows:
-        # Convert UTC to IST for display
-        event_time_ist = r["event_time"].astimezone(IST) if r["event_time"].tzinfo else IST.localize(r["event_time"])
-        d = event_time_ist.date().isoformat()
-        by_date.setdefault(d, []).append({"event_time": event_time_ist, "action": r["action"]})
-
-    report = []
-    total_working_seconds = 0
-    for day, events in sorted(by_date.items()):
-        check_ins = [e["event_time"] for e in events if e["action"] == "check-in"]
-        check_outs = [e["event_time"] for e in events if e["action"] == "check-out"]
-
-        check_in = min(check_ins).strftime("%I:%M %p") if check_ins else "-"
-        check_out = max(check_outs).strftime("%I:%M %p") if check_outs else "-"
-
-        seconds = 0
-        if check_ins and check_outs:
-            seconds = int((max(check_outs) - min(check_ins)).total_seconds())
-            total_working_seconds += seconds
-
-        hours = seconds // 3600
-        minutes = (seconds % 3600) // 60
-        total_str = f"{hours}h {minutes}m" if seconds else "-"
-
-        report.append({
-            "day": day,
-            "check_in": check_in,
-            "check_out": check_out,
-            "total_hours": total_str
-        })
-
+    start_date = get_ist_date() - timedelta(days=days)
+    rows = fetch_daily_attendance_report(db, user_email, start_date)
+    report = [_format_report_day(r) for r in rows]
+    total_working_seconds = int(rows[0]["window_worked_seconds"]) if rows else 0
     return report, total_working_seconds
 
 # ===========================================================================
@@ -853,7 +1246,7 @@ async def submit_comment(
     if not comment_text or not comment_text.strip():
         raise HTTPException(status_code=400, detail="Comment cannot be empty")
     
-    success = submit_employee_comment(db, user_email, comment_text.strip())
+    success = await run_db(submit_employee_comment, db, user_email, comment_text.strip())
     
     if success:
         return {"success": True, "message": "Comment submitted successfully"}
@@ -868,7 +1261,7 @@ async def get_my_comments(request: Request, db = Depends(get_db_connection)):
     if not user_email:
         raise HTTPException(status_code=401, detail="Not logged in")
     
-    comments = get_employee_comments(db, user_email)
+    comments = await run_db(get_employee_comments, db, user_email)
     return {"comments": comments}
 
 
@@ -879,7 +1272,7 @@ async def get_unread_count(request: Request, db = Depends(get_db_connection)):
     if not user_email or user_email != config.HR_EMAIL:
         raise HTTPException(status_code=403, detail="HR access required")
     
-    count = get_unread_comment_count(db)
+    count = await run_db(get_unread_comment_count, db)
     return {"unread_count": count}
 
 
@@ -895,8 +1288,8 @@ async def get_hr_comments(
     if not user_email or user_email != config.HR_EMAIL:
         raise HTTPException(status_code=403, detail="HR access required")
     
-    comments = get_all_comments_for_hr(db, limit, offset)
-    unread_count = get_unread_comment_count(db)
+    comments = await run_db(get_all_comments_for_hr, db, limit, offset)
+    unread_count = await run_db(get_unread_comment_count, db)
     
     return {
         "comments": comments,
@@ -916,7 +1309,7 @@ async def mark_read(
     if not user_email or user_email != config.HR_EMAIL:
         raise HTTPException(status_code=403, detail="HR access required")
     
-    success = mark_comment_as_read(db, comment_id)
+    success = await run_db(mark_comment_as_read, db, comment_id)
     
     if success:
         return {"success": True, "message": "Comment marked as read"}
@@ -935,8 +1328,7 @@ async def delete_comment_endpoint(
     if not user_email or user_email != config.HR_EMAIL:
         raise HTTPException(status_code=403, detail="HR access required")
     
-    from data import delete_comment
-    success = delete_comment(db, comment_id)
+    success = await run_db(delete_comment, db, comment_id)
     
     if success:
         return {"success": True, "message": "Comment deleted"}
@@ -967,54 +1359,25 @@ async def edit_employee_details(
         raise HTTPException(status_code=403, detail="HR access required")
     
     try:
-        cursor = db.cursor()
-        update_fields = []
-        update_values = []
-        
-        if name is not None:
-            update_fields.append("name = %s")
-            update_values.append(name)
-        if phone is not None:
-            update_fields.append("phone = %s")
-            update_values.append(phone)
-        if parent_phone is not None:
-            update_fields.append("parent_phone = %s")
-            update_values.append(parent_phone)
-        if dob is not None:
-            update_fields.append("dob = %s")
-            update_values.append(dob)
-        if gender is not None:
-            update_fields.append("gender = %s")
-            update_values.append(gender)
-        if employee_number is not None:
-            update_fields.append("employee_number = %s")
-            update_values.append(employee_number)
-        if aadhar is not None:
-            update_fields.append("aadhar = %s")
-            update_values.append(aadhar)
-        if joining_date is not None:
-            update_fields.append("joining_date = %s")
-            update_values.append(joining_date)
-        if native is not None:
-            update_fields.append("native = %s")
-            update_values.append(native)
-        if address is not None:
-            update_fields.append("address = %s")
-            update_values.append(address)
-        if job_role is not None:
-            update_fields.append("job_role = %s")
-            update_values.append(job_role)
+        fields = {
+            "name": name,
+            "phone": phone,
+            "parent_phone": parent_phone,
+            "dob": dob,
+            "gender": gender,
+            "employee_number": employee_number,
+            "aadhar": aadhar,
+            "joining_date": joining_date,
+            "native": native,
+            "address": address,
+            "job_role": job_role,
+        }
+        fields = {column: value for column, value in fields.items() if value is not None}
         
-        if not update_fields:
+        if not fields:
             raise HTTPException(status_code=400, detail="No fields to update")
         
-        update_fields.append("updated_at = CURRENT_TIMESTAMP")
-        update_values.append(email)
-        
-        query = f"UPDATE employee_details SET {', '.join(update_fields)} WHERE email = %s"
-        cursor.execute(query, update_values)
-        db.commit()
-        cursor.close()
+        await run_db(update_employee_fields, db, email, fields)
         
         return {"success": True, "message": "Employee details updated"}
     except Exception as e:
@@ -1036,10 +1399,7 @@ async def delete_employee_endpoint(
         raise HTTPException(status_code=403, detail="Cannot delete HR account")
     
     try:
-        cursor = db.cursor()
-        cursor.execute("DELETE FROM employee_details WHERE email = %s", (email,))
-        db.commit()
-        cursor.close()
+        await run_db(delete_employee_record, db, email)
         
         return {"success": True, "message": "Employee deleted"}
     except Exception as e:
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Check-in write throughput with each write committed alone and with the group-commit
+writer at a few ATTENDANCE_GROUP_COMMIT_MS windows.
+
+Every run fires WRITES simultaneous check-ins through write_attendance_record, one per
+throwaway address (bench<N>@group-commit.test, removed before and after each run), so
+none of them conflict. Needs the database from .env (schema is created if missing).
+
+    python benchmarks/group_commit.py [--writes 1000] [--windows 0,5,10,20]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytz
+
+import config
+import data
+from schema import initialize_database_schema
+
+EMAIL_PATTERN = "bench%@group-commit.test"
+
+
+def _cleanup():
+    with data.db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM attendance WHERE user_email LIKE %s", (EMAIL_PATTERN,))
+        cursor.execute("DELETE FROM daily_attendance WHERE user_email LIKE %s", (EMAIL_PATTERN,))
+        conn.commit()
+        cursor.close()
+
+
+async def _run(window_ms: int, writes: int) -> str:
+    config.ATTENDANCE_GROUP_COMMIT_MS = window_ms
+    data.close_attendance_writer()
+    _cleanup()
+    now = datetime.now(pytz.UTC)
+    started = time.perf_counter()
+    results = await asyncio.gather(*[
+        data.write_attendance_record(f"bench{i}@group-commit.test", "check-in", now, 11.12, 77.33, "benchmark")
+        for i in range(writes)
+    ], return_exceptions=True)
+    elapsed = time.perf_counter() - started
+    errors = sum(isinstance(r, Exception) for r in results)
+    stats = data.get_attendance_writer_stats()
+    data.close_attendance_writer()
+    _cleanup()
+    batches = f", {stats['batches']} batches, largest {stats['largest_batch']}" if stats else ""
+    return f"  window {window_ms:>3} ms: {writes / elapsed:6.0f} writes/s ({elapsed:.2f} s, {errors} errors{batches})"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--writes", type=int, default=1000)
+    parser.add_argument("--windows", default="0,5,10,20", help="comma-separated ms; 0 commits each write alone")
+    args = parser.parse_args()
+
+    initialize_database_schema()
+    print(f"{args.writes} simultaneous check-ins:")
+    try:
+        for window_ms in [int(w) for w in args.windows.split(",")]:
+            print(asyncio.run(_run(window_ms, args.writes)))
+    finally:
+        data.shutdown_db_executor()
+        data.close_db_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Concurrent /report requests with a slow query, with database calls run inline on the
+event loop (as before run_db) and offloaded to the DB thread pool (as now).
+
+A pg_sleep is added in front of the /report attendance lookup so every request spends
+SLEEP_SECONDS in PostgreSQL. Inline, the requests queue behind each other on the event
+loop; offloaded, they overlap. Needs the database from .env (schema is created if missing).
+
+    python benchmarks/report_concurrency.py [--requests 10] [--sleep 0.2]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+import app as app_module
+import config
+from data import close_db_pool, shutdown_db_executor
+from employees import users as static_users
+from schema import initialize_database_schema
+
+
+async def _inline_run_db(func, *args, **kwargs):
+    """run_db as it was before: the blocking call runs on the event loop itself."""
+    return func(*args, **kwargs)
+
+
+def _slow(func, seconds: float):
+    def wrapper(db, *args, **kwargs):
+        cursor = db.cursor()
+        cursor.execute("SELECT pg_sleep(%s)", (seconds,))
+        cursor.close()
+        return func(db, *args, **kwargs)
+    return wrapper
+
+
+async def _timed_requests(requests: int) -> float:
+    email, user = next((e, u) for e, u in static_users.items() if e != config.HR_EMAIL)
+    transport = httpx.ASGITransport(app=app_module.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await client.post("/", data={"email": email, "password": user.get("password", "zugo@123")})
+        started = time.perf_counter()
+        responses = await asyncio.gather(*[client.get("/report") for _ in range(requests)])
+        elapsed = time.perf_counter() - started
+    failed = [r.status_code for r in responses if r.status_code != 200]
+    if failed:
+        raise SystemExit(f"/report failed: {failed}")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=10)
+    parser.add_argument("--sleep", type=float, default=0.2, help="seconds of pg_sleep per request")
+    args = parser.parse_args()
+
+    initialize_database_schema()
+    app_module.fetch_attendance_for_today = _slow(app_module.fetch_attendance_for_today, args.sleep)
+    offloaded_run_db = app_module.run_db
+    try:
+        app_module.run_db = _inline_run_db
+        inline = asyncio.run(_timed_requests(args.requests))
+        app_module.run_db = offloaded_run_db
+        offloaded = asyncio.run(_timed_requests(args.requests))
+    finally:
+        app_module.run_db = offloaded_run_db
+        shutdown_db_executor()
+        close_db_pool()
+
+    print(f"{args.requests} concurrent /report requests, {args.sleep * 1000:.0f} ms query each:")
+    print(f"  inline on the event loop: {inline:.2f} s")
+    print(f"  offloaded with run_db:    {offloaded:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -18,6 +18,43 @@ DB_PORT = int(os.getenv("DB_PORT", "5432"))
 
 DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://...")
 
+# Database Connection Pool
+# One pool per worker process; every request and helper borrows from it
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "30"))  # Wait for a free connection
+DB_POOL_MAX_LIFETIME_SECONDS = int(os.getenv("DB_POOL_MAX_LIFETIME_SECONDS", "1800"))  # Recycle after 30 min
+DB_POOL_HEALTH_CHECK_IDLE_SECONDS = int(os.getenv("DB_POOL_HEALTH_CHECK_IDLE_SECONDS", "30"))  # 0 = ping on every checkout
+# Threads that run blocking DB calls off the event loop (defaults to the pool size)
+DB_THREAD_POOL_SIZE = int(os.getenv("DB_THREAD_POOL_SIZE", str(DB_POOL_MAX_SIZE)))
+
+# Group commit for check-in/check-out writes: wait this long to batch concurrent writes
+# into one transaction (5-20 ms suits the morning check-in rush); 0 = commit each write alone
+ATTENDANCE_GROUP_COMMIT_MS = float(os.getenv("ATTENDANCE_GROUP_COMMIT_MS", "0"))
+ATTENDANCE_GROUP_COMMIT_MAX_BATCH = int(os.getenv("ATTENDANCE_GROUP_COMMIT_MAX_BATCH", "200"))
+
+# Idempotency keys: how long a POST's outcome is replayed for retries with the same key
+IDEMPOTENCY_KEY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_KEY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "5"))  # form resubmit waits for the first
+
+# Offline check-in sync: each registered device signs queued events with its own key
+OFFLINE_DEVICE_KEY_TTL_DAYS = int(os.getenv("OFFLINE_DEVICE_KEY_TTL_DAYS", "30"))  # Re-register after this
+OFFLINE_SYNC_MAX_AGE_HOURS = int(os.getenv("OFFLINE_SYNC_MAX_AGE_HOURS", "72"))  # Older events are rejected
+OFFLINE_SYNC_MAX_CLOCK_SKEW_SECONDS = int(os.getenv("OFFLINE_SYNC_MAX_CLOCK_SKEW_SECONDS", "300"))  # Device clock ahead
+
+# Schema migrations: apply pending ones at startup, or only via `python schema.py migrate`
+DB_MIGRATE_ON_STARTUP = os.getenv("DB_MIGRATE_ON_STARTUP", "True").lower() == "true"
+
+# Employee Profile Cache (per worker process; writes through this app invalidate it)
+PROFILE_CACHE_TTL_SECONDS = int(os.getenv("PROFILE_CACHE_TTL_SECONDS", "300"))  # 0 = disabled
+PROFILE_CACHE_MAX_SIZE = int(os.getenv("PROFILE_CACHE_MAX_SIZE", "1000"))
+
+# Exports (CSV downloads and the monthly report email)
+EXPORT_FETCH_SIZE = int(os.getenv("EXPORT_FETCH_SIZE", "2000"))  # rows per server-side cursor round trip
+EXPORT_SPOOL_MAX_BYTES = int(os.getenv("EXPORT_SPOOL_MAX_BYTES", str(1024 * 1024)))  # spill to disk beyond this
+EXPORT_MAX_CONCURRENT = int(os.getenv("EXPORT_MAX_CONCURRENT", "2"))  # COPY exports streaming at once per worker
+EXPORT_STALL_TIMEOUT_SECONDS = int(os.getenv("EXPORT_STALL_TIMEOUT_SECONDS", "300"))  # give up if no data arrives
+
 # Office Location for Attendance
 OFFICE_LAT = 11.1205177
 OFFICE_LON = 77.3399277
@@ -45,9 +82,17 @@ MD_EMAIL = os.getenv("MD_EMAIL", "zugoprivitelimited@gmail.com")
 # OFFICE_LON = 77.3398681 # your office's longitude
 # OFFICE_RADIUS_METERS = 100  # 100 meters radius for location validation
 
+# Attendance Table Partitioning (one partition per IST month)
+ATTENDANCE_PARTITION_MONTHS_AHEAD = int(os.getenv("ATTENDANCE_PARTITION_MONTHS_AHEAD", "3"))
+ATTENDANCE_RETENTION_MONTHS = int(os.getenv("ATTENDANCE_RETENTION_MONTHS", "0"))  # 0 = keep all history
+ATTENDANCE_RETENTION_DROP = os.getenv("ATTENDANCE_RETENTION_DROP", "False").lower() == "true"  # False = detach only
+
 # Scheduler Settings
 LEAVE_MARKING_HOUR = 20  # 8 PM UTC
 MONTHLY_REPORT_DAY = 20  # Day of the month to send report
+ABSENCE_MARK_TIME = time(14, 30)  # IST; the daily absence job covers each day from this time on
+# Days the absence job backfills after downtime (older missed days are not marked)
+ABSENCE_CATCHUP_MAX_DAYS = int(os.getenv("ABSENCE_CATCHUP_MAX_DAYS", "31"))
 
 # Attendance Calculation Period (21st to 20th)
 ATTENDANCE_PERIOD_START_DAY = 21  # Start calculation from the 21st
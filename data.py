@@ -1,98 +1,766 @@
-from datetime import date
+import asyncio
+import csv
+import functools
+import os
+import queue
+import secrets
+import socket
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, datetime, time as dt_time, timedelta
 import psycopg2
 import psycopg2.extras
+import psycopg2.pool
+from psycopg2 import extensions, sql
 from typing import Optional, List, Dict
+import pytz
 # --- Local Imports ---
 import config
 from employees import users as static_users 
 from fastapi import HTTPException
 
+IST = pytz.timezone('Asia/Kolkata')
+
+
+def ist_day_bounds_utc(start_day: date, end_day: date = None):
+    """
+    UTC wall-clock [start, end) covering the IST days start_day..end_day inclusive.
+
+    attendance is partitioned on event_time, so adding this range next to a
+    work_date filter lets the planner skip every partition outside it.
+    """
+    end_day = end_day or start_day
+    start = IST.localize(datetime.combine(start_day, dt_time.min)).astimezone(pytz.UTC)
+    end = IST.localize(datetime.combine(end_day + timedelta(days=1), dt_time.min)).astimezone(pytz.UTC)
+    return start.replace(tzinfo=None), end.replace(tzinfo=None)
+
+
+def get_attendance_period_dates(ref_date: date) -> tuple[date, date]:
+    """
+    Calculates the start and end dates for the attendance period
+    (20th of previous month to 20th of current month or similar).
+    """
+    if ref_date.day > config.ATTENDANCE_PERIOD_END_DAY:
+        # Example: if today is Oct 25, period is Oct 21 to Nov 20
+        start_month = ref_date.month
+        start_year = ref_date.year
+        end_month = (ref_date.month % 12) + 1
+        end_year = ref_date.year if end_month != 1 else ref_date.year + 1
+    else:
+        # Example: if today is Oct 15, period is Sep 21 to Oct 20
+        end_month = ref_date.month
+        end_year = ref_date.year
+        start_month = (ref_date.month - 2 + 12) % 12 + 1 # month-1, then adjust for Jan
+        start_year = ref_date.year if start_month != 12 else ref_date.year - 1
+
+    start_date = date(start_year, start_month, config.ATTENDANCE_PERIOD_START_DAY)
+    end_date = date(end_year, end_month, config.ATTENDANCE_PERIOD_END_DAY)
+
+    # Adjust start_date if it falls in the current month but should be previous
+    if ref_date.day <= config.ATTENDANCE_PERIOD_END_DAY:
+        if start_date.month == ref_date.month:
+             # This means start_date was calculated for current year/month but should be previous year/month
+            start_date = date(start_date.year, start_date.month - 1, config.ATTENDANCE_PERIOD_START_DAY)
+            if start_date.month == 0: # Handle December case
+                start_date = date(start_date.year - 1, 12, config.ATTENDANCE_PERIOD_START_DAY)
+
+    return start_date, end_date
+
 
 # ===========================================================================
-# DATABASE SETUP & DEPENDENCY
+# DATABASE CONNECTION POOL
 # ===========================================================================
 
-def get_db_connection():
-    """Dependency to get a database connection."""
-    try:
-        conn = psycopg2.connect(
+class DatabasePool:
+    """
+    Process-wide psycopg2 connection pool.
+
+    Wraps ThreadedConnectionPool with what it lacks: callers wait (up to
+    `timeout` seconds) for a free connection instead of failing at once,
+    connections idle for a while are pinged before reuse, connections older
+    than `max_lifetime` are recycled, and usage counters are kept for monitoring.
+    """
+
+    def __init__(self, min_size: int, max_size: int, timeout: float,
+                 max_lifetime: int, health_check_idle: int):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.health_check_idle = health_check_idle
+
+        self._pool = psycopg2.pool.ThreadedConnectionPool(
+            min_size,
+            max_size,
             host=config.DB_HOST,
             port=config.DB_PORT,
             user=config.DB_USER,
             password=config.DB_PASSWORD,
-            database=config.DB_NAME
+            database=config.DB_NAME,
+            # event_time is stored as UTC wall-clock time; pin the session zone so
+            # timezone-aware datetimes are always converted to UTC on insert
+            options="-c timezone=UTC"
         )
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self._created_at = {}
+        self._last_used_at = {}
+        self._stats = {
+            "checkouts": 0,
+            "wait_timeouts": 0,
+            "recycled": 0,
+            "health_check_failures": 0,
+        }
+
+    def getconn(self):
+        """Borrow a healthy connection, waiting for a free slot if the pool is busy."""
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._stats["wait_timeouts"] += 1
+            raise psycopg2.pool.PoolError("connection pool exhausted")
+
+        try:
+            # Every idle connection may turn out stale; after that a fresh one is opened
+            for _ in range(self.max_size + 1):
+                conn = self._pool.getconn()
+                if self._is_usable(conn):
+                    break
+                self._discard(conn)
+            else:
+                raise psycopg2.pool.PoolError("could not obtain a healthy connection")
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._stats["checkouts"] += 1
+        return conn
+
+    def putconn(self, conn):
+        """Return a connection, rolling back anything the borrower left open."""
+        try:
+            if conn.closed:
+                self._discard(conn)
+                return
+            if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    self._discard(conn)
+                    return
+            self._last_used_at[id(conn)] = time.monotonic()
+            self._pool.putconn(conn)
+        finally:
+            self._slots.release()
+
+    def closeall(self):
+        self._pool.closeall()
+        self._created_at.clear()
+        self._last_used_at.clear()
+
+    def stats(self) -> Dict:
+        """Snapshot of pool usage for monitoring."""
+        with self._lock:
+            stats = dict(self._stats)
+        idle = len(self._pool._pool)
+        in_use = len(self._pool._used)
+        stats.update({
+            "min_size": self.min_size,
+            "max_size": self.max_size,
+            "open": idle + in_use,
+            "idle": idle,
+            "in_use": in_use,
+        })
+        return stats
+
+    def _is_usable(self, conn) -> bool:
+        if conn.closed:
+            return False
+
+        now = time.monotonic()
+        key = id(conn)
+        created_at = self._created_at.setdefault(key, now)
+        if self.max_lifetime and now - created_at > self.max_lifetime:
+            with self._lock:
+                self._stats["recycled"] += 1
+            return False
+
+        last_used_at = self._last_used_at.get(key)
+        if last_used_at is not None and now - last_used_at >= self.health_check_idle:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("SELECT 1")
+                cursor.close()
+                conn.rollback()
+            except psycopg2.Error:
+                with self._lock:
+                    self._stats["health_check_failures"] += 1
+                return False
+        return True
+
+    def _discard(self, conn):
+        self._created_at.pop(id(conn), None)
+        self._last_used_at.pop(id(conn), None)
+        try:
+            self._pool.putconn(conn, close=True)
+        except psycopg2.pool.PoolError:
+            pass
+
+
+_db_pool: Optional[DatabasePool] = None
+_db_pool_lock = threading.Lock()
+
+
+def get_db_pool() -> DatabasePool:
+    """Return the process-wide pool, creating it on first use."""
+    global _db_pool
+    if _db_pool is None:
+        with _db_pool_lock:
+            if _db_pool is None:
+                _db_pool = DatabasePool(
+                    min_size=config.DB_POOL_MIN_SIZE,
+                    max_size=config.DB_POOL_MAX_SIZE,
+                    timeout=config.DB_POOL_TIMEOUT_SECONDS,
+                    max_lifetime=config.DB_POOL_MAX_LIFETIME_SECONDS,
+                    health_check_idle=config.DB_POOL_HEALTH_CHECK_IDLE_SECONDS
+                )
+    return _db_pool
+
+
+def close_db_pool():
+    """Close every pooled connection (application shutdown)."""
+    global _db_pool
+    with _db_pool_lock:
+        if _db_pool is not None:
+            _db_pool.closeall()
+            _db_pool = None
+
+
+def get_db_pool_stats() -> Dict:
+    """Pool usage counters; empty until the pool has been created."""
+    return _db_pool.stats() if _db_pool is not None else {}
+
+
+@contextmanager
+def db_connection():
+    """Borrow a pooled connection for the duration of a `with` block."""
+    pool = get_db_pool()
+    conn = pool.getconn()
+    try:
         yield conn
+    finally:
+        pool.putconn(conn)
+
+
+def iter_query_rows(query: str, params=(), cursor_factory=None, batch_size: int = None):
+    """
+    Yield the rows of `query` from a named (server-side) cursor, fetching
+    `batch_size` rows per round trip, so memory stays flat for any result size.
+
+    The generator borrows its own pooled connection and holds it until it is
+    exhausted or closed, so it can outlive the request's dependency connection.
+    """
+    with db_connection() as conn:
+        cursor = conn.cursor(name="stream_rows", cursor_factory=cursor_factory)
+        cursor.itersize = batch_size or config.EXPORT_FETCH_SIZE
+        try:
+            cursor.execute(query, params)
+            for row in cursor:
+                yield row
+        finally:
+            # Ending the transaction also closes the server-side cursor
+            conn.rollback()
+
+
+# ===========================================================================
+# BLOCKING CALL OFFLOADING
+# ===========================================================================
+
+_db_executor: Optional[ThreadPoolExecutor] = None
+_db_executor_lock = threading.Lock()
+
+
+def _get_db_executor() -> ThreadPoolExecutor:
+    global _db_executor
+    if _db_executor is None:
+        with _db_executor_lock:
+            if _db_executor is None:
+                _db_executor = ThreadPoolExecutor(
+                    max_workers=config.DB_THREAD_POOL_SIZE,
+                    thread_name_prefix="db"
+                )
+    return _db_executor
+
+
+async def run_db(func, *args, **kwargs):
+    """
+    Run a blocking database function on the bounded DB thread pool.
+
+    psycopg2 blocks the calling thread, so async route handlers must never call
+    data functions directly: one slow query would stall every other request on
+    the worker. The pool is sized like the connection pool, so threads never
+    queue behind each other waiting for a connection.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_db_executor(), functools.partial(func, *args, **kwargs))
+
+
+def shutdown_db_executor():
+    """Stop the DB thread pool (application shutdown)."""
+    global _db_executor
+    with _db_executor_lock:
+        if _db_executor is not None:
+            _db_executor.shutdown(wait=True)
+            _db_executor = None
+
+
+# ===========================================================================
+# DATABASE SETUP & DEPENDENCY
+# ===========================================================================
+
+def get_db_connection():
+    """Dependency to get a pooled database connection."""
+    try:
+        with db_connection() as conn:
+            yield conn
     except psycopg2.Error as err:
         raise HTTPException(status_code=500, detail=f"Database connection failed: {err}")
-    finally:
-        if 'conn' in locals() and conn:
-            conn.close()
+
+
+# ===========================================================================
+# EMPLOYEE PROFILE CACHE
+# ===========================================================================
+
+class ProfileCache:
+    """
+    Thread-safe LRU cache of employee_details rows keyed by email.
+
+    Entries expire after `ttl` seconds and the least recently used entry is
+    evicted beyond `max_size`. Every employee write in this module invalidates
+    the affected email, so the TTL only bounds staleness across worker processes.
+    Each entry also records the payroll period its totals belong to; a lookup for
+    another period is a miss, so totals never outlive a period rollover.
+    """
+
+    def __init__(self, max_size: int, ttl: int):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_size > 0
+
+    def get(self, email: str, period_start: date) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get(email)
+            if entry is None or entry[0] < time.monotonic() or entry[1] != period_start:
+                if entry is not None:
+                    del self._entries[email]
+                self._misses += 1
+                return None
+            self._entries.move_to_end(email)
+            self._hits += 1
+            return dict(entry[2])
+
+    def set(self, email: str, period_start: date, profile: Dict):
+        with self._lock:
+            self._entries[email] = (time.monotonic() + self.ttl, period_start, dict(profile))
+            self._entries.move_to_end(email)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *emails: str):
+        with self._lock:
+            for email in emails:
+                if self._entries.pop(email, None) is not None:
+                    self._invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "enabled": self.enabled,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_ratio": round(self._hits / lookups, 4) if lookups else 0.0,
+                "invalidations": self._invalidations,
+            }
+
+
+profile_cache = ProfileCache(max_size=config.PROFILE_CACHE_MAX_SIZE, ttl=config.PROFILE_CACHE_TTL_SECONDS)
+
+
+def invalidate_employee_profile(*emails: str):
+    """Drop cached profiles after a write to employee_details."""
+    profile_cache.invalidate(*emails)
+
+
+def get_profile_cache_stats() -> Dict:
+    return profile_cache.stats()
 
 
 # ===========================================================================
 # DATABASE UTILITY FUNCTIONS
 # ===========================================================================
 
+# total_working / total_leave are served from the current payroll period's ledger row
+_EMPLOYEE_WITH_PERIOD_TOTALS = """
+    SELECT e.*, COALESCE(l.working_days, 0) AS period_working_days,
+           COALESCE(l.leave_days, 0) AS period_leave_days
+    FROM employee_details e
+    LEFT JOIN attendance_period_ledger l ON l.user_email = e.email AND l.period_start = %s
+"""
+
+
+def _current_period_start() -> date:
+    return get_attendance_period_dates(datetime.now(IST).date())[0]
+
+
+def _apply_period_totals(employee: Dict) -> Dict:
+    employee["total_working"] = employee.pop("period_working_days")
+    employee["total_leave"] = employee.pop("period_leave_days")
+    return employee
+
+
 def fetch_employee_by_email(db, email: str) -> Optional[Dict]:
+    period_start = _current_period_start()
+    if profile_cache.enabled:
+        employee = profile_cache.get(email, period_start)
+        if employee is not None:
+            return employee
+
     cursor = db.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    cursor.execute("SELECT * FROM employee_details WHERE email = %s", (email,))
+    cursor.execute(_EMPLOYEE_WITH_PERIOD_TOTALS + " WHERE e.email = %s", (period_start, email))
     employee = cursor.fetchone()
     cursor.close()
-    
-    # If employee exists but has missing fields, fill them from static_users
-    if employee:
-        static_user = static_users.get(email)
-        if static_user:
-            # Fill in any missing/null fields from static data
-            if not employee.get("phone"):
-                employee["phone"] = static_user.get("phone")
-            if not employee.get("parent_phone"):
-                employee["parent_phone"] = static_user.get("parent_phone")
-            if not employee.get("dob"):
-                employee["dob"] = static_user.get("dob")
-            if not employee.get("gender"):
-                employee["gender"] = static_user.get("gender")
-            if not employee.get("employee_number"):
-                employee["employee_number"] = static_user.get("employee_number")
-            if not employee.get("aadhar"):
-                employee["aadhar"] = static_user.get("aadhar")
-            if not employee.get("joining_date"):
-                employee["joining_date"] = static_user.get("joining_date")
-            if not employee.get("native"):
-                employee["native"] = static_user.get("native")
-            if not employee.get("address"):
-                employee["address"] = static_user.get("address")
-            if not employee.get("photo") or employee.get("photo") == "profile.jpg":
-                employee["photo"] = static_user.get("photo", "profile.jpg")
-            if not employee.get("job_role"):
-                employee["job_role"] = static_user.get("job_role", "Employee")
-            if not employee.get("pan_card"):
-                employee["pan_card"] = static_user.get("pan_card")
-            if not employee.get("salary"):
-                employee["salary"] = static_user.get("salary")
-            if not employee.get("bank_details"):
-                employee["bank_details"] = static_user.get("bank_details")
-    
+    if employee is not None:
+        employee = _apply_period_totals(employee)
+
+    if employee is not None and profile_cache.enabled:
+        profile_cache.set(email, period_start, employee)
     return employee
 
 
 def fetch_attendance_for_today(db, user_email: str) -> List[Dict]:
     cursor = db.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    today = date.today()
+    today = datetime.now(IST).date()
     cursor.execute(
-        "SELECT * FROM attendance WHERE user_email = %s AND DATE(event_time) = %s",
-        (user_email, today)
+        """SELECT * FROM attendance 
+           WHERE user_email = %s AND work_date = %s AND event_time >= %s AND event_time < %s""",
+        (user_email, today, *ist_day_bounds_utc(today))
     )
     records = cursor.fetchall()
     cursor.close()
     return records
     
 
+def fetch_roster_attendance_status(db, day: date, include_comments: bool = True) -> Dict[str, Dict]:
+    """
+    Presence on `day` and (optionally) the latest attendance comment for the whole roster.
+    Presence comes from daily_attendance and comments from employee_attendance_summary,
+    so neither costs an attendance scan.
+
+    Returns {email: {"present_today": bool, "last_comment": str | None}} for every
+    employee that has any matching attendance; callers default missing emails.
+    Costs one query (two with comments) regardless of headcount.
+    """
+    status = {}
+    cursor = db.cursor()
+    cursor.execute("SELECT user_email FROM daily_attendance WHERE work_date = %s", (day,))
+    for (email,) in cursor.fetchall():
+        status[email] = {"present_today": True, "last_comment": None}
+
+    if include_comments:
+        cursor.execute(
+            """SELECT user_email, last_comment FROM employee_attendance_summary 
+               WHERE last_comment IS NOT NULL"""
+        )
+        for email, comment in cursor.fetchall():
+            status.setdefault(email, {"present_today": False, "last_comment": None})["last_comment"] = comment
+    cursor.close()
+    return status
+
+
+def fetch_daily_attendance_report(db, user_email: str, start_date: date) -> List[Dict]:
+    """
+    One row per IST day since start_date with the first check-in, last check-out
+    (both as naive IST times) and the seconds worked between them, read from daily_attendance.
+
+    Each row also carries `window_worked_seconds`, the total across all returned days.
+    """
+    cursor = db.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    cursor.execute(
+        """SELECT work_date, source, worked_seconds,
+                  (first_check_in AT TIME ZONE 'UTC') AT TIME ZONE 'Asia/Kolkata' AS first_check_in,
+                  (last_check_out AT TIME ZONE 'UTC') AT TIME ZONE 'Asia/Kolkata' AS last_check_out,
+                  SUM(worked_seconds) OVER () AS window_worked_seconds
+           FROM daily_attendance
+           WHERE user_email = %s AND work_date >= %s
+           ORDER BY work_date""",
+        (user_email, start_date)
+    )
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
+
+
+def iter_daily_attendance_report(user_email: str, start_date: date):
+    """Stream the rows of fetch_daily_attendance_report (without the window total) for CSV export."""
+    return iter_query_rows(
+        """SELECT work_date, source, worked_seconds,
+                  (first_check_in AT TIME ZONE 'UTC') AT TIME ZONE 'Asia/Kolkata' AS first_check_in,
+                  (last_check_out AT TIME ZONE 'UTC') AT TIME ZONE 'Asia/Kolkata' AS last_check_out
+           FROM daily_attendance
+           WHERE user_email = %s AND work_date >= %s
+           ORDER BY work_date""",
+        (user_email, start_date),
+        cursor_factory=psycopg2.extras.RealDictCursor
+    )
+
+
+class AttendanceConflict(Exception):
+    """The employee's day does not allow this action; `reason` says why."""
+
+    ALREADY_CHECKED_IN = "already_checked_in"
+    NOT_CHECKED_IN = "not_checked_in"
+    ALREADY_CHECKED_OUT = "already_checked_out"
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+# Check-in claims the day's first check-in slot in daily_attendance, whose primary key
+# (user_email, work_date) serialises concurrent submits for the same employee and day
+_CHECK_IN_GATE = """
+    INSERT INTO daily_attendance AS d
+    (user_email, work_date, first_check_in, last_check_out, worked_seconds, check_in_count, source, updated_at)
+    VALUES (%(user_email)s, %(work_date)s, %(event_time)s, NULL, 0, 1, 'geo', CURRENT_TIMESTAMP)
+    ON CONFLICT (user_email, work_date) DO UPDATE SET
+        check_in_count = d.check_in_count + 1,
+        first_check_in = EXCLUDED.first_check_in,
+        worked_seconds = COALESCE(TRUNC(EXTRACT(EPOCH FROM d.last_check_out - EXCLUDED.first_check_in))::int, 0),
+        updated_at = CURRENT_TIMESTAMP
+    WHERE d.first_check_in IS NULL
+    RETURNING d.user_email, d.first_check_in, d.last_check_out, d.worked_seconds
+"""
+
+# Check-out fills the day's check-out slot, only after a check-in and only once
+_CHECK_OUT_GATE = """
+    UPDATE daily_attendance AS d SET
+        last_check_out = %(event_time)s,
+        worked_seconds = COALESCE(TRUNC(EXTRACT(EPOCH FROM %(event_time)s - d.first_check_in))::int, 0),
+        updated_at = CURRENT_TIMESTAMP
+    WHERE d.user_email = %(user_email)s AND d.work_date = %(work_date)s
+      AND d.first_check_in IS NOT NULL AND d.last_check_out IS NULL
+    RETURNING d.user_email, d.first_check_in, d.last_check_out, d.worked_seconds
+"""
+
+
+def insert_attendance_record(db, user_email: str, action: str, event_time, latitude=None,
+                             longitude=None, location_text: str = None, comment: str = None) -> Dict:
+    """
+    Record an employee's own check-in or check-out for event_time's IST day and commit.
+
+    One statement claims the day's check-in or check-out slot in daily_attendance and,
+    only if that succeeded, inserts the event, counts the working day and saves the
+    comment as the latest one. Raises AttendanceConflict when the day already has the
+    action (or a check-out has no check-in), however many requests race for it.
+    Returns the new record's id, event_time (naive UTC) and work_date, plus the day's
+    updated daily_attendance status under "day", so callers need no follow-up read.
+    """
+    cursor = db.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    try:
+        record = _insert_attendance_event(
+            cursor, user_email, action, event_time, latitude, longitude, location_text, comment
+        )
+    except AttendanceConflict:
+        db.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    db.commit()
+    invalidate_employee_profile(user_email)
+    return record
+
+
+def _insert_attendance_event(cursor, user_email: str, action: str, event_time, latitude=None,
+                             longitude=None, location_text: str = None, comment: str = None) -> Dict:
+    """The statement behind insert_attendance_record, without the commit (RealDictCursor)."""
+    if event_time.tzinfo is not None:
+        event_time = event_time.astimezone(pytz.UTC).replace(tzinfo=None)
+    work_date = pytz.UTC.localize(event_time).astimezone(IST).date()
+    period_start, period_end = get_attendance_period_dates(work_date)
+
+    cursor.execute(
+        f"""WITH gate AS ({_CHECK_IN_GATE if action == "check-in" else _CHECK_OUT_GATE}),
+           inserted AS (
+               INSERT INTO attendance
+               (user_email, action, event_time, latitude, longitude, location_text, comment)
+               SELECT %(user_email)s, %(action)s, %(event_time)s, %(latitude)s, %(longitude)s,
+                      %(location_text)s, %(comment)s
+               FROM gate
+               RETURNING id, event_time, work_date
+           ),
+           worked AS (
+               INSERT INTO attendance_period_ledger AS l
+               (user_email, period_start, period_end, working_days, updated_at)
+               SELECT e.email, %(period_start)s, %(period_end)s, 1, CURRENT_TIMESTAMP
+               FROM gate JOIN employee_details e ON e.email = gate.user_email
+               WHERE %(action)s = 'check-in'
+               ON CONFLICT (user_email, period_start) DO UPDATE SET
+                   working_days = l.working_days + 1,
+                   updated_at = CURRENT_TIMESTAMP
+           ),
+           latest_comment AS (
+               INSERT INTO employee_attendance_summary AS s
+               (user_email, last_comment, last_comment_at, last_comment_attendance_id, updated_at)
+               SELECT %(user_email)s, %(comment)s, i.event_time, i.id, CURRENT_TIMESTAMP
+               FROM inserted i
+               WHERE %(comment)s::text IS NOT NULL
+               ON CONFLICT (user_email) DO UPDATE SET
+                   last_comment = EXCLUDED.last_comment,
+                   last_comment_at = EXCLUDED.last_comment_at,
+                   last_comment_attendance_id = EXCLUDED.last_comment_attendance_id,
+                   updated_at = CURRENT_TIMESTAMP
+               WHERE s.last_comment_at IS NULL OR s.last_comment_at <= EXCLUDED.last_comment_at
+           )
+           SELECT i.id, i.event_time, i.work_date, d.first_check_in IS NOT NULL AS checked_in,
+                  (g.first_check_in AT TIME ZONE 'UTC') AT TIME ZONE 'Asia/Kolkata' AS day_first_check_in,
+                  (g.last_check_out AT TIME ZONE 'UTC') AT TIME ZONE 'Asia/Kolkata' AS day_last_check_out,
+                  g.worked_seconds AS day_worked_seconds
+           FROM (SELECT 1) AS one
+           LEFT JOIN inserted i ON TRUE
+           LEFT JOIN gate g ON TRUE
+           LEFT JOIN daily_attendance d ON d.user_email = %(user_email)s AND d.work_date = %(work_date)s""",
+        {
+            "user_email": user_email, "action": action, "event_time": event_time,
+            "work_date": work_date, "period_start": period_start, "period_end": period_end,
+            "latitude": latitude, "longitude": longitude, "location_text": location_text,
+            "comment": comment,
+        }
+    )
+    row = cursor.fetchone()
+    if row["id"] is None:
+        if action == "check-in":
+            raise AttendanceConflict(AttendanceConflict.ALREADY_CHECKED_IN)
+        raise AttendanceConflict(
+            AttendanceConflict.ALREADY_CHECKED_OUT if row["checked_in"] else AttendanceConflict.NOT_CHECKED_IN
+        )
+    return {
+        "id": row["id"], "event_time": row["event_time"], "work_date": row["work_date"],
+        # The day's daily_attendance row after this event, times in IST
+        "day": {
+            "work_date": row["work_date"],
+            "first_check_in": row["day_first_check_in"],
+            "last_check_out": row["day_last_check_out"],
+            "worked_seconds": row["day_worked_seconds"],
+        },
+    }
+
+
+def _record_daily_attendance(cursor, user_email: str, work_date: date, action: str, event_time, source: str):
+    """
+    Fold one event into the employee's daily_attendance row (same transaction as the insert).
+    The day's first check-in also counts a working day in the payroll period ledger.
+    """
+    first_check_in = event_time if action == "check-in" else None
+    last_check_out = event_time if action == "check-out" else None
+    check_ins = 1 if action == "check-in" else 0
+    cursor.execute(
+        """
+        INSERT INTO daily_attendance AS d
+        (user_email, work_date, first_check_in, last_check_out, worked_seconds, check_in_count, source, updated_at)
+        VALUES (%s, %s, %s, %s, 0, %s, %s, CURRENT_TIMESTAMP)
+        ON CONFLICT (user_email, work_date) DO UPDATE SET
+            check_in_count = d.check_in_count + EXCLUDED.check_in_count,
+            first_check_in = LEAST(d.first_check_in, EXCLUDED.first_check_in),
+            last_check_out = GREATEST(d.last_check_out, EXCLUDED.last_check_out),
+            worked_seconds = COALESCE(TRUNC(EXTRACT(EPOCH FROM
+                GREATEST(d.last_check_out, EXCLUDED.last_check_out)
+                - LEAST(d.first_check_in, EXCLUDED.first_check_in)
+            ))::int, 0),
+            source = CASE WHEN EXCLUDED.source = 'manual' THEN 'manual' ELSE d.source END,
+            updated_at = CURRENT_TIMESTAMP
+        RETURNING check_in_count
+        """,
+        (user_email, work_date, first_check_in, last_check_out, check_ins, source)
+    )
+    # The row lock serialises concurrent check-ins, so exactly one of them sees a count of 1
+    if check_ins and cursor.fetchone()[0] == 1:
+        _add_period_working_days(cursor, [(user_email, work_date)])
+
+
+def _add_period_working_days(cursor, worked_days):
+    """
+    Count newly worked (user_email, work_date) days in the ledger rows of their payroll
+    periods, one statement for any number of days. Unknown employees are skipped.
+    """
+    increments = {}
+    for user_email, work_date in worked_days:
+        key = (user_email, *get_attendance_period_dates(work_date))
+        increments[key] = increments.get(key, 0) + 1
+    if not increments:
+        return
+
+    psycopg2.extras.execute_values(
+        cursor,
+        """
+        INSERT INTO attendance_period_ledger AS l
+        (user_email, period_start, period_end, working_days, updated_at)
+        SELECT e.email, v.period_start, v.period_end, v.days, CURRENT_TIMESTAMP
+        FROM (VALUES %s) AS v (user_email, period_start, period_end, days)
+        JOIN employee_details e ON e.email = v.user_email
+        ON CONFLICT (user_email, period_start) DO UPDATE SET
+            working_days = l.working_days + EXCLUDED.working_days,
+            updated_at = CURRENT_TIMESTAMP
+        """,
+        [(email, start, end, days) for (email, start, end), days in increments.items()],
+        template="(%s, %s::date, %s::date, %s)"
+    )
+
+
+def add_manual_attendance_record(db, employee_email: str, action: str, event_time):
+    """Insert an HR-entered attendance event; the day's first check-in counts as a working day."""
+    cursor = db.cursor()
+    cursor.execute(
+        """INSERT INTO attendance (user_email, action, event_time, latitude, longitude, location_text)
+           VALUES (%s, %s, %s, %s, %s, %s)
+           RETURNING event_time, work_date""",
+        (employee_email, action, event_time, None, None, "Manual Entry by HR")
+    )
+    stored_event_time, work_date = cursor.fetchone()
+    _record_daily_attendance(cursor, employee_email, work_date, action, stored_event_time, "manual")
+    db.commit()
+    cursor.close()
+    invalidate_employee_profile(employee_email)
+
+
 def fetch_all_employees(db) -> List[Dict]:
     cursor = db.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    cursor.execute("SELECT * FROM employee_details WHERE email != %s", (config.HR_EMAIL,))
-    employees = cursor.fetchall()
+    cursor.execute(
+        _EMPLOYEE_WITH_PERIOD_TOTALS + " WHERE e.email != %s ORDER BY e.name ASC",
+        (_current_period_start(), config.HR_EMAIL)
+    )
+    employees = [_apply_period_totals(employee) for employee in cursor.fetchall()]
     cursor.close()
 
     # If DB has no rows yet, fall back to the static `employees` data (employees.py)
@@ -113,45 +781,83 @@ def fetch_all_employees(db) -> List[Dict]:
             ]
         except Exception:
             employees = []
-    else:
-        # If employees exist in DB, merge with static data to fill null fields
-        for emp in employees:
-            email = emp.get("email")
-            if email and email in static_users:
-                static_user = static_users[email]
-                # Fill in any missing/null fields from static data
-                if not emp.get("phone"):
-                    emp["phone"] = static_user.get("phone")
-                if not emp.get("parent_phone"):
-                    emp["parent_phone"] = static_user.get("parent_phone")
-                if not emp.get("dob"):
-                    emp["dob"] = static_user.get("dob")
-                if not emp.get("gender"):
-                    emp["gender"] = static_user.get("gender")
-                if not emp.get("employee_number"):
-                    emp["employee_number"] = static_user.get("employee_number")
-                if not emp.get("aadhar"):
-                    emp["aadhar"] = static_user.get("aadhar")
-                if not emp.get("joining_date"):
-                    emp["joining_date"] = static_user.get("joining_date")
-                if not emp.get("native"):
-                    emp["native"] = static_user.get("native")
-                if not emp.get("address"):
-                    emp["address"] = static_user.get("address")
-                if not emp.get("photo") or emp.get("photo") == "profile.jpg":
-                    emp["photo"] = static_user.get("photo", "profile.jpg")
-                if not emp.get("job_role"):
-                    emp["job_role"] = static_user.get("job_role", "Employee")
-                if not emp.get("pan_card"):
-                    emp["pan_card"] = static_user.get("pan_card")
-                if not emp.get("salary"):
-                    emp["salary"] = static_user.get("salary")
-                if not emp.get("bank_details"):
-                    emp["bank_details"] = static_user.get("bank_details")
 
     return employees
 
 
+def employee_email_exists(db, email: str, exclude_email: str = None) -> bool:
+    """Check whether an employee with this email exists (optionally ignoring one email)."""
+    cursor = db.cursor()
+    if exclude_email is None:
+        cursor.execute("SELECT 1 FROM employee_details WHERE email = %s", (email,))
+    else:
+        cursor.execute("SELECT 1 FROM employee_details WHERE email = %s AND email != %s", (email, exclude_email))
+    exists = cursor.fetchone() is not None
+    cursor.close()
+    return exists
+
+
+def employee_name_exists(db, name: str, exclude_email: str = None) -> bool:
+    """Case-insensitive check for an existing employee name (optionally ignoring one email)."""
+    cursor = db.cursor()
+    if exclude_email is None:
+        cursor.execute("SELECT 1 FROM employee_details WHERE LOWER(name) = LOWER(%s)", (name,))
+    else:
+        cursor.execute("SELECT 1 FROM employee_details WHERE LOWER(name) = LOWER(%s) AND email != %s", (name, exclude_email))
+    exists = cursor.fetchone() is not None
+    cursor.close()
+    return exists
+
+
+def fetch_employee_photo(db, email: str) -> Optional[str]:
+    """Return the stored photo filename for an employee, if any."""
+    cursor = db.cursor()
+    cursor.execute("SELECT photo FROM employee_details WHERE email = %s", (email,))
+    row = cursor.fetchone()
+    cursor.close()
+    return row[0] if row else None
+
+
+def create_employee(db, employee: Dict):
+    """Insert an employee_details row from a column -> value dict and commit."""
+    columns = list(employee.keys())
+    query = f"INSERT INTO employee_details ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+    cursor = db.cursor()
+    cursor.execute(query, [employee[c] for c in columns])
+    db.commit()
+    cursor.close()
+    invalidate_employee_profile(employee["email"])
+
+
+def update_employee_fields(db, email: str, fields: Dict):
+    """
+    Update the given employee_details columns (column -> value) and commit. A new email
+    also moves the employee's attendance events and daily_attendance rows, which have no
+    foreign key to cascade through, in the same transaction.
+    """
+    update_fields = [f"{column} = %s" for column in fields]
+    update_fields.append("updated_at = CURRENT_TIMESTAMP")
+    query = f"UPDATE employee_details SET {', '.join(update_fields)} WHERE email = %s"
+    cursor = db.cursor()
+    cursor.execute(query, list(fields.values()) + [email])
+    new_email = fields.get("email", email)
+    if new_email != email:
+        cursor.execute("UPDATE daily_attendance SET user_email = %s WHERE user_email = %s", (new_email, email))
+        cursor.execute("UPDATE attendance SET user_email = %s WHERE user_email = %s", (new_email, email))
+    db.commit()
+    cursor.close()
+    invalidate_employee_profile(email, fields.get("email", email))
+
+
+def delete_employee_record(db, email: str):
+    """Delete an employee and commit."""
+    cursor = db.cursor()
+    cursor.execute("DELETE FROM employee_details WHERE email = %s", (email,))
+    db.commit()
+    cursor.close()
+    invalidate_employee_profile(email)
+
+
 def fetch_notifications_for_user(db, user_email: str) -> List[Dict]:
     """Fetch unread notifications for a user."""
     cursor = db.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
@@ -178,68 +884,1139 @@ def mark_notification_as_read(db, notification_id: int):
     cursor.close()
 
 
-def fetch_attendance_for_period(user_email: str, start_date: date, end_date: date) -> List[Dict]:
-    """Fetch attendance records for a user within a date range."""
-    conn = psycopg2.connect(
-        host=config.DB_HOST,
-        port=config.DB_PORT,
-        user=config.DB_USER,
-        password=config.DB_PASSWORD,
-        database=config.DB_NAME
-    )
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+def fetch_attendance_for_period(user_email: str, start_date: date, end_date: date, db=None) -> List[Dict]:
+    """
+    Fetch attendance records for a user within an IST date range.
+    Uses `db` when the caller already holds a connection, otherwise borrows one from the pool.
+    """
+    if db is None:
+        with db_connection() as conn:
+            return fetch_attendance_for_period(user_email, start_date, end_date, conn)
+
+    cursor = db.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
     cursor.execute(
         """SELECT * FROM attendance 
-           WHERE user_email = %s AND DATE(event_time) BETWEEN %s AND %s
+           WHERE user_email = %s AND work_date BETWEEN %s AND %s
+             AND event_time >= %s AND event_time < %s
            ORDER BY event_time""",
-        (user_email, start_date, end_date)
+        (user_email, start_date, end_date, *ist_day_bounds_utc(start_date, end_date))
     )
     records = cursor.fetchall()
     cursor.close()
-    conn.close()
     return records
 
 
-def update_employee_leave(user_email: str, new_leave_count: int):
-    """Update the total leave count for an employee."""
-    conn = psycopg2.connect(
-        host=config.DB_HOST,
-        port=config.DB_PORT,
-        user=config.DB_USER,
-        password=config.DB_PASSWORD,
-        database=config.DB_NAME
-    )
-    cursor = conn.cursor()
+# The daily absence job (job_runs name) and how many days back a check-in still counts
+ABSENCE_JOB_NAME = "mark_absent_employees"
+ABSENCE_LOOKBACK_DAYS = 3
+# Taken exclusively while absence_marks are written and shared by offline syncs reversing them
+ABSENCE_MARKS_LOCK_ID = 4_221_170_002
+
+
+def mark_absent_employees(db, first_day: date, last_day: date, exclude_email: str,
+                          lookback_days: int = ABSENCE_LOOKBACK_DAYS, commit: bool = True) -> Dict:
+    """
+    For every IST day first_day..last_day, add one leave day, in the payroll period
+    containing that day, to every employee with no check-in in the lookback_days
+    before it (and on it). All days are marked in a single statement, so catching up
+    on missed runs costs the same round trip as a normal daily run.
+
+    Each leave day is recorded in absence_marks, which a check-in synced later for a
+    marked day reverses (see record_offline_attendance); a day already marked is not
+    counted twice. The statement runs under ABSENCE_MARKS_LOCK_ID, so it waits for
+    offline syncs in progress and they wait for it.
+
+    Returns counts for last_day's window, the emails that were marked absent and the
+    total leave days added. With commit=False the caller commits and invalidates the
+    marked profiles.
+    """
+    days, period_starts, period_ends = [], [], []
+    day = first_day
+    while day <= last_day:
+        period_start, period_end = get_attendance_period_dates(day)
+        days.append(day)
+        period_starts.append(period_start)
+        period_ends.append(period_end)
+        day += timedelta(days=1)
+
+    cursor = db.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    cursor.execute("SELECT pg_advisory_xact_lock(%s)", (ABSENCE_MARKS_LOCK_ID,))
     cursor.execute(
-        "UPDATE employee_details SET total_leave = %s WHERE email = %s",
-        (new_leave_count, user_email)
+        """WITH days AS (
+               SELECT * FROM unnest(%(days)s::date[], %(period_starts)s::date[], %(period_ends)s::date[])
+                   AS d(day, period_start, period_end)
+           ),
+           checked_in AS (
+               SELECT user_email, bool_or(work_date = %(last_day)s) AS today
+               FROM daily_attendance
+               WHERE first_check_in IS NOT NULL
+                 AND work_date BETWEEN %(last_day)s::date - %(lookback_days)s AND %(last_day)s
+               GROUP BY user_email
+           ),
+           absent_days AS (
+               SELECT e.email, d.day, d.period_start, d.period_end
+               FROM employee_details e CROSS JOIN days d
+               WHERE e.email <> %(exclude_email)s
+                 AND NOT EXISTS (
+                     SELECT 1 FROM daily_attendance a
+                     WHERE a.user_email = e.email AND a.first_check_in IS NOT NULL
+                       AND a.work_date BETWEEN d.day - %(lookback_days)s AND d.day
+                 )
+           ),
+           recorded AS (
+               INSERT INTO absence_marks (user_email, work_date, period_start, lookback_days)
+               SELECT email, day, period_start, %(lookback_days)s FROM absent_days
+               ON CONFLICT (user_email, work_date) DO NOTHING
+               RETURNING user_email, work_date
+           ),
+           absences AS (
+               SELECT a.email, a.period_start, a.period_end, COUNT(*) AS leave_days
+               FROM absent_days a
+               JOIN recorded r ON r.user_email = a.email AND r.work_date = a.day
+               GROUP BY a.email, a.period_start, a.period_end
+           ),
+           marked AS (
+               INSERT INTO attendance_period_ledger AS l
+               (user_email, period_start, period_end, leave_days, updated_at)
+               SELECT email, period_start, period_end, leave_days, CURRENT_TIMESTAMP
+               FROM absences
+               ON CONFLICT (user_email, period_start) DO UPDATE SET
+                   leave_days = l.leave_days + EXCLUDED.leave_days,
+                   updated_at = CURRENT_TIMESTAMP
+               RETURNING l.user_email AS email
+           )
+           SELECT
+               (SELECT COUNT(*) FROM employee_details WHERE email <> %(exclude_email)s) AS employees,
+               (SELECT COUNT(*) FROM checked_in c JOIN employee_details e ON e.email = c.user_email
+                WHERE c.today AND e.email <> %(exclude_email)s) AS present_today,
+               (SELECT COUNT(*) FROM checked_in c JOIN employee_details e ON e.email = c.user_email
+                WHERE e.email <> %(exclude_email)s) AS checked_in_window,
+               (SELECT COALESCE(array_agg(DISTINCT email ORDER BY email), '{}') FROM marked) AS marked_absent,
+               (SELECT COALESCE(SUM(leave_days), 0)::int FROM absences) AS leave_days_added""",
+        {
+            "days": days, "period_starts": period_starts, "period_ends": period_ends,
+            "last_day": last_day, "lookback_days": lookback_days,
+            "exclude_email": exclude_email,
+        }
     )
-    conn.commit()
+    result = dict(cursor.fetchone())
     cursor.close()
-    conn.close()
+    if commit:
+        db.commit()
+        invalidate_employee_profile(*result["marked_absent"])
+    return result
 
 
-def fetch_monthly_attendance_all(year: int, month: int) -> List[Dict]:
-    """Fetch all attendance records for a specific calendar month."""
-    conn = psycopg2.connect(
-        host=config.DB_HOST,
-        port=config.DB_PORT,
-        user=config.DB_USER,
-        password=config.DB_PASSWORD,
-        database=config.DB_NAME
-    )
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    cursor.execute(
+def iter_monthly_attendance_all(year: int, month: int):
+    """Stream all attendance records for a specific IST calendar month."""
+    first_day = date(year, month, 1)
+    last_day = (first_day + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    return iter_query_rows(
         """SELECT user_email, action, event_time, latitude, longitude, location_text 
            FROM attendance 
-           WHERE EXTRACT(YEAR FROM event_time) = %s AND EXTRACT(MONTH FROM event_time) = %s
+           WHERE event_time >= %s AND event_time < %s
            ORDER BY event_time""",
-        (year, month)
+        ist_day_bounds_utc(first_day, last_day),
+        cursor_factory=psycopg2.extras.RealDictCursor
     )
-    records = cursor.fetchall()
+
+
+# ===========================================================================
+# ATTENDANCE GROUP COMMIT
+# ===========================================================================
+
+class AttendanceWriteCoalescer:
+    """
+    Batches check-in/check-out writes from concurrent requests into one transaction.
+
+    A single writer thread takes the first queued write, keeps collecting for
+    `window` seconds (or until `max_batch` writes), then runs each write's statement
+    under its own savepoint and commits the batch once: one commit (and fsync) per
+    batch instead of one per request. Every caller's Future resolves with its own
+    record, AttendanceConflict or database error once the commit has succeeded;
+    if the commit fails, every write in the batch fails with it.
+    """
+
+    def __init__(self, window: float, max_batch: int):
+        self.window = window
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._closing = False
+        self._closing_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._writes = 0
+        self._largest_batch = 0
+        self._thread = threading.Thread(target=self._run, name="attendance-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, user_email: str, action: str, event_time, latitude=None, longitude=None,
+               location_text: str = None, comment: str = None) -> Future:
+        future = Future()
+        with self._closing_lock:
+            if self._closing:
+                future.set_exception(RuntimeError("Attendance writer is shut down"))
+                return future
+            self._queue.put((future, (user_email, action, event_time, latitude, longitude, location_text, comment)))
+        return future
+
+    def close(self):
+        """Write whatever is queued, then stop the writer thread; later submits fail at once."""
+        with self._closing_lock:
+            if self._closing:
+                return
+            self._closing = True
+            self._queue.put(None)
+        self._thread.join()
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            return {
+                "window_ms": self.window * 1000,
+                "batches": self._batches,
+                "writes": self._writes,
+                "largest_batch": self._largest_batch,
+                "queued": self._queue.qsize(),
+            }
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._write_batch(batch)
+
+    def _write_batch(self, batch):
+        written = []
+        conflicts = []
+        try:
+            with db_connection() as conn:
+                cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+                try:
+                    for future, args in batch:
+                        cursor.execute("SAVEPOINT attendance_write")
+                        try:
+                            record = _insert_attendance_event(cursor, *args)
+                        except AttendanceConflict as e:
+                            # Answered only after the commit: the conflict reflects rows it makes final
+                            cursor.execute("RELEASE SAVEPOINT attendance_write")
+                            conflicts.append((future, e))
+                            continue
+                        except psycopg2.Error as e:
+                            cursor.execute("ROLLBACK TO SAVEPOINT attendance_write")
+                            future.set_exception(e)
+                            continue
+                        cursor.execute("RELEASE SAVEPOINT attendance_write")
+                        written.append((future, args[0], record))
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                finally:
+                    cursor.close()
+        except Exception as e:
+            print(f"Attendance batch of {len(batch)} failed: {e}")
+            for future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        invalidate_employee_profile(*{user_email for _, user_email, _ in written})
+        for future, _, record in written:
+            future.set_result(record)
+        for future, conflict in conflicts:
+            future.set_exception(conflict)
+        with self._stats_lock:
+            self._batches += 1
+            self._writes += len(written)
+            self._largest_batch = max(self._largest_batch, len(batch))
+
+
+_attendance_writer: Optional[AttendanceWriteCoalescer] = None
+_attendance_writer_lock = threading.Lock()
+
+
+def get_attendance_writer() -> Optional[AttendanceWriteCoalescer]:
+    """The process-wide group-commit writer, or None when ATTENDANCE_GROUP_COMMIT_MS is 0."""
+    global _attendance_writer
+    if config.ATTENDANCE_GROUP_COMMIT_MS <= 0:
+        return None
+    if _attendance_writer is None:
+        with _attendance_writer_lock:
+            if _attendance_writer is None:
+                _attendance_writer = AttendanceWriteCoalescer(
+                    config.ATTENDANCE_GROUP_COMMIT_MS / 1000, config.ATTENDANCE_GROUP_COMMIT_MAX_BATCH
+                )
+    return _attendance_writer
+
+
+def get_attendance_writer_stats() -> Dict:
+    """Group-commit counters; empty while the writer is disabled or unused."""
+    return _attendance_writer.stats() if _attendance_writer is not None else {}
+
+
+def close_attendance_writer():
+    """Flush and stop the group-commit writer (application shutdown)."""
+    global _attendance_writer
+    with _attendance_writer_lock:
+        if _attendance_writer is not None:
+            _attendance_writer.close()
+            _attendance_writer = None
+
+
+async def write_attendance_record(user_email: str, action: str, event_time, latitude=None,
+                                  longitude=None, location_text: str = None, comment: str = None) -> Dict:
+    """
+    insert_attendance_record for async handlers: through the group-commit writer when
+    enabled, otherwise on the DB thread pool with a connection borrowed just for the write.
+    """
+    writer = get_attendance_writer()
+    if writer is not None:
+        return await asyncio.wrap_future(
+            writer.submit(user_email, action, event_time, latitude, longitude, location_text, comment)
+        )
+
+    def write():
+        with db_connection() as conn:
+            return insert_attendance_record(
+                conn, user_email, action, event_time, latitude, longitude, location_text, comment
+            )
+    return await run_db(write)
+
+
+# ===========================================================================
+# IDEMPOTENCY KEYS
+# ===========================================================================
+
+def claim_idempotency_key(db, user_email: str, endpoint: str, key: str, request_hash: str) -> Optional[Dict]:
+    """
+    Claim a client-supplied idempotency key for one request, in one round trip.
+
+    Returns None when the key is new (or expired) and the caller should run the request,
+    then complete_idempotency_key or release_idempotency_key. Otherwise returns the stored
+    row: request_hash plus status_code, headers and body, with status_code None while the
+    first request is still running. Commits on `db`.
+    """
+    cursor = db.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    cursor.execute(
+        """WITH claimed AS (
+               INSERT INTO idempotency_keys AS k
+               (user_email, endpoint, idempotency_key, request_hash, expires_at)
+               VALUES (%(user_email)s, %(endpoint)s, %(key)s, %(request_hash)s,
+                       CURRENT_TIMESTAMP + make_interval(secs => %(ttl)s))
+               ON CONFLICT (user_email, endpoint, idempotency_key) DO UPDATE SET
+                   request_hash = EXCLUDED.request_hash, status_code = NULL, headers = NULL, body = NULL,
+                   created_at = CURRENT_TIMESTAMP, expires_at = EXCLUDED.expires_at
+               WHERE k.expires_at <= CURRENT_TIMESTAMP
+               RETURNING 1
+           )
+           SELECT EXISTS (SELECT 1 FROM claimed) AS claimed,
+                  k.request_hash, k.status_code, k.headers, k.body
+           FROM (SELECT 1) AS one
+           LEFT JOIN idempotency_keys k
+             ON k.user_email = %(user_email)s AND k.endpoint = %(endpoint)s
+            AND k.idempotency_key = %(key)s AND k.expires_at > CURRENT_TIMESTAMP""",
+        {
+            "user_email": user_email, "endpoint": endpoint, "key": key,
+            "request_hash": request_hash, "ttl": config.IDEMPOTENCY_KEY_TTL_SECONDS,
+        }
+    )
+    row = cursor.fetchone()
+    db.commit()
     cursor.close()
-    conn.close()
-    return records
+
+    if row["claimed"]:
+        return None
+    # A concurrent first request committed after this statement's snapshot: still running
+    if row["request_hash"] is None:
+        return {"request_hash": request_hash, "status_code": None, "headers": None, "body": None}
+    return _stored_idempotency_outcome(row)
+
+
+def fetch_idempotency_key(db, user_email: str, endpoint: str, key: str) -> Optional[Dict]:
+    """
+    The live row for a key (request_hash, status_code, headers, body), or None once it
+    has been released or has expired. Used to wait for a first request still running.
+    """
+    cursor = db.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    cursor.execute(
+        """SELECT request_hash, status_code, headers, body FROM idempotency_keys
+           WHERE user_email = %s AND endpoint = %s AND idempotency_key = %s
+             AND expires_at > CURRENT_TIMESTAMP""",
+        (user_email, endpoint, key)
+    )
+    row = cursor.fetchone()
+    db.commit()
+    cursor.close()
+    return _stored_idempotency_outcome(row) if row else None
+
+
+def _stored_idempotency_outcome(row) -> Dict:
+    stored = {name: row[name] for name in ("request_hash", "status_code", "headers", "body")}
+    if stored["body"] is not None:
+        stored["body"] = bytes(stored["body"])
+    return stored
+
+
+def complete_idempotency_key(db, user_email: str, endpoint: str, key: str,
+                             status_code: int, headers: Dict, body: bytes):
+    """Store the response of a claimed key so retries replay it until the key expires."""
+    cursor = db.cursor()
+    cursor.execute(
+        """UPDATE idempotency_keys SET status_code = %s, headers = %s, body = %s
+           WHERE user_email = %s AND endpoint = %s AND idempotency_key = %s""",
+        (status_code, psycopg2.extras.Json(headers), psycopg2.Binary(body), user_email, endpoint, key)
+    )
+    db.commit()
+    cursor.close()
+
+
+def release_idempotency_key(db, user_email: str, endpoint: str, key: str):
+    """
+    Forget a claimed key whose request failed, so a retry runs it again. Rolls back
+    whatever the failed request left open on `db` first.
+    """
+    db.rollback()
+    cursor = db.cursor()
+    cursor.execute(
+        """DELETE FROM idempotency_keys
+           WHERE user_email = %s AND endpoint = %s AND idempotency_key = %s AND status_code IS NULL""",
+        (user_email, endpoint, key)
+    )
+    db.commit()
+    cursor.close()
+
+
+def purge_expired_idempotency_keys() -> int:
+    """Delete expired idempotency keys; returns how many were removed."""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM idempotency_keys WHERE expires_at <= CURRENT_TIMESTAMP")
+        purged = cursor.rowcount
+        conn.commit()
+        cursor.close()
+    return purged
+
+
+# ===========================================================================
+# OFFLINE ATTENDANCE SYNC
+# ===========================================================================
+
+# First key of the two-key advisory lock that serialises one employee's offline syncs
+OFFLINE_SYNC_LOCK_NAMESPACE = 4_221_171
+
+
+def register_offline_device(db, user_email: str, label: str = None) -> Dict:
+    """
+    Register a device for offline check-ins and commit. Returns device_id, the new random
+    signing_key (only ever returned here), created_at and expires_at (naive UTC).
+    """
+    cursor = db.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    cursor.execute(
+        """INSERT INTO offline_devices (device_id, user_email, label, signing_key, expires_at)
+           VALUES (%s, %s, %s, %s, (NOW() AT TIME ZONE 'UTC') + make_interval(days => %s))
+           RETURNING device_id, signing_key, created_at, expires_at""",
+        (secrets.token_hex(16), user_email, label, secrets.token_hex(32), config.OFFLINE_DEVICE_KEY_TTL_DAYS)
+    )
+    device = dict(cursor.fetchone())
+    db.commit()
+    cursor.close()
+    return device
+
+
+def fetch_offline_devices(db, user_email: str) -> List[Dict]:
+    """An employee's registered offline devices, newest first (without their keys)."""
+    cursor = db.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    cursor.execute(
+        """SELECT device_id, label, created_at, expires_at, revoked_at, last_synced_at
+           FROM offline_devices WHERE user_email = %s ORDER BY created_at DESC""",
+        (user_email,)
+    )
+    devices = cursor.fetchall()
+    cursor.close()
+    return devices
+
+
+def fetch_offline_device(db, user_email: str, device_id: str) -> Optional[Dict]:
+    """One of an employee's devices, including its signing_key, or None."""
+    cursor = db.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    cursor.execute(
+        """SELECT device_id, label, signing_key, created_at, expires_at, revoked_at
+           FROM offline_devices WHERE user_email = %s AND device_id = %s""",
+        (user_email, device_id)
+    )
+    device = cursor.fetchone()
+    cursor.close()
+    return device
+
+
+def revoke_offline_device(db, device_id: str, user_email: str = None) -> bool:
+    """
+    Revoke a device's signing key (only the given employee's when user_email is set) and
+    commit; its unsynced events are refused from then on. False if there was no such device.
+    """
+    cursor = db.cursor()
+    cursor.execute(
+        """UPDATE offline_devices SET revoked_at = COALESCE(revoked_at, NOW() AT TIME ZONE 'UTC')
+           WHERE device_id = %s AND (%s::text IS NULL OR user_email = %s)""",
+        (device_id, user_email, user_email)
+    )
+    found = cursor.rowcount > 0
+    db.commit()
+    cursor.close()
+    return found
+
+
+def _reverse_absence_leave(cursor, user_email: str, work_date: date) -> int:
+    """
+    Take back the leave days the absence job recorded that a newly recorded first check-in
+    on work_date would have prevented: every absence_marks row whose lookback window
+    covers work_date. The marks are deleted. Returns the count.
+    """
+    cursor.execute(
+        """DELETE FROM absence_marks
+           WHERE user_email = %s AND work_date >= %s AND work_date - lookback_days <= %s
+           RETURNING period_start""",
+        (user_email, work_date, work_date)
+    )
+    leave_days = {}
+    for row in cursor.fetchall():
+        leave_days[row["period_start"]] = leave_days.get(row["period_start"], 0) + 1
+    for period_start, days in leave_days.items():
+        cursor.execute(
+            """UPDATE attendance_period_ledger SET leave_days = leave_days - %s, updated_at = CURRENT_TIMESTAMP
+               WHERE user_email = %s AND period_start = %s""",
+            (days, user_email, period_start)
+        )
+    return sum(leave_days.values())
+
+
+def record_offline_attendance(db, user_email: str, device_id: str, events: List[Dict]) -> List[Dict]:
+    """
+    Write an employee's validated offline events (event_id, action, event_time, latitude,
+    longitude, comment) from one device in one transaction, oldest first.
+
+    Events synced before (same event_id) come back as 'duplicate' with their record id;
+    the rest go through the same conditional insert as live check-ins, each under a
+    savepoint, and are 'accepted' or 'rejected' with an AttendanceConflict reason.
+    A check-in accepted for a day the absence job has already marked takes back the
+    leave it prevents.
+    Returns one result per event (event_id, status, reason, record_id, leave_days_reversed)
+    in input order.
+    """
+    results = {}
+    cursor = db.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    try:
+        # Concurrent uploads of the same queue wait here, then see each other's events as duplicates
+        cursor.execute("SELECT pg_advisory_xact_lock(%s, hashtext(%s))", (OFFLINE_SYNC_LOCK_NAMESPACE, user_email))
+        # The absence job waits for this sync to commit (and the sync for the job), so it
+        # either sees these check-ins or has recorded its marks before they are reversed
+        cursor.execute("SELECT pg_advisory_xact_lock_shared(%s)", (ABSENCE_MARKS_LOCK_ID,))
+        cursor.execute(
+            """SELECT event_id, attendance_id FROM offline_attendance_events
+               WHERE user_email = %s AND event_id = ANY(%s)""",
+            (user_email, [event["event_id"] for event in events])
+        )
+        synced = {row["event_id"]: row["attendance_id"] for row in cursor.fetchall()}
+
+        accepted = []
+        for event in sorted(events, key=lambda e: e["event_time"]):
+            event_id = event["event_id"]
+            if event_id in synced:
+                results[event_id] = {"status": "duplicate", "reason": None, "record_id": synced[event_id],
+                                     "leave_days_reversed": 0}
+                continue
+            cursor.execute("SAVEPOINT offline_event")
+            try:
+                record = _insert_attendance_event(
+                    cursor, user_email, event["action"], event["event_time"], event["latitude"],
+                    event["longitude"], f"{event['latitude']:.6f}, {event['longitude']:.6f}", event.get("comment")
+                )
+                reversed_days = 0
+                if event["action"] == "check-in":
+                    reversed_days = _reverse_absence_leave(cursor, user_email, record["work_date"])
+            except AttendanceConflict as e:
+                cursor.execute("RELEASE SAVEPOINT offline_event")
+                results[event_id] = {"status": "rejected", "reason": e.reason, "record_id": None,
+                                     "leave_days_reversed": 0}
+                continue
+            except psycopg2.Error as e:
+                cursor.execute("ROLLBACK TO SAVEPOINT offline_event")
+                results[event_id] = {"status": "rejected", "reason": f"database error: {e}", "record_id": None,
+                                     "leave_days_reversed": 0}
+                continue
+            cursor.execute("RELEASE SAVEPOINT offline_event")
+            results[event_id] = {"status": "accepted", "reason": None, "record_id": record["id"],
+                                 "leave_days_reversed": reversed_days}
+            accepted.append((event_id, record["id"], record["event_time"]))
+
+        if accepted:
+            psycopg2.extras.execute_values(
+                cursor,
+                """INSERT INTO offline_attendance_events (user_email, device_id, event_id, attendance_id, event_time)
+                   SELECT e.email, v.device_id, v.event_id, v.attendance_id, v.event_time
+                   FROM (VALUES %s) AS v (user_email, device_id, event_id, attendance_id, event_time)
+                   JOIN employee_details e ON e.email = v.user_email""",
+                [(user_email, device_id, *row) for row in accepted],
+                template="(%s, %s, %s, %s, %s::timestamp)"
+            )
+        cursor.execute(
+            "UPDATE offline_devices SET last_synced_at = NOW() AT TIME ZONE 'UTC' WHERE device_id = %s",
+            (device_id,)
+        )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    if accepted:
+        invalidate_employee_profile(user_email)
+    return [{"event_id": event["event_id"], **results[event["event_id"]]} for event in events]
+
+
+# ===========================================================================
+# SCHEDULED JOB RUNS
+# ===========================================================================
+
+# First key of the two-key advisory locks that keep a scheduled job on one worker at a time
+JOB_LOCK_NAMESPACE = 4_221_170
+
+
+def run_scheduled_job(job_name: str, slot: str, job) -> Optional[Dict]:
+    """
+    Run `job(conn)` at most once per (job_name, slot) across every worker and instance.
+
+    A session advisory lock keeps concurrent workers out while the job runs, and the
+    job_runs row for the slot records the outcome: a slot that already succeeded is
+    skipped, one that failed or was interrupted is run again. `job` must not commit;
+    its writes are committed together with the 'succeeded' row, so a crash can never
+    leave the job's work applied but unrecorded. `job` returns (rows_affected, result).
+
+    Returns the job's result, or None when the slot was skipped.
+    """
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT pg_try_advisory_lock(%s, hashtext(%s))", (JOB_LOCK_NAMESPACE, job_name))
+        locked = cursor.fetchone()[0]
+        conn.commit()
+        if not locked:
+            print(f"Job {job_name} [{slot}] is running on another worker; skipped")
+            cursor.close()
+            return None
+
+        try:
+            cursor.execute(
+                """INSERT INTO job_runs AS r (job_name, slot, status, worker)
+                   VALUES (%s, %s, 'running', %s)
+                   ON CONFLICT (job_name, slot) DO UPDATE SET
+                       status = 'running', worker = EXCLUDED.worker, attempts = r.attempts + 1,
+                       started_at = CURRENT_TIMESTAMP, finished_at = NULL,
+                       rows_affected = NULL, error = NULL
+                   WHERE r.status <> 'succeeded'
+                   RETURNING id""",
+                (job_name, slot, worker)
+            )
+            claimed = cursor.fetchone()
+            conn.commit()
+            if claimed is None:
+                print(f"Job {job_name} [{slot}] already succeeded; skipped")
+                return None
+            run_id = claimed[0]
+
+            try:
+                rows_affected, result = job(conn)
+                cursor.execute(
+                    """UPDATE job_runs SET status = 'succeeded', finished_at = clock_timestamp(),
+                              rows_affected = %s
+                       WHERE id = %s""",
+                    (rows_affected, run_id)
+                )
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                cursor.execute(
+                    """UPDATE job_runs SET status = 'failed', finished_at = clock_timestamp(), error = %s
+                       WHERE id = %s""",
+                    (f"{type(e).__name__}: {e}"[:1000], run_id)
+                )
+                conn.commit()
+                print(f"Job {job_name} [{slot}] failed: {e}")
+                raise
+            return result
+        finally:
+            conn.rollback()
+            cursor.execute("SELECT pg_advisory_unlock(%s, hashtext(%s))", (JOB_LOCK_NAMESPACE, job_name))
+            conn.commit()
+            cursor.close()
+
+
+def fetch_job_runs(db, job_name: str = None, limit: int = 50) -> List[Dict]:
+    """Most recent scheduled job runs, newest first."""
+    cursor = db.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    cursor.execute(
+        """SELECT job_name, slot, status, attempts, worker, started_at, finished_at,
+                  EXTRACT(EPOCH FROM finished_at - started_at) AS duration_seconds,
+                  rows_affected, error
+           FROM job_runs
+           WHERE %(job_name)s::text IS NULL OR job_name = %(job_name)s
+           ORDER BY started_at DESC
+           LIMIT %(limit)s""",
+        {"job_name": job_name, "limit": limit}
+    )
+    runs = cursor.fetchall()
+    cursor.close()
+    return runs
+
+
+def fetch_last_succeeded_slot(db, job_name: str) -> Optional[str]:
+    """Latest slot (slots are ISO dates, so they sort as text) a job completed successfully, or None."""
+    cursor = db.cursor()
+    cursor.execute(
+        "SELECT MAX(slot) FROM job_runs WHERE job_name = %s AND status = 'succeeded'",
+        (job_name,)
+    )
+    slot = cursor.fetchone()[0]
+    cursor.close()
+    return slot
+
+
+# ===========================================================================
+# BULK ATTENDANCE IMPORT (COPY FROM STDIN)
+# ===========================================================================
+
+ATTENDANCE_IMPORT_COLUMNS = ["user_email", "action", "event_time", "location_text", "comment"]
+ATTENDANCE_IMPORT_REQUIRED = ["user_email", "action", "event_time"]
+
+# Checked in order; each staged row keeps the first reason that applies
+_IMPORT_VALIDATIONS = [
+    ("missing user_email, action or event_time",
+     "user_email IS NULL OR action IS NULL OR event_time_raw IS NULL"),
+    ("invalid action", "action NOT IN ('check-in', 'check-out')"),
+    ("invalid event_time (expected YYYY-MM-DD HH:MM[:SS] in IST)",
+     r"event_time_raw !~ '^\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}(:\d{2})?$'"),
+    # Field ranges are checked before anything is cast, so a bad date never aborts the import
+    ("invalid event_time (expected YYYY-MM-DD HH:MM[:SS] in IST)",
+     """CASE WHEN substr(event_time_raw, 1, 4)::int < 1
+                   OR substr(event_time_raw, 6, 2)::int NOT BETWEEN 1 AND 12 THEN true
+             ELSE NOT (substr(event_time_raw, 12, 2)::int < 24
+                       AND substr(event_time_raw, 15, 2)::int < 60
+                       AND COALESCE(NULLIF(substr(event_time_raw, 18, 2), ''), '0')::int < 60
+                       AND substr(event_time_raw, 9, 2)::int BETWEEN 1 AND EXTRACT(DAY FROM
+                           make_date(substr(event_time_raw, 1, 4)::int, substr(event_time_raw, 6, 2)::int, 1)
+                           + INTERVAL '1 month - 1 day'))
+        END"""),
+]
+
+
+def import_attendance_csv(db, csv_file) -> Dict:
+    """
+    Bulk-load attendance events from a CSV file object (binary), in one transaction.
+
+    The header must name columns from ATTENDANCE_IMPORT_COLUMNS; event_time is IST
+    wall-clock time. Rows are COPYed into a staging table and validated there
+    (known employee, valid action and time, not a duplicate of the file or of
+    stored attendance). Valid rows are merged into attendance, daily_attendance and
+    the payroll ledger. Returns counts plus every rejected row with its CSV line.
+    Raises ValueError for an unusable header.
+    """
+    header_line = csv_file.readline().decode("utf-8-sig").strip()
+    header = [c.strip().lower() for c in next(csv.reader([header_line]))] if header_line else []
+    unknown = [c for c in header if c not in ATTENDANCE_IMPORT_COLUMNS]
+    missing = [c for c in ATTENDANCE_IMPORT_REQUIRED if c not in header]
+    if unknown or missing or len(set(header)) != len(header):
+        raise ValueError(
+            f"CSV header must contain {', '.join(ATTENDANCE_IMPORT_REQUIRED)} "
+            f"and may add {', '.join(c for c in ATTENDANCE_IMPORT_COLUMNS if c not in ATTENDANCE_IMPORT_REQUIRED)}"
+        )
+
+    staging_columns = sql.SQL(", ").join(
+        sql.Identifier("event_time_raw" if c == "event_time" else c) for c in header
+    )
+
+    def load(cursor):
+        cursor.copy_expert(
+            sql.SQL("COPY attendance_import_staging ({}) FROM STDIN WITH (FORMAT csv)")
+               .format(staging_columns).as_string(db),
+            csv_file
+        )
+
+    result = _import_staged_attendance(db, load, "Imported by HR")
+    result["rejections"] = [
+        {
+            "line": row_no + 1, "user_email": email, "action": action, "event_time": raw,
+            "reason": f"duplicate of line {duplicate_of + 1}" if duplicate_of else reason,
+        }
+        for row_no, email, action, raw, reason, duplicate_of in result.pop("rejected_rows")
+    ]
+    return result
+
+
+def add_manual_attendance_batch(db, entries: List[Dict]) -> Dict:
+    """
+    Insert many HR-entered events (dicts with employee_email, attendance_date,
+    attendance_time in IST and action) through the same staged validation and merge
+    as the CSV import: one multi-row insert, and ledger counters updated once per
+    employee and period. Returns counts plus every rejected entry by list index.
+    """
+    def load(cursor):
+        psycopg2.extras.execute_values(
+            cursor,
+            "INSERT INTO attendance_import_staging (user_email, action, event_time_raw) VALUES %s",
+            [
+                (e.get("employee_email"), e.get("action"),
+                 f"{e.get('attendance_date') or ''} {e.get('attendance_time') or ''}".strip() or None)
+                for e in entries
+            ]
+        )
+
+    result = _import_staged_attendance(db, load, "Manual Entry by HR")
+    result["rejections"] = [
+        {
+            "index": row_no - 1, "employee_email": email, "action": action,
+            "reason": f"duplicate of entry {duplicate_of - 1}" if duplicate_of else reason,
+        }
+        for row_no, email, action, _, reason, duplicate_of in result.pop("rejected_rows")
+    ]
+    return result
+
+
+def _import_staged_attendance(db, load, default_location: str) -> Dict:
+    """
+    Validate and merge attendance rows in one transaction. `load(cursor)` fills the
+    temp table attendance_import_staging; rows are checked in bulk (known employee,
+    valid action and IST time, not a duplicate of another staged row or of stored
+    attendance) and valid ones merged into attendance, daily_attendance, the
+    comment summary and the payroll ledger. Returns counts and the raw rejected rows.
+    """
+    cursor = db.cursor()
+    try:
+        cursor.execute("""
+            CREATE TEMP TABLE attendance_import_staging (
+                row_no BIGINT GENERATED ALWAYS AS IDENTITY,
+                user_email TEXT, action TEXT, event_time_raw TEXT, location_text TEXT, comment TEXT,
+                event_time TIMESTAMP, reject_reason TEXT, duplicate_of BIGINT
+            ) ON COMMIT DROP
+        """)
+        load(cursor)
+        cursor.execute("""
+            UPDATE attendance_import_staging SET
+                user_email = NULLIF(lower(trim(user_email)), ''),
+                action = NULLIF(lower(trim(action)), ''),
+                event_time_raw = NULLIF(trim(event_time_raw), ''),
+                location_text = COALESCE(NULLIF(trim(location_text), ''), %s),
+                comment = NULLIF(trim(comment), '')
+        """, (default_location,))
+
+        for reason, condition in _IMPORT_VALIDATIONS:
+            # CASE pins the evaluation order: rows already rejected never reach the casts
+            cursor.execute(
+                f"""UPDATE attendance_import_staging SET reject_reason = %s
+                    WHERE CASE WHEN reject_reason IS NULL THEN ({condition}) ELSE false END""",
+                (reason,)
+            )
+        cursor.execute("""
+            UPDATE attendance_import_staging 
+            SET event_time = (replace(event_time_raw, 'T', ' ')::timestamp AT TIME ZONE 'Asia/Kolkata') AT TIME ZONE 'UTC'
+            WHERE reject_reason IS NULL
+        """)
+        cursor.execute("""
+            UPDATE attendance_import_staging SET reject_reason = 'event_time is in the future'
+            WHERE reject_reason IS NULL AND event_time > (NOW() AT TIME ZONE 'UTC')
+        """)
+        cursor.execute("""
+            UPDATE attendance_import_staging s SET reject_reason = 'unknown employee'
+            WHERE reject_reason IS NULL
+              AND NOT EXISTS (SELECT 1 FROM employee_details e WHERE e.email = s.user_email)
+        """)
+        cursor.execute("""
+            UPDATE attendance_import_staging s SET reject_reason = 'duplicate', duplicate_of = f.first_row
+            FROM (
+                SELECT row_no, MIN(row_no) OVER (PARTITION BY user_email, action, event_time) AS first_row
+                FROM attendance_import_staging WHERE reject_reason IS NULL
+            ) AS f
+            WHERE s.row_no = f.row_no AND f.row_no <> f.first_row
+        """)
+        cursor.execute("""
+            UPDATE attendance_import_staging s SET reject_reason = 'already recorded'
+            WHERE reject_reason IS NULL AND EXISTS (
+                SELECT 1 FROM attendance a
+                WHERE a.user_email = s.user_email AND a.action = s.action AND a.event_time = s.event_time
+            )
+        """)
+
+        # Merge: events, each employee's newest comment, then their days (counting
+        # imported check-ins), in one statement
+        cursor.execute("""
+            WITH inserted AS (
+                INSERT INTO attendance (user_email, action, event_time, location_text, comment)
+                SELECT user_email, action, event_time, location_text, comment
+                FROM attendance_import_staging WHERE reject_reason IS NULL
+                ORDER BY row_no
+                RETURNING id, user_email, action, event_time, work_date, comment
+            ),
+            latest_comment AS (
+                INSERT INTO employee_attendance_summary AS s
+                (user_email, last_comment, last_comment_at, last_comment_attendance_id, updated_at)
+                SELECT DISTINCT ON (user_email) user_email, comment, event_time, id, CURRENT_TIMESTAMP
+                FROM inserted WHERE comment IS NOT NULL
+                ORDER BY user_email, event_time DESC, id DESC
+                ON CONFLICT (user_email) DO UPDATE SET
+                    last_comment = EXCLUDED.last_comment,
+                    last_comment_at = EXCLUDED.last_comment_at,
+                    last_comment_attendance_id = EXCLUDED.last_comment_attendance_id,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE s.last_comment_at IS NULL OR s.last_comment_at <= EXCLUDED.last_comment_at
+            ),
+            days AS (
+                SELECT user_email, work_date,
+                       MIN(event_time) FILTER (WHERE action = 'check-in') AS first_check_in,
+                       MAX(event_time) FILTER (WHERE action = 'check-out') AS last_check_out,
+                       COUNT(*) FILTER (WHERE action = 'check-in') AS check_ins
+                FROM inserted GROUP BY user_email, work_date
+            ),
+            merged AS (
+                INSERT INTO daily_attendance AS d
+                (user_email, work_date, first_check_in, last_check_out, worked_seconds, check_in_count, source, updated_at)
+                SELECT user_email, work_date, first_check_in, last_check_out,
+                       COALESCE(TRUNC(EXTRACT(EPOCH FROM last_check_out - first_check_in))::int, 0),
+                       check_ins, 'manual', CURRENT_TIMESTAMP
+                FROM days
+                ON CONFLICT (user_email, work_date) DO UPDATE SET
+                    check_in_count = d.check_in_count + EXCLUDED.check_in_count,
+                    first_check_in = LEAST(d.first_check_in, EXCLUDED.first_check_in),
+                    last_check_out = GREATEST(d.last_check_out, EXCLUDED.last_check_out),
+                    worked_seconds = COALESCE(TRUNC(EXTRACT(EPOCH FROM
+                        GREATEST(d.last_check_out, EXCLUDED.last_check_out)
+                        - LEAST(d.first_check_in, EXCLUDED.first_check_in)
+                    ))::int, 0),
+                    source = 'manual',
+                    updated_at = CURRENT_TIMESTAMP
+                RETURNING user_email, work_date, check_in_count
+            )
+            SELECT m.user_email, m.work_date, m.check_in_count = days.check_ins AND days.check_ins > 0
+            FROM merged m JOIN days USING (user_email, work_date)
+        """)
+        merged_days = cursor.fetchall()
+        # A day is newly worked when every check-in it now has came from this file
+        _add_period_working_days(cursor, [(email, day) for email, day, newly_worked in merged_days if newly_worked])
+
+        cursor.execute("""
+            SELECT COUNT(*) FILTER (WHERE reject_reason IS NULL), COUNT(*) FILTER (WHERE reject_reason IS NOT NULL)
+            FROM attendance_import_staging
+        """)
+        inserted, rejected = cursor.fetchone()
+        cursor.execute("""
+            SELECT row_no, user_email, action, event_time_raw, reject_reason, duplicate_of
+            FROM attendance_import_staging WHERE reject_reason IS NOT NULL ORDER BY row_no
+        """)
+        rejected_rows = cursor.fetchall()
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    invalidate_employee_profile(*{email for email, _, _ in merged_days})
+    return {
+        "inserted": inserted,
+        "rejected": rejected,
+        "days_updated": len(merged_days),
+        "rejected_rows": rejected_rows,
+    }
+
+
+# ===========================================================================
+# BULK ATTENDANCE EXPORT (COPY TO STDOUT)
+# ===========================================================================
+
+# Columns HR may request, mapped to the SQL that produces them
+ATTENDANCE_EXPORT_COLUMNS = {
+    "id": sql.SQL("id"),
+    "user_email": sql.SQL("user_email"),
+    "action": sql.SQL("action"),
+    "work_date": sql.SQL("work_date"),
+    "event_time_utc": sql.SQL("event_time"),
+    "event_time_ist": sql.SQL("(event_time AT TIME ZONE 'UTC') AT TIME ZONE 'Asia/Kolkata'"),
+    "latitude": sql.SQL("latitude"),
+    "longitude": sql.SQL("longitude"),
+    "location_text": sql.SQL("location_text"),
+    "comment": sql.SQL("comment"),
+}
+DEFAULT_ATTENDANCE_EXPORT_COLUMNS = [
+    "user_email", "action", "work_date", "event_time_ist", "latitude", "longitude", "location_text", "comment"
+]
+
+
+class _QueueWriter:
+    """File-like sink for copy_expert that hands ~chunk_size blocks to a bounded queue."""
+
+    def __init__(self, chunks: queue.Queue, cancelled: threading.Event, chunk_size: int):
+        self._chunks = chunks
+        self._cancelled = cancelled
+        self._chunk_size = chunk_size
+        self._buffer = bytearray()
+
+    def write(self, data):
+        if self._cancelled.is_set():
+            raise IOError("export cancelled by the client")
+        self._buffer += data.encode("utf-8") if isinstance(data, str) else data
+        if len(self._buffer) >= self._chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self._put(bytes(self._buffer))
+            self._buffer = bytearray()
+
+    def _put(self, item):
+        # Block while the client is slow, but notice if it goes away
+        while not self._cancelled.is_set():
+            try:
+                self._chunks.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+        raise IOError("export cancelled by the client")
+
+
+# Caps the COPY exports streaming at once (each holds a pooled connection and a thread)
+_export_slots = threading.BoundedSemaphore(config.EXPORT_MAX_CONCURRENT)
+
+
+def iter_attendance_export(start_date: date, end_date: date, columns: List[str] = None,
+                           user_email: str = None, compress: bool = False, chunk_size: int = 64 * 1024):
+    """
+    Stream attendance between the IST dates start_date..end_date as CSV bytes
+    produced by Postgres `COPY ... TO STDOUT`, optionally gzip-compressed.
+
+    COPY runs on a worker thread with its own pooled connection and feeds a bounded
+    queue, so memory stays flat and a slow client throttles the server. Column names
+    must come from ATTENDANCE_EXPORT_COLUMNS (ValueError otherwise). At most
+    EXPORT_MAX_CONCURRENT exports run at once; beyond that this raises a 503.
+    """
+    columns = columns or DEFAULT_ATTENDANCE_EXPORT_COLUMNS
+    unknown = [c for c in columns if c not in ATTENDANCE_EXPORT_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown export columns: {', '.join(unknown)}")
+
+    filters = [sql.SQL("work_date BETWEEN %(start_date)s AND %(end_date)s"),
+               sql.SQL("event_time >= %(window_start)s AND event_time < %(window_end)s")]
+    if user_email:
+        filters.append(sql.SQL("user_email = %(user_email)s"))
+    query = sql.SQL("COPY (SELECT {columns} FROM attendance WHERE {filters} ORDER BY event_time) "
+                    "TO STDOUT WITH (FORMAT csv, HEADER true)").format(
+        columns=sql.SQL(", ").join(
+            sql.SQL("{} AS {}").format(ATTENDANCE_EXPORT_COLUMNS[c], sql.Identifier(c)) for c in columns
+        ),
+        filters=sql.SQL(" AND ").join(filters),
+    )
+    window_start, window_end = ist_day_bounds_utc(start_date, end_date)
+    params = {"start_date": start_date, "end_date": end_date, "user_email": user_email,
+              "window_start": window_start, "window_end": window_end}
+
+    if not _export_slots.acquire(blocking=False):
+        raise HTTPException(
+            status_code=503, detail="Too many exports in progress, try again shortly",
+            headers={"Retry-After": "30"}
+        )
+    stream = _stream_attendance_export(query, params, compress, chunk_size)
+    # Start the generator so closing or discarding it always releases the slot
+    next(stream)
+    return stream
+
+
+def _stream_attendance_export(query, params: Dict, compress: bool, chunk_size: int):
+    """Generator behind iter_attendance_export; its first (empty) yield only marks it as started."""
+    chunks = queue.Queue(maxsize=8)
+    cancelled = threading.Event()
+    done = object()
+    active = {}  # the connection running COPY, so an abandoned export can cancel it
+    active_lock = threading.Lock()
+
+    def hand_over(item):
+        # Never block forever on a consumer that has gone away
+        while not cancelled.is_set():
+            try:
+                chunks.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def produce():
+        try:
+            with db_connection() as conn:
+                with active_lock:
+                    active["conn"] = conn
+                cursor = conn.cursor()
+                try:
+                    writer = _QueueWriter(chunks, cancelled, chunk_size)
+                    # COPY takes no bind parameters, so they are inlined with mogrify
+                    cursor.copy_expert(cursor.mogrify(query, params).decode("utf-8"), writer)
+                    writer.flush()
+                finally:
+                    with active_lock:
+                        active.pop("conn", None)
+                    cursor.close()
+                    conn.rollback()
+            hand_over(done)
+        except Exception as exc:
+            hand_over(exc)
+
+    try:
+        yield b""
+        producer = threading.Thread(target=produce, name="attendance-export", daemon=True)
+        producer.start()
+
+        compressor = zlib.compressobj(wbits=31) if compress else None  # wbits=31: gzip container
+        last_data = time.monotonic()
+        while True:
+            try:
+                item = chunks.get(timeout=1)
+            except queue.Empty:
+                if not producer.is_alive() and chunks.empty():
+                    raise RuntimeError("Attendance export worker stopped without finishing")
+                if time.monotonic() - last_data > config.EXPORT_STALL_TIMEOUT_SECONDS:
+                    raise TimeoutError(
+                        f"Attendance export produced no data for {config.EXPORT_STALL_TIMEOUT_SECONDS} s"
+                    )
+                continue
+            last_data = time.monotonic()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            if compressor:
+                item = compressor.compress(item)
+                if not item:
+                    continue
+            yield item
+        if compressor:
+            yield compressor.flush()
+    finally:
+        cancelled.set()
+        with active_lock:
+            if "conn" in active:
+                active["conn"].cancel()  # interrupt a COPY still running on the server
+        _export_slots.release()
 
 
 # ===========================================================================
@@ -1,260 +1,1002 @@
 import psycopg2
+import psycopg2.errors
 import psycopg2.extras
+from psycopg2 import sql
+import hashlib
+import json
 import os
+import re
+from datetime import date, datetime
+import pytz
 import config
+from typing import Dict, List
 from employees import users as static_users 
 
-def initialize_database_schema():
-    """Initializes the database schema for Attendance Only."""
-    try:
-        # Connect to postgres default database to create our database
-        conn = psycopg2.connect(
-            host=config.DB_HOST, 
-            user=config.DB_USER, 
-            password=config.DB_PASSWORD, 
-            port=config.DB_PORT,
-            database="postgres"
+IST = pytz.timezone('Asia/Kolkata')
+
+# attendance.event_time holds UTC wall-clock time; this is the IST calendar day it falls on.
+# Both casts are immutable, so the expression can back a stored generated column.
+IST_WORK_DATE_EXPR = "((event_time AT TIME ZONE 'UTC') AT TIME ZONE 'Asia/Kolkata')::date"
+
+ATTENDANCE_COLUMNS = "id, user_email, action, event_time, latitude, longitude, location_text, comment"
+
+ATTENDANCE_PARTITION_NAME = re.compile(r"^attendance_y(\d{4})m(\d{2})$")
+
+
+# ===========================================================================
+# ATTENDANCE PARTITIONING
+# ===========================================================================
+
+def _add_months(month_start: date, months: int) -> date:
+    index = month_start.year * 12 + month_start.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _ist_month_start_utc(month_start: date) -> datetime:
+    """UTC wall-clock time of IST midnight on the first of the month."""
+    return IST.localize(datetime(month_start.year, month_start.month, 1)).astimezone(pytz.UTC).replace(tzinfo=None)
+
+
+def _current_ist_month() -> date:
+    return datetime.now(IST).date().replace(day=1)
+
+
+def _create_partitioned_attendance(cursor):
+    """
+    Create the attendance parent table, partitioned by month on event_time.
+
+    Partition bounds follow IST months, so a monthly report or a 21st-to-20th
+    period touches one or two partitions. The primary key has to include the
+    partition key; rows outside every monthly partition land in attendance_default.
+    """
+    cursor.execute("CREATE SEQUENCE IF NOT EXISTS attendance_id_seq")
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS attendance (
+            id BIGINT NOT NULL DEFAULT nextval('attendance_id_seq'),
+            user_email VARCHAR(255) NOT NULL,
+            action VARCHAR(50) NOT NULL,
+            event_time TIMESTAMP NOT NULL,
+            latitude NUMERIC(10,7) NULL,
+            longitude NUMERIC(10,7) NULL,
+            location_text VARCHAR(255) NULL,
+            comment TEXT NULL,
+            work_date DATE GENERATED ALWAYS AS ({IST_WORK_DATE_EXPR}) STORED,
+            PRIMARY KEY (id, event_time)
+        ) PARTITION BY RANGE (event_time)
+    """)
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = 'attendance'::regclass")
+    if cursor.fetchone()[0] == "p":
+        cursor.execute("ALTER SEQUENCE attendance_id_seq OWNED BY attendance.id")
+        cursor.execute("CREATE TABLE IF NOT EXISTS attendance_default PARTITION OF attendance DEFAULT")
+
+
+def _migrate_attendance_to_partitioned(cursor) -> bool:
+    """Copy a legacy unpartitioned attendance heap into the partitioned table. Returns True if it ran."""
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('attendance')")
+    row = cursor.fetchone()
+    if not row or row[0] == "p":
+        return False
+
+    cursor.execute("ALTER TABLE attendance RENAME TO attendance_unpartitioned")
+    cursor.execute("ALTER INDEX IF EXISTS attendance_pkey RENAME TO attendance_unpartitioned_pkey")
+    # Keep the id sequence alive when the old table is dropped
+    cursor.execute("ALTER SEQUENCE IF EXISTS attendance_id_seq OWNED BY NONE")
+    _create_partitioned_attendance(cursor)
+
+    cursor.execute("SELECT MIN(event_time) FROM attendance_unpartitioned")
+    oldest = cursor.fetchone()[0]
+    if oldest is not None:
+        oldest_month = pytz.UTC.localize(oldest).astimezone(IST).date().replace(day=1)
+        ensure_attendance_partitions(cursor, from_month=oldest_month)
+
+    cursor.execute(f"""
+        INSERT INTO attendance ({ATTENDANCE_COLUMNS})
+        SELECT {ATTENDANCE_COLUMNS} FROM attendance_unpartitioned
+    """)
+    cursor.execute("DROP TABLE attendance_unpartitioned")
+    return True
+
+
+def _create_month_partition(cursor, month_start: date) -> bool:
+    """Create the partition for one IST month. Returns False if it already exists."""
+    name = f"attendance_y{month_start.year}m{month_start.month:02d}"
+    cursor.execute("SELECT to_regclass(%s)", (name,))
+    if cursor.fetchone()[0]:
+        return False
+
+    lower = _ist_month_start_utc(month_start)
+    upper = _ist_month_start_utc(_add_months(month_start, 1))
+
+    # A month's rows may already sit in the default partition; they must move with it
+    cursor.execute(
+        "SELECT EXISTS (SELECT 1 FROM attendance_default WHERE event_time >= %s AND event_time < %s)",
+        (lower, upper)
+    )
+    has_default_rows = cursor.fetchone()[0]
+    if has_default_rows:
+        cursor.execute(
+            f"""CREATE TEMP TABLE attendance_partition_move ON COMMIT DROP AS
+                SELECT {ATTENDANCE_COLUMNS} FROM attendance_default
+                WHERE event_time >= %s AND event_time < %s""",
+            (lower, upper)
         )
-        conn.autocommit = True
-        cursor = conn.cursor()
-        
-        # Check if database exists
-        cursor.execute(f"SELECT 1 FROM pg_database WHERE datname = '{config.DB_NAME}'")
-        db_exists = cursor.fetchone()
-        
-        if not db_exists:
-            cursor.execute(f"CREATE DATABASE {config.DB_NAME}")
-            print(f"Created database: {config.DB_NAME}")
-        else:
-            print(f"Database {config.DB_NAME} already exists")
-        
-        cursor.close()
-        conn.close()
-        
-        # Now connect to the created database
-        conn = psycopg2.connect(
-            host=config.DB_HOST, 
-            user=config.DB_USER, 
-            password=config.DB_PASSWORD, 
-            port=config.DB_PORT,
-            database=config.DB_NAME
+        cursor.execute(
+            "DELETE FROM attendance_default WHERE event_time >= %s AND event_time < %s",
+            (lower, upper)
         )
+
+    cursor.execute(
+        sql.SQL("CREATE TABLE {} PARTITION OF attendance FOR VALUES FROM (%s) TO (%s)").format(sql.Identifier(name)),
+        (lower, upper)
+    )
+
+    if has_default_rows:
+        cursor.execute(f"""
+            INSERT INTO attendance ({ATTENDANCE_COLUMNS})
+            SELECT {ATTENDANCE_COLUMNS} FROM attendance_partition_move
+        """)
+        cursor.execute("DROP TABLE attendance_partition_move")
+    return True
+
+
+def ensure_attendance_partitions(cursor, from_month: date = None, months_ahead: int = None) -> List[str]:
+    """Create monthly partitions from `from_month` (default: current IST month) through `months_ahead` months ahead."""
+    if months_ahead is None:
+        months_ahead = config.ATTENDANCE_PARTITION_MONTHS_AHEAD
+    current = _current_ist_month()
+    month = from_month or current
+    last = _add_months(current, months_ahead)
+
+    created = []
+    while month <= last:
+        if _create_month_partition(cursor, month):
+            created.append(f"attendance_y{month.year}m{month.month:02d}")
+        month = _add_months(month, 1)
+    return created
+
+
+def relocate_default_attendance_rows(cursor, retention_months: int = None) -> List[str]:
+    """
+    Create the monthly partitions for rows that landed in attendance_default (a month whose
+    partition was not created in time), which moves them out of it. Months older than the
+    retention window are left where they are. Returns the partitions created.
+    """
+    if retention_months is None:
+        retention_months = config.ATTENDANCE_RETENTION_MONTHS
+    cutoff = _add_months(_current_ist_month(), -retention_months) if retention_months > 0 else date.min
+
+    cursor.execute("SELECT DISTINCT date_trunc('month', work_date)::date FROM attendance_default ORDER BY 1")
+    created = []
+    for (month,) in cursor.fetchall():
+        if month >= cutoff and _create_month_partition(cursor, month):
+            created.append(f"attendance_y{month.year}m{month.month:02d}")
+    return created
+
+
+def retire_expired_attendance_partitions(cursor, retention_months: int = None, drop: bool = None) -> List[str]:
+    """
+    Detach (or drop) monthly partitions older than the retention window.
+    A retention of 0 keeps everything. Detached partitions stay in the database as plain tables.
+    """
+    if retention_months is None:
+        retention_months = config.ATTENDANCE_RETENTION_MONTHS
+    if drop is None:
+        drop = config.ATTENDANCE_RETENTION_DROP
+    if retention_months <= 0:
+        return []
+
+    cutoff = _add_months(_current_ist_month(), -retention_months)
+    cursor.execute("""
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'attendance'::regclass
+    """)
+
+    retired = []
+    for (name,) in cursor.fetchall():
+        match = ATTENDANCE_PARTITION_NAME.match(name)
+        if not match or date(int(match.group(1)), int(match.group(2)), 1) >= cutoff:
+            continue
+        cursor.execute(sql.SQL("ALTER TABLE attendance DETACH PARTITION {}").format(sql.Identifier(name)))
+        if drop:
+            cursor.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(name)))
+        retired.append(name)
+    return retired
+
+
+def _maintain_attendance_partitions(cursor):
+    created = ensure_attendance_partitions(cursor) + relocate_default_attendance_rows(cursor)
+    retired = retire_expired_attendance_partitions(cursor)
+    if created:
+        print(f"Created attendance partitions: {', '.join(created)}")
+    if retired:
+        print(f"Retired attendance partitions: {', '.join(retired)}")
+    return len(created) + len(retired)
+
+
+def maintain_attendance_partitions():
+    """
+    Scheduled job: create upcoming monthly partitions, move stray rows out of the default
+    partition and retire expired partitions, once a day cluster-wide. Also run at startup,
+    so an instance that slept through the nightly run still has this month's partition.
+    """
+    from data import run_scheduled_job
+
+    def job(conn):
         cursor = conn.cursor()
-        
-        # 1. Attendance Table - SEPARATE execute calls
-        try:
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS attendance (
-                    id BIGSERIAL PRIMARY KEY,
-                    user_email VARCHAR(255) NOT NULL,
-                    action VARCHAR(50) NOT NULL,
-                    event_time TIMESTAMP NOT NULL,
-                    latitude NUMERIC(10,7) NULL,
-                    longitude NUMERIC(10,7) NULL,
-                    location_text VARCHAR(255) NULL,
-                    comment TEXT NULL
-                )
-            """)
-            print("Created/verified attendance table")
-        except psycopg2.Error as e:
-            if "already exists" not in str(e):
-                print(f"Error creating attendance table: {e}")
-        
-        # Add comment column if it doesn't exist (for existing databases)
         try:
-            cursor.execute("""
-                ALTER TABLE attendance 
-                ADD COLUMN IF NOT EXISTS comment TEXT NULL
-            """)
-            print("Verified comment column in attendance table")
-        except psycopg2.Error as e:
-            if "already exists" not in str(e):
-                print(f"Info: {e}")
-        
-        # Create index separately
-        try:
-            cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_user_time 
-                ON attendance (user_email, event_time)
-            """)
-            print("Created/verified attendance index")
-        except psycopg2.Error as e:
-            if "already exists" not in str(e):
-                print(f"Error creating index: {e}")
+            changed = _maintain_attendance_partitions(cursor)
+        finally:
+            cursor.close()
+        return changed, changed
 
-        # 2. Employee Details Table
-        try:
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS employee_details (
-                    id SERIAL PRIMARY KEY,
-                    name VARCHAR(255) NOT NULL,
-                    email VARCHAR(255) UNIQUE NOT NULL,
-                    password VARCHAR(255) NOT NULL,
-                    photo VARCHAR(255) DEFAULT 'profile.jpg',
-                    job_role VARCHAR(255) DEFAULT 'Employee',
-                    phone VARCHAR(20),
-                    parent_phone VARCHAR(20),
-                    dob VARCHAR(50),
-                    gender VARCHAR(50),
-                    employee_number VARCHAR(50) UNIQUE,
-                    aadhar VARCHAR(50),
-                    joining_date VARCHAR(50),
-                    native VARCHAR(255),
-                    address TEXT,
-                    pan_card VARCHAR(50),
-                    bank_details VARCHAR(255),
-                    salary VARCHAR(50),
-                    total_leave INT DEFAULT 0,
-                    total_working INT DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            print("Created/verified employee_details table")
-        except psycopg2.Error as e:
-            if "already exists" not in str(e):
-                print(f"Error creating employee_details table: {e}")
+    return run_scheduled_job("maintain_attendance_partitions", datetime.now(IST).date().isoformat(), job)
 
-        # Add missing columns if they don't exist (for existing databases)
-        try:
-            cursor.execute("""
-                ALTER TABLE employee_details 
-                ADD COLUMN IF NOT EXISTS pan_card VARCHAR(50)
-            """)
-            print("Verified pan_card column in employee_details table")
-        except psycopg2.Error as e:
-            if "already exists" not in str(e):
-                print(f"Info: {e}")
 
-        try:
-            cursor.execute("""
-                ALTER TABLE employee_details 
-                ADD COLUMN IF NOT EXISTS bank_details VARCHAR(255)
-            """)
-            print("Verified bank_details column in employee_details table")
-        except psycopg2.Error as e:
-            if "already exists" not in str(e):
-                print(f"Info: {e}")
+# ===========================================================================
+# PAYROLL PERIOD LEDGER
+# ===========================================================================
 
-        try:
-            cursor.execute("""
-                ALTER TABLE employee_details 
-                ADD COLUMN IF NOT EXISTS salary VARCHAR(50)
-            """)
-            print("Verified salary column in employee_details table")
-        except psycopg2.Error as e:
-            if "already exists" not in str(e):
-                print(f"Info: {e}")
+def _backfill_attendance_period_ledger(cursor):
+    """
+    Seed attendance_period_ledger from history: working days from daily_attendance,
+    and the current employee_details.total_leave as the current period's leave days.
+    """
+    from data import get_attendance_period_dates
+
+    ledger = {}
+    cursor.execute("""
+        SELECT d.user_email, d.work_date FROM daily_attendance d
+        JOIN employee_details e ON e.email = d.user_email
+        WHERE d.first_check_in IS NOT NULL
+    """)
+    for email, work_date in cursor.fetchall():
+        period = get_attendance_period_dates(work_date)
+        ledger.setdefault((email, *period), [0, 0])[0] += 1
+
+    current_period = get_attendance_period_dates(datetime.now(IST).date())
+    cursor.execute("SELECT email, total_leave FROM employee_details WHERE COALESCE(total_leave, 0) > 0")
+    for email, total_leave in cursor.fetchall():
+        ledger.setdefault((email, *current_period), [0, 0])[1] = total_leave
+
+    if ledger:
+        psycopg2.extras.execute_values(
+            cursor,
+            """INSERT INTO attendance_period_ledger 
+               (user_email, period_start, period_end, working_days, leave_days) VALUES %s""",
+            [(email, start, end, working, leave) for (email, start, end), (working, leave) in ledger.items()]
+        )
+
+
+# ===========================================================================
+# STATIC EMPLOYEE DATA SYNC
+# ===========================================================================
+
+# Profile fields employees.py provides for each employee
+STATIC_EMPLOYEE_FIELDS = [
+    "phone", "parent_phone", "dob", "gender", "employee_number", "aadhar", "joining_date",
+    "native", "address", "photo", "job_role", "pan_card", "salary", "bank_details",
+]
+
+
+def _static_employee_snapshot() -> Dict[str, Dict]:
+    return {
+        email: {field: user_data.get(field) for field in STATIC_EMPLOYEE_FIELDS}
+        for email, user_data in static_users.items()
+    }
+
+
+def static_employees_version(snapshot: Dict[str, Dict] = None) -> str:
+    """Content hash of the static employee data in employees.py."""
+    snapshot = snapshot if snapshot is not None else _static_employee_snapshot()
+    return hashlib.sha256(json.dumps(snapshot, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _static_fill_expression(field: str, value: str) -> str:
+    """SQL for a field when employees.py did not change it: keep the DB value, fill it if missing."""
+    if field == "photo":
+        return f"CASE WHEN e.photo IS NULL OR e.photo IN ('', 'profile.jpg') THEN COALESCE({value}, 'profile.jpg') ELSE e.photo END"
+    if field == "job_role":
+        return f"COALESCE(NULLIF(e.job_role, ''), {value}, 'Employee')"
+    return f"COALESCE(NULLIF(e.{field}, ''), {value})"
+
+
+def sync_static_employees(cursor, force: bool = False):
+    """
+    Write employees.py profile data into employee_details.
+
+    A field whose value in employees.py changed since the last recorded sync
+    overwrites the DB; every other field only fills values missing in the DB,
+    so edits made through the HR pages are kept. The first run is the one-time
+    backfill. Returns the number of rows updated, or None when employees.py is
+    unchanged since the recorded version (and `force` is not set).
+    """
+    snapshot = _static_employee_snapshot()
+    version = static_employees_version(snapshot)
+
+    cursor.execute("SELECT version, snapshot FROM static_data_sync WHERE name = 'employees'")
+    row = cursor.fetchone()
+    if row and row[0] == version and not force:
+        return None
+    previous = row[1] if row else {}
+
+    rows = []
+    for email, fields in snapshot.items():
+        before = previous.get(email)
+        changed = [before is not None and before.get(field) != fields[field] for field in STATIC_EMPLOYEE_FIELDS]
+        rows.append((email, *[fields[field] for field in STATIC_EMPLOYEE_FIELDS], *changed))
+
+    assignments = []
+    for field in STATIC_EMPLOYEE_FIELDS:
+        value = f"v.{field}"
+        if field == "employee_number":
+            # employee_number is unique; never copy one another employee already holds
+            value = (
+                "CASE WHEN NOT EXISTS (SELECT 1 FROM employee_details x "
+                "WHERE x.employee_number = v.employee_number AND x.email != e.email) "
+                "THEN v.employee_number END"
+            )
+        assignments.append(
+            f"{field} = CASE WHEN v.{field}_changed AND {value} IS NOT NULL "
+            f"THEN {value} ELSE {_static_fill_expression(field, value)} END"
+        )
+
+    value_columns = ["email"] + STATIC_EMPLOYEE_FIELDS + [f"{field}_changed" for field in STATIC_EMPLOYEE_FIELDS]
+    psycopg2.extras.execute_values(
+        cursor,
+        f"""UPDATE employee_details AS e
+            SET {', '.join(assignments)}, updated_at = CURRENT_TIMESTAMP
+            FROM (VALUES %s) AS v({', '.join(value_columns)})
+            WHERE e.email = v.email""",
+        rows,
+        page_size=max(len(rows), 1)
+    )
+    updated = cursor.rowcount
+
+    cursor.execute(
+        """INSERT INTO static_data_sync (name, version, snapshot, synced_at)
+           VALUES ('employees', %s, %s, CURRENT_TIMESTAMP)
+           ON CONFLICT (name) DO UPDATE SET
+               version = EXCLUDED.version, snapshot = EXCLUDED.snapshot, synced_at = EXCLUDED.synced_at""",
+        (version, psycopg2.extras.Json(snapshot))
+    )
+    return updated
+
+
+# Columns seeded from employees.py; email is the conflict key and password is only set on insert
+SEED_EMPLOYEE_COLUMNS = ["name", "email", "password"] + STATIC_EMPLOYEE_FIELDS
+SEED_MODES = ("skip", "fill", "overwrite")
+
+
+def _seed_update_expression(field: str, mode: str) -> str:
+    if mode == "overwrite":
+        return f"COALESCE(EXCLUDED.{field}, e.{field})"
+    if field == "name":
+        return "e.name"
+    return _static_fill_expression(field, f"EXCLUDED.{field}")
+
+
+def seed_static_employees(cursor, mode: str = "skip") -> Dict[str, int]:
+    """
+    Insert every employees.py employee in one multi-row INSERT ... ON CONFLICT (email).
+
+    Existing rows are left alone (`skip`), have empty fields filled (`fill`) or are
+    overwritten with employees.py values (`overwrite`); passwords are never overwritten.
+    Rows whose employee_number already belongs to another employee are skipped, as the
+    per-row loop did. Returns counts of inserted, updated and skipped rows.
+    """
+    if mode not in SEED_MODES:
+        raise ValueError(f"mode must be one of {', '.join(SEED_MODES)}")
+
+    employees = {email: user_data for email, user_data in static_users.items() if email != config.HR_EMAIL}
+    rows, seen_numbers = [], set()
+    for email, user_data in employees.items():
+        number = user_data.get("employee_number")
+        if number and number in seen_numbers:
+            continue
+        seen_numbers.add(number)
+        values = {field: user_data.get(field) for field in SEED_EMPLOYEE_COLUMNS}
+        values.update({
+            "email": email,
+            "name": user_data.get("name", ""),
+            "password": user_data.get("password", "zugo@123"),
+            "photo": user_data.get("photo", "profile.jpg"),
+            "job_role": user_data.get("job_role", "Employee"),
+        })
+        rows.append(tuple(values[field] for field in SEED_EMPLOYEE_COLUMNS))
+    if not rows:
+        return {"inserted": 0, "updated": 0, "skipped": 0}
+
+    if mode == "skip":
+        on_conflict = "DO NOTHING"
+    else:
+        fields = [field for field in SEED_EMPLOYEE_COLUMNS if field not in ("email", "password")]
+        expressions = [_seed_update_expression(field, mode) for field in fields]
+        updates = ", ".join(f"{field} = {expr}" for field, expr in zip(fields, expressions))
+        # Only touch rows that actually change so `updated` counts real updates
+        on_conflict = (
+            f"DO UPDATE SET {updates}, updated_at = CURRENT_TIMESTAMP "
+            f"WHERE ({', '.join('e.' + field for field in fields)}) "
+            f"IS DISTINCT FROM ({', '.join(expressions)})"
+        )
+
+    columns = ", ".join(SEED_EMPLOYEE_COLUMNS)
+    results = psycopg2.extras.execute_values(
+        cursor,
+        f"""INSERT INTO employee_details AS e ({columns})
+            SELECT {columns} FROM (VALUES %s) AS v ({columns})
+            WHERE v.employee_number IS NULL OR NOT EXISTS (
+                SELECT 1 FROM employee_details x
+                WHERE x.employee_number = v.employee_number AND x.email != v.email
+            )
+            ON CONFLICT (email) {on_conflict}
+            RETURNING (xmax = 0) AS inserted""",
+        rows,
+        page_size=len(rows),
+        fetch=True
+    )
+    inserted = sum(1 for (was_inserted,) in results if was_inserted)
+    updated = len(results) - inserted
+    return {"inserted": inserted, "updated": updated, "skipped": len(employees) - inserted - updated}
+
+
+def run_static_employee_seed(mode: str = "skip"):
+    """Command-line entry point for seeding employees.py into employee_details."""
+    from data import db_connection
 
-        # 3. Employee Comments/Messages Table (for employee-to-HR communication)
+    with db_connection() as conn:
+        cursor = conn.cursor()
         try:
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS employee_comments (
-                    id SERIAL PRIMARY KEY,
-                    employee_email VARCHAR(255) NOT NULL,
-                    comment_text TEXT NOT NULL,
-                    attendance_date DATE NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    is_read BOOLEAN DEFAULT FALSE,
-                    read_by_hr_at TIMESTAMP NULL,
-                    FOREIGN KEY (employee_email) REFERENCES employee_details(email) ON DELETE CASCADE
-                )
-            """)
-            print("Created/verified employee_comments table")
-        except psycopg2.Error as e:
-            if "already exists" not in str(e):
-                print(f"Error creating employee_comments table: {e}")
+            seeded = seed_static_employees(cursor, mode=mode)
+            conn.commit()
+        finally:
+            cursor.close()
+    print(f"Seeded employees ({mode}): {seeded['inserted']} inserted, "
+          f"{seeded['updated']} updated, {seeded['skipped']} skipped")
+
+
+def run_static_employee_sync(force: bool = False):
+    """Command-line entry point for the static employee sync."""
+    from data import db_connection
 
-        # Create index on employee_comments
+    with db_connection() as conn:
+        cursor = conn.cursor()
         try:
+            updated = sync_static_employees(cursor, force=force)
+            conn.commit()
+        finally:
+            cursor.close()
+
+    if updated is None:
+        print("employees.py unchanged since last sync; nothing to do (use --force to re-run)")
+    else:
+        print(f"Synced static employee data ({updated} rows updated)")
+
+
+# ===========================================================================
+# SCHEMA MIGRATIONS
+# ===========================================================================
+
+# Any constant works; it only has to be the same for every process running migrations
+SCHEMA_MIGRATION_LOCK_ID = 4_221_170_001
+
+
+def _convert_legacy_manual_entries_to_utc(cursor):
+    """
+    Manual HR entries used to be stored as IST wall-clock time; every other row (and every
+    manual entry since) is UTC. Shift the old ones to UTC. Only the baseline migration
+    calls this: whatever manual rows a database holds when it first migrates are legacy.
+    """
+    cursor.execute("SELECT to_regclass('attendance')")
+    if cursor.fetchone()[0] is None:
+        return
+    cursor.execute("""
+        UPDATE attendance SET event_time = event_time - INTERVAL '5 hours 30 minutes'
+        WHERE location_text = 'Manual Entry by HR'
+    """)
+    if cursor.rowcount:
+        print(f"Converted {cursor.rowcount} legacy manual attendance entries from IST to UTC")
+
+
+def _migration_0001_baseline(cursor):
+    """Every table, column and index the app had before versioned migrations (idempotent)."""
+    # Before partitioning and the per-day backfills below, which read event_time as UTC
+    _convert_legacy_manual_entries_to_utc(cursor)
+    # Attendance Table - range-partitioned by IST month on event_time
+    _create_partitioned_attendance(cursor)
+    cursor.execute("ALTER TABLE attendance ADD COLUMN IF NOT EXISTS comment TEXT NULL")
+    # IST work date, stored so date filters can use an index instead of DATE(event_time)
+    cursor.execute(f"""
+        ALTER TABLE attendance 
+        ADD COLUMN IF NOT EXISTS work_date DATE 
+        GENERATED ALWAYS AS ({IST_WORK_DATE_EXPR}) STORED
+    """)
+    # Older databases have a single unpartitioned heap; move it into monthly partitions
+    if _migrate_attendance_to_partitioned(cursor):
+        print("Migrated attendance table to monthly partitions")
+    _maintain_attendance_partitions(cursor)
+
+    # Indexes are declared on the parent and cascade to every partition
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_time ON attendance (user_email, event_time)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_attendance_user_work_date ON attendance (user_email, work_date)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_attendance_work_date ON attendance (work_date)")
+
+    # Employee Details Table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS employee_details (
+            id SERIAL PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            email VARCHAR(255) UNIQUE NOT NULL,
+            password VARCHAR(255) NOT NULL,
+            photo VARCHAR(255) DEFAULT 'profile.jpg',
+            job_role VARCHAR(255) DEFAULT 'Employee',
+            phone VARCHAR(20),
+            parent_phone VARCHAR(20),
+            dob VARCHAR(50),
+            gender VARCHAR(50),
+            employee_number VARCHAR(50) UNIQUE,
+            aadhar VARCHAR(50),
+            joining_date VARCHAR(50),
+            native VARCHAR(255),
+            address TEXT,
+            pan_card VARCHAR(50),
+            bank_details VARCHAR(255),
+            salary VARCHAR(50),
+            total_leave INT DEFAULT 0,
+            total_working INT DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    # Columns added after the first release
+    cursor.execute("ALTER TABLE employee_details ADD COLUMN IF NOT EXISTS pan_card VARCHAR(50)")
+    cursor.execute("ALTER TABLE employee_details ADD COLUMN IF NOT EXISTS bank_details VARCHAR(255)")
+    cursor.execute("ALTER TABLE employee_details ADD COLUMN IF NOT EXISTS salary VARCHAR(50)")
+
+    # Employee Comments/Messages Table (for employee-to-HR communication)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS employee_comments (
+            id SERIAL PRIMARY KEY,
+            employee_email VARCHAR(255) NOT NULL,
+            comment_text TEXT NOT NULL,
+            attendance_date DATE NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            is_read BOOLEAN DEFAULT FALSE,
+            read_by_hr_at TIMESTAMP NULL,
+            FOREIGN KEY (employee_email) REFERENCES employee_details(email) ON DELETE CASCADE
+        )
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_comments_employee_date 
+        ON employee_comments (employee_email, attendance_date)
+    """)
+
+    # Records which version of employees.py was last written into employee_details
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS static_data_sync (
+            name VARCHAR(100) PRIMARY KEY,
+            version VARCHAR(64) NOT NULL,
+            snapshot JSONB NOT NULL,
+            synced_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    # Per-employee attendance summary (latest attendance comment), kept current on write
+    cursor.execute("SELECT to_regclass('employee_attendance_summary')")
+    summary_exists = cursor.fetchone()[0] is not None
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS employee_attendance_summary (
+            user_email VARCHAR(255) PRIMARY KEY,
+            last_comment TEXT NULL,
+            last_comment_at TIMESTAMP NULL,
+            last_comment_attendance_id BIGINT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_email) REFERENCES employee_details(email) ON DELETE CASCADE ON UPDATE CASCADE
+        )
+    """)
+    if not summary_exists:
+        # One-time backfill from existing attendance comments
+        cursor.execute("""
+            INSERT INTO employee_attendance_summary 
+            (user_email, last_comment, last_comment_at, last_comment_attendance_id)
+            SELECT DISTINCT ON (a.user_email) a.user_email, a.comment, a.event_time, a.id
+            FROM attendance a
+            JOIN employee_details e ON e.email = a.user_email
+            WHERE a.comment IS NOT NULL
+            ORDER BY a.user_email, a.event_time DESC
+        """)
+
+    # One row per employee per IST day (first check-in, last check-out), kept current on write
+    cursor.execute("SELECT to_regclass('daily_attendance')")
+    daily_exists = cursor.fetchone()[0] is not None
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS daily_attendance (
+            user_email VARCHAR(255) NOT NULL,
+            work_date DATE NOT NULL,
+            first_check_in TIMESTAMP NULL,
+            last_check_out TIMESTAMP NULL,
+            worked_seconds INTEGER NOT NULL DEFAULT 0,
+            check_in_count INTEGER NOT NULL DEFAULT 0,
+            source VARCHAR(10) NOT NULL DEFAULT 'geo',
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_email, work_date)
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_daily_attendance_work_date ON daily_attendance (work_date)")
+    if not daily_exists:
+        # One-time backfill from existing attendance events
+        cursor.execute("""
+            INSERT INTO daily_attendance 
+            (user_email, work_date, first_check_in, last_check_out, worked_seconds, check_in_count, source)
+            SELECT user_email, work_date, first_check_in, last_check_out,
+                   COALESCE(TRUNC(EXTRACT(EPOCH FROM last_check_out - first_check_in))::int, 0),
+                   check_in_count, source
+            FROM (
+                SELECT user_email, work_date,
+                       MIN(event_time) FILTER (WHERE action = 'check-in') AS first_check_in,
+                       MAX(event_time) FILTER (WHERE action = 'check-out') AS last_check_out,
+                       COUNT(*) FILTER (WHERE action = 'check-in') AS check_in_count,
+                       CASE WHEN bool_or(location_text = 'Manual Entry by HR')
+                            THEN 'manual' ELSE 'geo' END AS source
+                FROM attendance
+                GROUP BY user_email, work_date
+            ) AS days
+        """)
+    else:
+        cursor.execute("""
+            SELECT 1 FROM information_schema.columns 
+            WHERE table_name = 'daily_attendance' AND column_name = 'check_in_count'
+        """)
+        if cursor.fetchone() is None:
+            cursor.execute("ALTER TABLE daily_attendance ADD COLUMN check_in_count INTEGER NOT NULL DEFAULT 0")
             cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_comments_employee_date 
-                ON employee_comments (employee_email, attendance_date)
+                UPDATE daily_attendance AS d SET check_in_count = c.check_ins
+                FROM (
+                    SELECT user_email, work_date, COUNT(*) AS check_ins
+                    FROM attendance WHERE action = 'check-in'
+                    GROUP BY user_email, work_date
+                ) AS c
+                WHERE d.user_email = c.user_email AND d.work_date = c.work_date
             """)
-            print("Created/verified comments index")
-        except psycopg2.Error as e:
-            if "already exists" not in str(e):
-                print(f"Error creating comments index: {e}")
 
+    # Working and leave days per employee per payroll period (21st-20th), kept current on write
+    cursor.execute("SELECT to_regclass('attendance_period_ledger')")
+    ledger_exists = cursor.fetchone()[0] is not None
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS attendance_period_ledger (
+            user_email VARCHAR(255) NOT NULL,
+            period_start DATE NOT NULL,
+            period_end DATE NOT NULL,
+            working_days INTEGER NOT NULL DEFAULT 0,
+            leave_days INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_email, period_start),
+            FOREIGN KEY (user_email) REFERENCES employee_details(email) ON DELETE CASCADE ON UPDATE CASCADE
+        )
+    """)
+    if not ledger_exists:
+        _backfill_attendance_period_ledger(cursor)
+
+
+def _migration_0002_job_runs(cursor):
+    """One row per scheduled job and slot, so each job runs once per slot across all workers."""
+    cursor.execute("""
+        CREATE TABLE job_runs (
+            id BIGSERIAL PRIMARY KEY,
+            job_name VARCHAR(100) NOT NULL,
+            slot VARCHAR(50) NOT NULL,
+            status VARCHAR(20) NOT NULL CHECK (status IN ('running', 'succeeded', 'failed')),
+            attempts INTEGER NOT NULL DEFAULT 1,
+            worker VARCHAR(255),
+            started_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP,
+            rows_affected INTEGER,
+            error TEXT,
+            UNIQUE (job_name, slot)
+        )
+    """)
+    cursor.execute("CREATE INDEX idx_job_runs_started_at ON job_runs(started_at DESC)")
+
+
+def _migration_0003_idempotency_keys(cursor):
+    """Stored outcomes of POSTs sent with an idempotency key, replayed to retries until they expire."""
+    cursor.execute("""
+        CREATE TABLE idempotency_keys (
+            user_email VARCHAR(255) NOT NULL,
+            endpoint VARCHAR(100) NOT NULL,
+            idempotency_key VARCHAR(255) NOT NULL,
+            request_hash CHAR(64) NOT NULL,
+            status_code SMALLINT,
+            headers JSONB,
+            body BYTEA,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            expires_at TIMESTAMP NOT NULL,
+            PRIMARY KEY (user_email, endpoint, idempotency_key)
+        )
+    """)
+    cursor.execute("CREATE INDEX idx_idempotency_keys_expires_at ON idempotency_keys(expires_at)")
+
+
+def _migration_0004_offline_attendance_events(cursor):
+    """Offline-captured events already synced, so a device re-uploading its queue gets them back as duplicates."""
+    cursor.execute("""
+        CREATE TABLE offline_attendance_events (
+            user_email VARCHAR(255) NOT NULL,
+            event_id VARCHAR(100) NOT NULL,
+            attendance_id BIGINT NOT NULL,
+            event_time TIMESTAMP NOT NULL,
+            synced_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_email, event_id),
+            FOREIGN KEY (user_email) REFERENCES employee_details(email) ON DELETE CASCADE ON UPDATE CASCADE
+        )
+    """)
+
+
+def _migration_0005_summary_email_cascade(cursor):
+    """Let employee_attendance_summary follow email changes instead of blocking them."""
+    cursor.execute("""
+        SELECT conname FROM pg_constraint
+        WHERE conrelid = 'employee_attendance_summary'::regclass AND contype = 'f'
+          AND confrelid = 'employee_details'::regclass AND confupdtype <> 'c'
+    """)
+    for (constraint,) in cursor.fetchall():
+        cursor.execute(sql.SQL("ALTER TABLE employee_attendance_summary DROP CONSTRAINT {}").format(
+            sql.Identifier(constraint)))
+        cursor.execute(sql.SQL("""
+            ALTER TABLE employee_attendance_summary ADD CONSTRAINT {}
+            FOREIGN KEY (user_email) REFERENCES employee_details(email) ON DELETE CASCADE ON UPDATE CASCADE
+        """).format(sql.Identifier(constraint)))
+
+
+def _migration_0006_offline_devices(cursor):
+    """Registered devices with their own revocable, expiring offline signing keys."""
+    cursor.execute("""
+        CREATE TABLE offline_devices (
+            device_id VARCHAR(64) PRIMARY KEY,
+            user_email VARCHAR(255) NOT NULL,
+            label VARCHAR(100),
+            signing_key CHAR(64) NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT (NOW() AT TIME ZONE 'UTC'),
+            expires_at TIMESTAMP NOT NULL,
+            revoked_at TIMESTAMP,
+            last_synced_at TIMESTAMP,
+            FOREIGN KEY (user_email) REFERENCES employee_details(email) ON DELETE CASCADE ON UPDATE CASCADE
+        )
+    """)
+    cursor.execute("CREATE INDEX idx_offline_devices_user_email ON offline_devices(user_email)")
+    cursor.execute("ALTER TABLE offline_attendance_events ADD COLUMN device_id VARCHAR(64)")
+
+
+def _migration_0007_absence_marks(cursor):
+    """One row per leave day the absence job adds, so a later check-in can take back exactly those."""
+    cursor.execute("""
+        CREATE TABLE absence_marks (
+            user_email VARCHAR(255) NOT NULL,
+            work_date DATE NOT NULL,
+            period_start DATE NOT NULL,
+            lookback_days SMALLINT NOT NULL,
+            marked_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_email, work_date),
+            FOREIGN KEY (user_email) REFERENCES employee_details(email) ON DELETE CASCADE ON UPDATE CASCADE
+        )
+    """)
+
+
+# (version, description, function) in order. Never edit an applied migration;
+# append a new one and it runs once on every database.
+SCHEMA_MIGRATIONS = [
+    (1, "baseline schema", _migration_0001_baseline),
+    (2, "scheduled job runs", _migration_0002_job_runs),
+    (3, "idempotency keys", _migration_0003_idempotency_keys),
+    (4, "offline attendance events", _migration_0004_offline_attendance_events),
+    (5, "cascade email changes to attendance summary", _migration_0005_summary_email_cascade),
+    (6, "offline devices", _migration_0006_offline_devices),
+    (7, "absence marks", _migration_0007_absence_marks),
+]
+SCHEMA_VERSION = SCHEMA_MIGRATIONS[-1][0]
+
+
+def _connect(database: str = None):
+    return psycopg2.connect(
+        host=config.DB_HOST, 
+        user=config.DB_USER, 
+        password=config.DB_PASSWORD, 
+        port=config.DB_PORT,
+        database=database or config.DB_NAME
+    )
+
+
+def _ensure_database_exists():
+    """Create the application database from the `postgres` maintenance database if needed."""
+    conn = _connect("postgres")
+    conn.autocommit = True
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s", (config.DB_NAME,))
+    if not cursor.fetchone():
+        cursor.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(config.DB_NAME)))
+        print(f"Created database: {config.DB_NAME}")
+    cursor.close()
+    conn.close()
+
+
+def schema_status(conn):
+    """
+    (applied schema version, recorded employees.py version) in one round trip;
+    (0, None) for a database that predates versioned migrations.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT (SELECT COALESCE(MAX(version), 0) FROM schema_migrations),
+                   (SELECT version FROM static_data_sync WHERE name = 'employees')
+        """)
+        return cursor.fetchone()
+    except psycopg2.errors.UndefinedTable:
+        return 0, None
+    finally:
+        conn.rollback()
+        cursor.close()
+
+
+def migrate_database(conn) -> List[int]:
+    """
+    Apply pending migrations, each in its own transaction together with its
+    schema_migrations row, then maintain partitions and seed employees.
+
+    A session advisory lock makes concurrent callers (several workers starting at
+    once) wait for the first one instead of racing on DDL. Returns the versions applied.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT pg_advisory_lock(%s)", (SCHEMA_MIGRATION_LOCK_ID,))
+    try:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                description VARCHAR(255) NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cursor.execute("SELECT version FROM schema_migrations")
+        applied = {row[0] for row in cursor.fetchall()}
         conn.commit()
 
-        # Seed HR Account
-        try:
-            cursor2 = conn.cursor()
-            cursor2.execute("SELECT 1 FROM employee_details WHERE email = %s LIMIT 1", (config.HR_EMAIL,))
-            hr_row = cursor2.fetchone()
-            if not hr_row:
-                default_hr_password = os.getenv("HR_PASSWORD", "zugo@123")
-                cursor2.execute(
-                    "INSERT INTO employee_details (name, email, password, job_role) VALUES (%s, %s, %s, %s)",
-                    ("HR", config.HR_EMAIL, default_hr_password, "HR Manager")
+        newly_applied = []
+        for version, description, migration in SCHEMA_MIGRATIONS:
+            if version in applied:
+                continue
+            try:
+                migration(cursor)
+                cursor.execute(
+                    "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                    (version, description)
                 )
                 conn.commit()
-                print(f"Inserted default HR account: {config.HR_EMAIL}")
-            else:
-                print(f"✓ HR account already exists: {config.HR_EMAIL}")
-            cursor2.close()
-        except psycopg2.IntegrityError as _e:
-            conn.rollback()
-            print(f"✓ HR account already exists (duplicate): {config.HR_EMAIL}")
-            cursor2.close()
-        except Exception as _e:
-            print(f"Warning: could not ensure HR account exists: {_e}")
-
-        # Seed Static Employees
-        try:
-            cursor3 = conn.cursor()
-            for email, user_data in static_users.items():
-                if email == config.HR_EMAIL: 
-                    continue
-                    
-                cursor3.execute("SELECT email FROM employee_details WHERE email = %s", (email,))
-                if cursor3.fetchone(): 
-                    continue 
-                
-                # Extract data (Safe dict.get)
-                name = user_data.get("name", "")
-                password = user_data.get("password", "zugo@123")
-                photo = user_data.get("photo", "profile.jpg")
-                phone = user_data.get("phone")
-                parent_phone = user_data.get("parent_phone")
-                dob = user_data.get("dob")
-                gender = user_data.get("gender")
-                employee_number = user_data.get("employee_number")
-                aadhar = user_data.get("aadhar")
-                joining_date = user_data.get("joining_date")
-                native = user_data.get("native")
-                address = user_data.get("address")
-                job_role = user_data.get("job_role", "Employee")
-                
-                try:
-                    cursor3.execute(
-                        """INSERT INTO employee_details 
-                           (name, email, password, photo, phone, parent_phone, dob, gender, 
-                            employee_number, aadhar, joining_date, native, address, job_role)
-                           VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)""",
-                        (name, email, password, photo, phone, parent_phone, dob, gender,
-                         employee_number, aadhar, joining_date, native, address, job_role)
-                    )
-                    conn.commit()
-                except psycopg2.IntegrityError as ie:
-                    conn.rollback()
-                    # Check if it's a duplicate email or employee_number
-                    if "email" in str(ie):
-                        pass  # Email already exists, skip
-                    elif "employee_number" in str(ie):
-                        # Update existing employee if only employee_number conflicts
-                        pass  # Skip this one
-                    else:
-                        print(f"  Warning: Could not insert {email}: {ie}")
-            cursor3.close()
-            print("✓ Employee data seeding complete.")
-        except Exception as _e:
-            print(f"Warning: could not seed employee data: {_e}")
+            except Exception:
+                conn.rollback()
+                print(f"Migration {version} ({description}) failed; later migrations were not applied")
+                raise
+            newly_applied.append(version)
+            print(f"Applied migration {version}: {description}")
 
+        _maintain_attendance_partitions(cursor)
+        conn.commit()
+        _seed_employees(conn)
+        return newly_applied
+    finally:
+        conn.rollback()
+        cursor.execute("SELECT pg_advisory_unlock(%s)", (SCHEMA_MIGRATION_LOCK_ID,))
+        conn.commit()
         cursor.close()
-        conn.close()
-        print("Database schema initialization complete.")
-        
+
+
+def _seed_employees(conn):
+    """Ensure the HR account and every employees.py employee exist, then sync their static data."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """INSERT INTO employee_details (name, email, password, job_role) VALUES (%s, %s, %s, %s)
+               ON CONFLICT (email) DO NOTHING""",
+            ("HR", config.HR_EMAIL, os.getenv("HR_PASSWORD", "zugo@123"), "HR Manager")
+        )
+        if cursor.rowcount:
+            print(f"Inserted default HR account: {config.HR_EMAIL}")
+
+        seeded = seed_static_employees(cursor)
+        conn.commit()
+        print(f"✓ Employee data seeding complete ({seeded['inserted']} inserted, {seeded['skipped']} skipped).")
+    except psycopg2.Error as _e:
+        conn.rollback()
+        print(f"Warning: could not seed employee data: {_e}")
+
+    # Reconcile existing rows with employees.py (no-op unless employees.py changed)
+    try:
+        updated = sync_static_employees(cursor)
+        conn.commit()
+        if updated is not None:
+            print(f"✓ Synced static employee data ({updated} rows updated)")
+    except psycopg2.Error as _e:
+        conn.rollback()
+        print(f"Warning: could not sync static employee data: {_e}")
+    finally:
+        cursor.close()
+
+
+def initialize_database_schema():
+    """
+    Startup check: one query compares the applied schema version and the recorded
+    employees.py version with this code. When both match nothing else runs; otherwise
+    pending migrations are applied (unless DB_MIGRATE_ON_STARTUP is off).
+    """
+    try:
+        try:
+            conn = _connect()
+        except psycopg2.OperationalError as err:
+            if "does not exist" not in str(err):
+                raise
+            _ensure_database_exists()
+            conn = _connect()
+
+        try:
+            applied_version, static_version = schema_status(conn)
+            if applied_version >= SCHEMA_VERSION and static_version == static_employees_version():
+                print(f"Database schema is up to date (version {applied_version}).")
+                return
+
+            if not config.DB_MIGRATE_ON_STARTUP:
+                print(
+                    f"Warning: database schema is at version {applied_version}, code expects {SCHEMA_VERSION}. "
+                    "Run `python schema.py migrate`."
+                )
+                return
+
+            migrate_database(conn)
+            print("Database schema initialization complete.")
+        finally:
+            conn.close()
+
     except psycopg2.Error as err:
-        print(f"Error during DB initialization: {err}")
\ No newline at end of file
+        print(f"Error during DB initialization: {err}")
+
+
+def run_migrations():
+    """Command-line entry point: create the database if needed and apply pending migrations."""
+    _ensure_database_exists()
+    conn = _connect()
+    try:
+        applied = migrate_database(conn)
+    finally:
+        conn.close()
+    if applied:
+        print(f"Database migrated to version {SCHEMA_VERSION} (applied {', '.join(map(str, applied))})")
+    else:
+        print(f"Database schema already at version {SCHEMA_VERSION}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Database maintenance commands")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    sync_parser = subcommands.add_parser("sync-employees", help="Write employees.py profile data into employee_details")
+    sync_parser.add_argument("--force", action="store_true", help="Run even if employees.py is unchanged since the last sync")
+    seed_parser = subcommands.add_parser("seed-employees", help="Insert employees.py employees in one upsert")
+    seed_parser.add_argument("--mode", choices=SEED_MODES, default="skip",
+                             help="What to do with employees that already exist (default: skip)")
+    subcommands.add_parser("migrate", help="Create the database if needed and apply pending schema migrations")
+    subcommands.add_parser("status", help="Show the applied and expected schema versions")
+    args = parser.parse_args()
+
+    if args.command == "sync-employees":
+        run_static_employee_sync(force=args.force)
+    elif args.command == "seed-employees":
+        run_static_employee_seed(mode=args.mode)
+    elif args.command == "migrate":
+        run_migrations()
+    elif args.command == "status":
+        status_conn = _connect()
+        try:
+            applied_version, static_version = schema_status(status_conn)
+        finally:
+            status_conn.close()
+        print(f"Schema version: {applied_version} applied, {SCHEMA_VERSION} expected")
+        print(f"employees.py: {'in sync' if static_version == static_employees_version() else 'not synced'}")
@@ -1,12 +1,12 @@
 # services.py
-import math
+import hashlib
+import hmac
 import io
 import csv
+import tempfile
 import config
-import psycopg2
-import psycopg2.extras
 from math import radians, cos, sin, asin, sqrt
-from typing import Optional, List, Dict
+from typing import Optional, Dict
 import pytz
 
 import smtplib
@@ -14,16 +14,15 @@ from email.message import EmailMessage
 from datetime import datetime, date, timedelta
 
 from config import (
-    OFFICE_LAT, OFFICE_LON, OFFICE_RADIUS_METERS,
-    CHECKIN_MORNING_START, CHECKIN_MORNING_END, CHECKIN_AFTERNOON_START, CHECKIN_AFTERNOON_END,
     CHECKOUT_MIN_TIME,
     SMTP_HOST, SMTP_PORT, SMTP_USER, SMTP_PASSWORD, HR_EMAIL, MD_EMAIL,
-    ATTENDANCE_PERIOD_START_DAY, ATTENDANCE_PERIOD_END_DAY
+    ABSENCE_MARK_TIME, ABSENCE_CATCHUP_MAX_DAYS
 )
 from data import (
-    fetch_all_employees, update_employee_leave, fetch_attendance_for_period, fetch_monthly_attendance_all
+    ABSENCE_JOB_NAME,
+    fetch_last_succeeded_slot, invalidate_employee_profile, iter_monthly_attendance_all,
+    mark_absent_employees, run_scheduled_job
 )
-import psycopg2
 
 # ===========================================================================
 # TIMEZONE CONFIGURATION
@@ -50,114 +49,64 @@ def is_checkout_allowed(current_time: datetime.time) -> bool:
     """Checks if the current time is after the minimum allowed check-out time."""
     return current_time >= CHECKOUT_MIN_TIME
 
-def get_attendance_period_dates(ref_date: date) -> tuple[date, date]:
-    """
-    Calculates the start and end dates for the attendance period
-    (20th of previous month to 20th of current month or similar).
-    """
-    if ref_date.day > ATTENDANCE_PERIOD_END_DAY:
-        # Example: if today is Oct 25, period is Oct 21 to Nov 20
-        start_month = ref_date.month
-        start_year = ref_date.year
-        end_month = (ref_date.month % 12) + 1
-        end_year = ref_date.year if end_month != 1 else ref_date.year + 1
-    else:
-        # Example: if today is Oct 15, period is Sep 21 to Oct 20
-        end_month = ref_date.month
-        end_year = ref_date.year
-        start_month = (ref_date.month - 2 + 12) % 12 + 1 # month-1, then adjust for Jan
-        start_year = ref_date.year if start_month != 12 else ref_date.year - 1
-
-    start_date = date(start_year, start_month, ATTENDANCE_PERIOD_START_DAY)
-    end_date = date(end_year, end_month, ATTENDANCE_PERIOD_END_DAY)
-
-    # Adjust start_date if it falls in the current month but should be previous
-    if ref_date.day <= ATTENDANCE_PERIOD_END_DAY:
-        if start_date.month == ref_date.month:
-             # This means start_date was calculated for current year/month but should be previous year/month
-            start_date = date(start_date.year, start_date.month - 1, ATTENDANCE_PERIOD_START_DAY)
-            if start_date.month == 0: # Handle December case
-                start_date = date(start_date.year - 1, 12, ATTENDANCE_PERIOD_START_DAY)
-
-    return start_date, end_date
-
-
-def calculate_working_days_and_leaves_for_employee(user_email: str, ref_date: date = None):
-    """
-    Calculates working days and leaves for a user based on the attendance period (20th to 20th).
-    If ref_date is not provided, uses today's date to determine the current period.
-    """
-    if ref_date is None:
-        ref_date = date.today()
-
-    start_period, end_period = get_attendance_period_dates(ref_date)
-    
-    attendance_records = fetch_attendance_for_period(user_email, start_period, end_period)
-
-    # Calculate actual working days based on unique check-ins within the period
-    checked_in_dates = set()
-    for record in attendance_records:
-        if record["action"] == "check-in":
-            checked_in_dates.add(record["event_time"].date())
-    
-    total_working_days = len(checked_in_dates)
+def offline_event_message(event_id: str, action: str, captured_at: str, latitude: float, longitude: float) -> str:
+    """The string a device signs for one offline event (coordinates to 6 decimal places)."""
+    return f"{event_id}|{action}|{captured_at}|{latitude:.6f}|{longitude:.6f}"
 
-    # Note: total_leave from DB should be updated by the scheduled task
-    # This function primarily *calculates* total_working for display.
-    # The actual 'total_leave' in DB is managed by the daily leave marking job.
 
-    return total_working_days, start_period, end_period
+def verify_offline_event_signature(signing_key: str, message: str, signature: str) -> bool:
+    """Check an event's hex HMAC-SHA256 signature against its device's offline signing key."""
+    expected = hmac.new(signing_key.encode("utf-8"), message.encode("utf-8"), hashlib.sha256)
+    return hmac.compare_digest(expected.hexdigest(), (signature or "").lower())
 
 
-def mark_leaves_for_absent_employees():
+def mark_leaves_for_absent_employees() -> Optional[Dict]:
     """
     Marks employees as absent after 3 consecutive days without check-in.
-    Runs daily.
+
+    Covers every day since the last successful run up to the latest day that is due
+    (today from ABSENCE_MARK_TIME on, otherwise yesterday), so days missed while the
+    service was down are backfilled in the same single pass. Runs at ABSENCE_MARK_TIME
+    and at startup; returns a summary, or None when there was nothing to do.
     """
-    import config
-    from data import fetch_all_employees, update_employee_leave, fetch_attendance_for_period
-    
-    # Use IST date
-    today = datetime.now(IST).date()
-    
-    # Create DB connection for fetch_all_employees
-    conn = psycopg2.connect(
-        host=config.DB_HOST,
-        port=config.DB_PORT,
-        user=config.DB_USER,
-        password=config.DB_PASSWORD,
-        database=config.DB_NAME
+    now = datetime.now(IST)
+    through = now.date() if now.time() >= ABSENCE_MARK_TIME else now.date() - timedelta(days=1)
+    job_name = ABSENCE_JOB_NAME
+
+    def job(conn):
+        last_slot = fetch_last_succeeded_slot(conn, job_name)
+        first = date.fromisoformat(last_slot) + timedelta(days=1) if last_slot else through
+        first = max(first, through - timedelta(days=ABSENCE_CATCHUP_MAX_DAYS - 1))
+        if first > through:
+            return 0, None
+        result = mark_absent_employees(conn, first, through, HR_EMAIL, commit=False)
+        result["first_day"] = first
+        return result["leave_days_added"], result
+
+    result = run_scheduled_job(job_name, through.isoformat(), job)
+    if result is None:
+        return None
+    invalidate_employee_profile(*result["marked_absent"])
+
+    summary = {
+        "date": through.isoformat(),
+        "window_start": (through - timedelta(days=3)).isoformat(),
+        "caught_up_from": result["first_day"].isoformat(),
+        "days_processed": (through - result["first_day"]).days + 1,
+        "employees": result["employees"],
+        "present_today": result["present_today"],
+        "checked_in_within_window": result["checked_in_window"],
+        "marked_absent": len(result["marked_absent"]),
+        "marked_absent_emails": list(result["marked_absent"]),
+        "leave_days_added": result["leave_days_added"],
+    }
+    catch_up = f" (caught up from {summary['caught_up_from']})" if summary["days_processed"] > 1 else ""
+    print(
+        f"Absence check for {summary['date']}{catch_up}: {summary['marked_absent']} marked absent, "
+        f"{summary['leave_days_added']} leave days added, "
+        f"{summary['present_today']} present today, {summary['employees']} employees checked"
     )
-    
-    try:
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        cursor.execute("SELECT * FROM employee_details WHERE email != %s", (HR_EMAIL,))
-        employees = cursor.fetchall()
-        cursor.close()
-        
-        for employee in employees:
-            user_email = employee["email"]
-            if user_email == HR_EMAIL: # Skip HR account
-                continue
-
-            # Check last 3 days for any check-in
-            three_days_ago = today - timedelta(days=3)
-            last_three_days_attendance = fetch_attendance_for_period(user_email, three_days_ago, today)
-            has_checked_in_last_three_days = any(r["action"] == "check-in" for r in last_three_days_attendance)
-
-            if not has_checked_in_last_three_days:
-                # Employee hasn't checked in for 3+ days - mark as absent
-                current_leave = employee.get("total_leave", 0)
-                update_employee_leave(user_email, current_leave + 1)
-                print(f"⚠️ Marked ABSENT for {user_email} - No check-in for 3+ days")
-            else:
-                checked_in_today = any(r["action"] == "check-in" for r in last_three_days_attendance if r["event_time"].date() == today)
-                if checked_in_today:
-                    print(f"✓ {user_email} checked in today - Status: Present")
-                else:
-                    print(f"→ {user_email} has no check-in today, but checked in within last 3 days")
-    finally:
-        conn.close()
+    return summary
 
 
 def send_monthly_report_email_task() -> None:
@@ -174,25 +123,32 @@ def send_monthly_report_email_task() -> None:
 
     print(f"Generating report for: {year}-{month:02d}")
 
-    # 2. Fetch data using the calculated previous month
-    rows = fetch_monthly_attendance_all(year, month)
-    if not rows:
-        print(f"No attendance data for {year}-{month:02d}. Skipping report.")
-        return
-
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(["user_email", "action", "event_time", "latitude", "longitude", "location_text"])
-    for r in rows:
-        writer.writerow([
-            r.get("user_email"),
-            r.get("action"),
-            r.get("event_time").strftime("%Y-%m-%d %H:%M:%S") if r.get("event_time") else "",
-            r.get("latitude"),
-            r.get("longitude"),
-            r.get("location_text"),
-        ])
-    csv_data = output.getvalue().encode("utf-8")
+    # 2. Stream the month's events into a spooled file (kept in memory only while small)
+    with tempfile.SpooledTemporaryFile(max_size=config.EXPORT_SPOOL_MAX_BYTES) as spool:
+        output = io.TextIOWrapper(spool, encoding="utf-8", newline="")
+        writer = csv.writer(output)
+        writer.writerow(["user_email", "action", "event_time", "latitude", "longitude", "location_text"])
+        row_count = 0
+        for r in iter_monthly_attendance_all(year, month):
+            writer.writerow([
+                r.get("user_email"),
+                r.get("action"),
+                r.get("event_time").strftime("%Y-%m-%d %H:%M:%S") if r.get("event_time") else "",
+                r.get("latitude"),
+                r.get("longitude"),
+                r.get("location_text"),
+            ])
+            row_count += 1
+        output.flush()
+        output.detach()
+
+        if not row_count:
+            print(f"No attendance data for {year}-{month:02d}. Skipping report.")
+            return
+
+        # The attachment itself has to be in memory for smtplib
+        spool.seek(0)
+        csv_data = spool.read()
 
     msg = EmailMessage()
     msg["Subject"] = f"Monthly Attendance Report {year}-{month:02d}"
@@ -216,20 +172,3 @@ def send_monthly_report_email_task() -> None:
         print(f"Monthly report for {year}-{month:02d} emailed successfully.")
     except Exception as e:
         print(f"Failed to send monthly report email: {e}")
-
-def reset_monthly_totals():
-    import config
-    conn = psycopg2.connect(
-        host=config.DB_HOST,
-        port=config.DB_PORT,
-        user=config.DB_USER,
-        password=config.DB_PASSWORD,
-        database=config.DB_NAME
-    )
-    try:
-        cursor = conn.cursor()
-        cursor.execute("UPDATE employee_details SET total_working = 0, total_leave = 0")
-        conn.commit()
-    finally:
-        cursor.close()
-        conn.close()
\ No newline at end of file
@@ -0,0 +1,100 @@
+// --- START OF FILE attendance.js ---
+
+// Check-in/check-out without a page reload: the attendance form's fields go to
+// /api/attendance and the page is updated in place. The form stays the fallback:
+// without JavaScript, or when the API cannot answer, it is submitted as before.
+
+function newIdempotencyKey() {
+    if (window.crypto && crypto.randomUUID) {
+        return crypto.randomUUID().replace(/-/g, '');
+    }
+    return Date.now().toString(16) + Math.random().toString(16).slice(2);
+}
+
+function submitAttendance(form) {
+    const field = name => form.querySelector(`[name="${name}"]`);
+    const keyInput = field('idempotency_key');
+    const commentInput = field('comment');
+    const button = form.querySelector('button[type="submit"]');
+    if (button) button.disabled = true;
+
+    fetch('/api/attendance', {
+        method: 'POST',
+        credentials: 'same-origin',
+        headers: {
+            'Content-Type': 'application/json',
+            'Idempotency-Key': keyInput ? keyInput.value : newIdempotencyKey()
+        },
+        body: JSON.stringify({
+            action: field('action').value,
+            latitude: parseFloat(field('latitude').value),
+            longitude: parseFloat(field('longitude').value),
+            comment: commentInput && commentInput.value ? commentInput.value : null
+        })
+    })
+    .then(response => {
+        if (response.status === 401) {
+            window.location.href = '/';
+            return;
+        }
+        if (![200, 400, 409].includes(response.status)) {
+            throw new Error(`HTTP ${response.status}`);
+        }
+        return response.json().then(data => {
+            if (button) button.disabled = false;
+            // Answered: the next click is a new request
+            if (keyInput) keyInput.value = newIdempotencyKey();
+            if (commentInput) commentInput.remove();
+            if (response.status === 200) {
+                showAttendanceStatus('✅ ' + data.message, 'success');
+                updateAttendanceToday(data.today);
+            } else {
+                showAttendanceStatus('⚠️ ' + data.detail, 'error');
+            }
+        });
+    })
+    .catch(error => {
+        // A write the API already made is refused by the once-a-day rule, never repeated
+        console.warn('Attendance API unavailable, submitting the form instead:', error);
+        form.submit();
+    });
+}
+
+function showAttendanceStatus(message, type) {
+    const status = document.getElementById('attendanceStatus');
+    if (!status) return;
+    status.textContent = message;
+    status.style.display = 'block';
+    status.style.backgroundColor = type === 'success' ? '#d5f4e6' : '#fadbd8';
+    status.style.color = type === 'success' ? '#27ae60' : '#c0392b';
+
+    setTimeout(() => {
+        status.style.display = 'none';
+    }, 5000);
+}
+
+function updateAttendanceToday(today) {
+    // Today's row in the report table, if the page has one
+    const table = document.getElementById('attendanceTable');
+    if (table) {
+        let row = Array.from(table.rows).find(r => r.cells.length === 4 && r.cells[0].textContent.trim() === today.day);
+        if (!row) {
+            Array.from(table.rows).filter(r => r.cells.length === 1).forEach(r => r.remove());
+            row = table.insertRow(0);
+            for (let i = 0; i < 4; i++) row.insertCell();
+        }
+        [today.day, today.check_in, today.check_out, today.total_hours].forEach((value, i) => {
+            row.cells[i].textContent = value;
+        });
+    }
+
+    // Each action can be done once per day
+    document.querySelectorAll('form[action="/attendance"]').forEach(form => {
+        const action = form.querySelector('[name="action"]').value;
+        const button = form.querySelector('button[type="submit"]');
+        if (!button) return;
+        if ((action === 'check-in' && today.checked_in) || (action === 'check-out' && today.checked_out)) {
+            button.disabled = true;
+        }
+    });
+}
@@ -67,6 +67,381 @@ def test_database_connection():
         print(f"[FAIL] Unexpected error: {e}")
         return False
 
+def test_concurrent_check_in():
+    """Test that 100 parallel check-ins for one employee and day record exactly one."""
+    print("\nTesting concurrent check-ins...")
+    try:
+        import config
+        import psycopg2
+        import psycopg2.pool
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+        from datetime import datetime
+        import pytz
+        from data import insert_attendance_record, AttendanceConflict
+
+        # A throwaway address (not an employee) keeps the check away from real data
+        email = "concurrency-check@deployment.test"
+        event_time = datetime.now(pytz.UTC)
+
+        # 100 submits race on a few shared connections, well under max_connections
+        max_connections = 10
+        connections = psycopg2.pool.ThreadedConnectionPool(
+            1, max_connections,
+            host=config.DB_HOST,
+            port=config.DB_PORT,
+            user=config.DB_USER,
+            password=config.DB_PASSWORD,
+            database=config.DB_NAME
+        )
+        # getconn() raises instead of waiting when the pool is empty; one connection
+        # is kept for the cleanup and the checks below
+        available = threading.BoundedSemaphore(max_connections - 1)
+
+        def submit(action):
+            with available:
+                conn = connections.getconn()
+                try:
+                    insert_attendance_record(conn, email, action, event_time)
+                    return "recorded"
+                except AttendanceConflict as e:
+                    return e.reason
+                finally:
+                    conn.rollback()
+                    connections.putconn(conn)
+
+        def cleanup(conn):
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM attendance WHERE user_email = %s", (email,))
+            cursor.execute("DELETE FROM daily_attendance WHERE user_email = %s", (email,))
+            conn.commit()
+            cursor.close()
+
+        conn = connections.getconn()
+        cleanup(conn)
+        try:
+            with ThreadPoolExecutor(max_workers=100) as pool:
+                check_ins = list(pool.map(submit, ["check-in"] * 100))
+                check_outs = list(pool.map(submit, ["check-out"] * 100))
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT action, COUNT(*) FROM attendance WHERE user_email = %s GROUP BY action", (email,)
+            )
+            stored = dict(cursor.fetchall())
+            cursor.close()
+        finally:
+            cleanup(conn)
+            connections.closeall()
+
+        if (check_ins.count("recorded") == 1 and check_outs.count("recorded") == 1
+                and stored == {"check-in": 1, "check-out": 1}):
+            print("[OK] 100 parallel check-ins and check-outs recorded once each")
+            return True
+        print(f"[FAIL] Duplicate attendance recorded: {stored}")
+        return False
+    except psycopg2.Error as e:
+        print(f"[FAIL] Concurrent check-in test could not run: {e}")
+        return False
+    except Exception as e:
+        print(f"[FAIL] Unexpected error: {e}")
+        return False
+
+def test_idempotency_keys():
+    """Test claiming, replaying, mismatching, expiring and releasing idempotency keys."""
+    print("\nTesting idempotency keys...")
+    try:
+        import config
+        import psycopg2
+        from data import (
+            claim_idempotency_key, complete_idempotency_key, release_idempotency_key, fetch_idempotency_key
+        )
+
+        # A throwaway address (not an employee) keeps the check away from real data
+        email = "idempotency-check@deployment.test"
+        endpoint = "/deployment-test"
+        conn = psycopg2.connect(
+            host=config.DB_HOST,
+            port=config.DB_PORT,
+            user=config.DB_USER,
+            password=config.DB_PASSWORD,
+            database=config.DB_NAME
+        )
+
+        def cleanup():
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM idempotency_keys WHERE user_email = %s", (email,))
+            conn.commit()
+            cursor.close()
+
+        def claim(key, request_hash="a" * 64):
+            return claim_idempotency_key(conn, email, endpoint, key, request_hash)
+
+        failures = []
+        cleanup()
+        try:
+            if claim("k1") is not None:
+                failures.append("a new key was not claimed")
+            in_progress = claim("k1")
+            if not in_progress or in_progress["status_code"] is not None:
+                failures.append("a second claim did not see the first still in progress")
+
+            complete_idempotency_key(conn, email, endpoint, "k1", 303, {"location": "/report"}, b"")
+            replay = claim("k1")
+            if not replay or replay["status_code"] != 303 or replay["headers"] != {"location": "/report"}:
+                failures.append(f"a completed key did not replay its response: {replay}")
+            mismatch = claim("k1", "b" * 64)
+            if not mismatch or mismatch["request_hash"] != "a" * 64:
+                failures.append("a reused key did not return the original request hash")
+
+            cursor = conn.cursor()
+            cursor.execute(
+                """UPDATE idempotency_keys SET expires_at = CURRENT_TIMESTAMP - INTERVAL '1 second'
+                   WHERE user_email = %s AND idempotency_key = 'k1'""",
+                (email,)
+            )
+            conn.commit()
+            cursor.close()
+            if fetch_idempotency_key(conn, email, endpoint, "k1") is not None:
+                failures.append("an expired key was still returned")
+            if claim("k1") is not None:
+                failures.append("an expired key was not claimed again")
+
+            claim("k2")
+            release_idempotency_key(conn, email, endpoint, "k2")
+            if fetch_idempotency_key(conn, email, endpoint, "k2") is not None or claim("k2") is not None:
+                failures.append("a released key was not claimable again")
+            complete_idempotency_key(conn, email, endpoint, "k2", 200, {}, b"{}")
+            release_idempotency_key(conn, email, endpoint, "k2")
+            if claim("k2") is None:
+                failures.append("releasing a completed key dropped its stored outcome")
+        finally:
+            cleanup()
+            conn.close()
+
+        if not failures:
+            print("[OK] Idempotency keys claim, replay, reject mismatches, expire and release")
+            return True
+        for failure in failures:
+            print(f"[FAIL] Idempotency keys: {failure}")
+        return False
+    except psycopg2.Error as e:
+        print(f"[FAIL] Idempotency key test could not run: {e}")
+        return False
+    except Exception as e:
+        print(f"[FAIL] Unexpected error: {e}")
+        return False
+
+def test_attendance_api():
+    """Test the JSON check-in API's 200, 400, 409 and 401 answers."""
+    print("\nTesting JSON check-in API...")
+    try:
+        import config
+        import psycopg2
+        from datetime import datetime
+        import pytz
+        from fastapi.testclient import TestClient
+        import app as app_module
+        from employees import users as static_users
+
+        # A throwaway employee (allowed to log in only for this test)
+        email = "api-check@deployment.test"
+        password = "deployment-test"
+        office = {"latitude": config.OFFICE_LAT, "longitude": config.OFFICE_LON}
+        conn = psycopg2.connect(
+            host=config.DB_HOST,
+            port=config.DB_PORT,
+            user=config.DB_USER,
+            password=config.DB_PASSWORD,
+            database=config.DB_NAME
+        )
+
+        def cleanup():
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM attendance WHERE user_email = %s", (email,))
+            cursor.execute("DELETE FROM daily_attendance WHERE user_email = %s", (email,))
+            cursor.execute("DELETE FROM employee_details WHERE email = %s", (email,))
+            conn.commit()
+            cursor.close()
+
+        cleanup()
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO employee_details (name, email, password) VALUES (%s, %s, %s)",
+            ("API Check", email, password)
+        )
+        conn.commit()
+        cursor.close()
+        static_users[email] = {"name": "API Check", "password": password}
+        get_ist_now = app_module.get_ist_now
+        # Inside the morning check-in window, whatever the time of the run
+        app_module.get_ist_now = lambda: datetime.now(pytz.timezone("Asia/Kolkata")).replace(
+            hour=config.CHECKIN_MORNING_START.hour, minute=config.CHECKIN_MORNING_START.minute
+        )
+        try:
+            anonymous = TestClient(app_module.app)
+            unauthorized = anonymous.post("/api/attendance", json={"action": "check-in", **office})
+
+            client = TestClient(app_module.app)
+            client.post("/", data={"email": email, "password": password}, follow_redirects=False)
+            away = client.post("/api/attendance", json={"action": "check-in", "latitude": 0.0, "longitude": 0.0})
+            checked_in = client.post("/api/attendance", json={"action": "check-in", **office})
+            again = client.post("/api/attendance", json={"action": "check-in", **office})
+        finally:
+            app_module.get_ist_now = get_ist_now
+            static_users.pop(email, None)
+            cleanup()
+            conn.close()
+
+        answers = {
+            "200": checked_in.status_code == 200 and checked_in.json()["today"]["next_action"] == "check-out",
+            "400": away.status_code == 400,
+            "409": again.status_code == 409,
+            "401": unauthorized.status_code == 401,
+        }
+        if all(answers.values()):
+            print("[OK] /api/attendance answers 200, 400, 409 and 401")
+            return True
+        print(f"[FAIL] /api/attendance answered {checked_in.status_code}, {away.status_code}, "
+              f"{again.status_code}, {unauthorized.status_code} (expected 200, 400, 409, 401)")
+        return False
+    except psycopg2.Error as e:
+        print(f"[FAIL] JSON check-in API test could not run: {e}")
+        return False
+    except Exception as e:
+        print(f"[FAIL] Unexpected error: {e}")
+        return False
+
+def test_offline_sync():
+    """Test offline sync: device keys, signatures, duplicates, revocation and leave reversal."""
+    print("\nTesting offline check-in sync...")
+    try:
+        import config
+        import hashlib
+        import hmac
+        import psycopg2
+        from datetime import datetime, timedelta
+        import pytz
+        from fastapi.testclient import TestClient
+        import app as app_module
+        from data import record_offline_attendance, get_attendance_period_dates
+        from employees import users as static_users
+
+        # A throwaway employee (allowed to log in only for this test)
+        email = "offline-check@deployment.test"
+        password = "deployment-test"
+        ist = pytz.timezone("Asia/Kolkata")
+        yesterday = datetime.now(ist).date() - timedelta(days=1)
+        conn = psycopg2.connect(
+            host=config.DB_HOST,
+            port=config.DB_PORT,
+            user=config.DB_USER,
+            password=config.DB_PASSWORD,
+            database=config.DB_NAME
+        )
+
+        def execute(query, params=()):
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            row = cursor.fetchone() if cursor.description else None
+            conn.commit()
+            cursor.close()
+            return row
+
+        def cleanup():
+            execute("DELETE FROM attendance WHERE user_email = %s", (email,))
+            execute("DELETE FROM daily_attendance WHERE user_email = %s", (email,))
+            execute("DELETE FROM employee_details WHERE email = %s", (email,))
+
+        def event(event_id, day, key, action="check-in"):
+            captured_at = ist.localize(datetime.combine(day, config.CHECKIN_MORNING_START)).isoformat()
+            latitude, longitude = config.OFFICE_LAT, config.OFFICE_LON
+            message = f"{event_id}|{action}|{captured_at}|{latitude:.6f}|{longitude:.6f}"
+            return {
+                "event_id": event_id, "action": action, "captured_at": captured_at,
+                "latitude": latitude, "longitude": longitude,
+                "signature": hmac.new(key.encode(), message.encode(), hashlib.sha256).hexdigest(),
+            }
+
+        failures = []
+        cleanup()
+        execute("INSERT INTO employee_details (name, email, password) VALUES (%s, %s, %s)",
+                ("Offline Check", email, password))
+        static_users[email] = {"name": "Offline Check", "password": password}
+        try:
+            anonymous = TestClient(app_module.app)
+            if anonymous.post("/api/attendance/offline-devices", json={}).status_code != 401:
+                failures.append("registering a device without a session was not refused")
+
+            client = TestClient(app_module.app)
+            client.post("/", data={"email": email, "password": password}, follow_redirects=False)
+            device = client.post("/api/attendance/offline-devices", json={"label": "deployment test"}).json()
+            key, device_id = device["key"], device["device_id"]
+            # Pretend the device was registered before it went offline three days ago
+            execute("UPDATE offline_devices SET created_at = created_at - INTERVAL '3 days' WHERE device_id = %s",
+                    (device_id,))
+
+            # The absence job counted two_days_ago as leave; three days ago was never marked
+            two_days_ago = yesterday - timedelta(days=1)
+            period_start, period_end = get_attendance_period_dates(two_days_ago)
+            execute(
+                """INSERT INTO attendance_period_ledger (user_email, period_start, period_end, leave_days)
+                   VALUES (%s, %s, %s, 1)""",
+                (email, period_start, period_end)
+            )
+            execute(
+                """INSERT INTO absence_marks (user_email, work_date, period_start, lookback_days)
+                   VALUES (%s, %s, %s, 3)""",
+                (email, two_days_ago, period_start)
+            )
+
+            def sync_directly(event_id, day):
+                offline = event(event_id, day, key)
+                return record_offline_attendance(conn, email, device_id, [{
+                    "event_id": offline["event_id"], "action": "check-in", "latitude": offline["latitude"],
+                    "longitude": offline["longitude"], "event_time": datetime.fromisoformat(offline["captured_at"]),
+                }])[0]["leave_days_reversed"]
+
+            reversed_days = sync_directly("offline-1", two_days_ago)
+            unmarked_days = sync_directly("offline-0", two_days_ago - timedelta(days=1))
+            leave_days = execute(
+                "SELECT leave_days FROM attendance_period_ledger WHERE user_email = %s AND period_start = %s",
+                (email, period_start)
+            )[0]
+            if reversed_days != 1 or unmarked_days != 0 or leave_days != 0:
+                failures.append(f"leave was not taken back for exactly the marked day "
+                                f"({reversed_days}, {unmarked_days}, {leave_days})")
+
+            forged = event("offline-3", yesterday, "0" * 64)
+            batch = {"device_id": device_id, "events": [event("offline-2", yesterday, key), forged]}
+            first = client.post("/api/attendance/offline-sync", json=batch).json()
+            if [r["status"] for r in first["results"]] != ["accepted", "rejected"]:
+                failures.append(f"a signed and a forged event were not accepted and rejected: {first['results']}")
+            again = client.post("/api/attendance/offline-sync", json=batch).json()
+            if again["results"][0]["status"] != "duplicate":
+                failures.append("a re-uploaded event was not reported as a duplicate")
+
+            client.delete(f"/api/attendance/offline-devices/{device_id}")
+            if client.post("/api/attendance/offline-sync", json=batch).status_code != 403:
+                failures.append("a revoked device could still sync")
+        finally:
+            static_users.pop(email, None)
+            cleanup()
+            conn.close()
+
+        if not failures:
+            print("[OK] Offline sync accepts signed events once, refuses forged ones and revoked devices, "
+                  "and reverses leave")
+            return True
+        for failure in failures:
+            print(f"[FAIL] Offline sync: {failure}")
+        return False
+    except psycopg2.Error as e:
+        print(f"[FAIL] Offline sync test could not run: {e}")
+        return False
+    except Exception as e:
+        print(f"[FAIL] Unexpected error: {e}")
+        return False
+
 def test_static_files():
     """Test if static files directory exists."""
     print("\nTesting static files...")
@@ -107,6 +482,10 @@ def main():
     results.append(("Imports", test_imports()))
     results.append(("Configuration", test_config()))
     results.append(("Database Connection", test_database_connection()))
+    results.append(("Concurrent Check-ins", test_concurrent_check_in()))
+    results.append(("Idempotency Keys", test_idempotency_keys()))
+    results.append(("JSON Check-in API", test_attendance_api()))
+    results.append(("Offline Sync", test_offline_sync()))
     results.append(("Static Files", test_static_files()))
     results.append(("Templates", test_templates()))
     results.append(("Environment File", test_env_file()))